@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""Measures how long importing the server extension adds to server start.
+
+Runs a fresh interpreter with `python -X importtime`, first importing the
+modules the notebook server has already loaded by the time it loads
+extensions, so only the extension's own cost is counted.
+
+  python benchmarks/import_time.py --budget-ms 50
+
+Exits with status 1 when the import takes longer than the budget, or when a
+module that should only load on first use was imported.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+PACKAGE = 'jupyterlab_gcsfilebrowser'
+# Loaded by the notebook server before it loads extensions.
+SERVER_MODULES = (
+  'notebook.base.handlers',
+  'notebook.utils',
+  'jupyter_core.paths',
+  'traitlets',
+)
+# Must not be imported until the first request that needs them.
+DEFERRED_MODULES = (
+  'google.cloud.storage',
+  'nbformat',
+  'jupyterlab_gcsfilebrowser.handlers',
+)
+
+
+def import_times(repeat):
+  """Returns the best of repeat runs as a list of (module, self_us, cum_us).
+
+  Modules are listed in the order -X importtime reports them: each after the
+  modules it imported, with its name indented by its nesting depth.
+  """
+  root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+  code = 'import %s; import %s' % (', '.join(SERVER_MODULES), PACKAGE)
+  best = None
+  for _ in range(repeat):
+    result = subprocess.run(
+      [sys.executable, '-X', 'importtime', '-c', code],
+      cwd=root, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    times = []
+    for line in result.stderr.splitlines():
+      if not line.startswith('import time:') or 'self [us]' in line:
+        continue
+      self_us, cumulative_us, name = line[len('import time:'):].split('|')
+      times.append((name.rstrip()[1:], int(self_us), int(cumulative_us)))
+    if best is None or package_time(times) < package_time(best):
+      best = times
+  return best
+
+
+def package_time(times):
+  return [c for n, _, c in times if n == PACKAGE][0]
+
+
+def package_modules(times):
+  """The (self_us, module) of the modules imported by the package."""
+  index = [n for n, _, _ in times].index(PACKAGE)
+  modules = []
+  for name, self_us, _ in reversed(times[:index]):
+    if not name.startswith(' '):
+      break
+    modules.append((self_us, name.strip()))
+  return modules
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--budget-ms', type=float, default=50,
+                      help='Fail above this many milliseconds.')
+  parser.add_argument('--repeat', type=int, default=5,
+                      help='Take the best of this many runs.')
+  args = parser.parse_args()
+
+  times = import_times(args.repeat)
+  names = set(n.strip() for n, _, _ in times)
+  total_ms = package_time(times) / 1000.0
+
+  print('%s import: %.1f ms (budget %.1f ms)' % (
+    PACKAGE, total_ms, args.budget_ms))
+  print('Slowest modules imported by the extension:')
+  for self_us, name in sorted(package_modules(times), reverse=True)[:10]:
+    print('  %8.1f ms  %s' % (self_us / 1000.0, name))
+
+  deferred = [m for m in DEFERRED_MODULES if m in names]
+  if deferred:
+    print('Imported at load instead of on first use: %s' % ', '.join(deferred))
+  if deferred or total_ms > args.budget_ms:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
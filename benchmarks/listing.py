@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Measures how fast a directory listing is turned into a response.
+
+Builds a listing of fake blobs below one directory, half of them directly
+inside it and half spread over subdirectories, then times list_dir and the
+JSON encoding of its result separately.
+
+  python benchmarks/listing.py --objects 1000000
+
+Reports items per second for each stage. The encoding is timed with both the
+standard json module and orjson, when orjson is installed.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(
+  0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jupyterlab_gcsfilebrowser import handlers  # pylint: disable=g-import-not-at-top
+
+BUCKET = 'bucket'
+DIRECTORY = 'data/run-1'
+
+
+class ListedBlob(object):
+  """The parts of a listed Blob read by list_dir, without its overhead."""
+  __slots__ = ('name', '_properties')
+
+  def __init__(self, name, updated):
+    self.name = name
+    self._properties = {'updated': updated}
+
+  @property
+  def updated(self):
+    raise AssertionError('Listed timestamps should not be parsed')
+
+
+def make_listing(objects, subdirectories):
+  blobs = []
+  for i in range(objects):
+    updated = '2020-01-%02dT%02d:%02d:%02d.%03dZ' % (
+      1 + i % 28, i % 24, i % 60, i % 59, i % 1000)
+    if i % 2:
+      name = '%s/part-%08d.csv' % (DIRECTORY, i)
+    else:
+      name = '%s/shard-%05d/part-%08d.csv' % (
+        DIRECTORY, i % subdirectories, i)
+    blobs.append(ListedBlob(name, updated))
+  blobs.sort(key=lambda b: b.name)
+  return blobs
+
+
+def best_time(repeat, fn, *args):
+  best = None
+  result = None
+  for _ in range(repeat):
+    start = time.perf_counter()
+    result = fn(*args)
+    elapsed = time.perf_counter() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best, result
+
+
+def report(stage, count, seconds):
+  print('%-16s %9.3f s  %12.0f items/s' % (stage, seconds, count / seconds))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--objects', type=int, default=1000000,
+                      help='Objects listed below the directory.')
+  parser.add_argument('--subdirectories', type=int, default=1000,
+                      help='Subdirectories the objects are spread over.')
+  parser.add_argument('--repeat', type=int, default=3,
+                      help='Take the best of this many runs.')
+  args = parser.parse_args()
+
+  blobs = make_listing(args.objects, args.subdirectories)
+  print('%d objects listed, %d subdirectories' % (
+    args.objects, args.subdirectories))
+
+  seconds, contents = best_time(
+    args.repeat, handlers.list_dir, BUCKET, DIRECTORY, blobs)
+  report('list_dir', len(blobs), seconds)
+
+  response = {'type': 'directory', 'content': contents}
+  seconds, _ = best_time(args.repeat, json.dumps, response)
+  report('json.dumps', len(contents), seconds)
+  if handlers.orjson is not None:
+    seconds, _ = best_time(args.repeat, handlers.dumps, response)
+    report('orjson.dumps', len(contents), seconds)
+  else:
+    print('orjson is not installed')
+
+
+if __name__ == '__main__':
+  main()
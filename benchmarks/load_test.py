@@ -0,0 +1,652 @@
+#!/usr/bin/env python
+"""Load test of the server extension's REST endpoints against a fake GCS.
+
+Serves the extension's handlers from a Tornado app and points their storage
+client at an in-process fake of the GCS JSON API. The fake can add latency
+to every request and throttle requests with HTTP 429. Simulated users do what
+the file browser does: browse directories, open a notebook, autosave it,
+checkpoint it, and create, copy, move and delete scratch files.
+
+  python benchmarks/load_test.py --users 50 --duration 60 --latency-ms 30
+
+Reports p50 and p99 latency per operation, throughput, the lag of the
+server's event loop and the peak RSS of the process, which includes the fake
+GCS and the simulated users.
+"""
+
+import argparse
+import asyncio
+import base64
+import bisect
+import collections
+import hashlib
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import google_crc32c
+
+sys.path.insert(
+  0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=g-import-not-at-top
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import storage
+from notebook.utils import url_path_join
+from requests.adapters import HTTPAdapter
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.testing import bind_unused_port
+from tornado.web import Application
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+from jupyterlab_gcsfilebrowser.usage import UsageCache
+# pylint: enable=g-import-not-at-top
+
+BUCKET = 'load-test'
+ENDPOINT = '/gcp/v1/gcs'
+# Interval of the probe that measures the lag of the server's event loop.
+LAG_PROBE_INTERVAL = 0.01
+
+
+class FakeObject(object):
+
+  def __init__(self, bucket, name, data, generation, content_type):
+    self.bucket = bucket
+    self.name = name
+    self.data = data
+    self.generation = generation
+    self.content_type = content_type
+    self.updated = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+    self.crc32c = base64.b64encode(
+      google_crc32c.Checksum(data).digest()).decode('ascii')
+    self.md5 = base64.b64encode(hashlib.md5(data).digest()).decode('ascii')
+
+  def resource(self):
+    return {
+      'kind': 'storage#object',
+      'id': '%s/%s/%d' % (self.bucket, self.name, self.generation),
+      'bucket': self.bucket,
+      'name': self.name,
+      'generation': str(self.generation),
+      'metageneration': '1',
+      'contentType': self.content_type,
+      'size': str(len(self.data)),
+      'timeCreated': self.updated,
+      'updated': self.updated,
+      'crc32c': self.crc32c,
+      'md5Hash': self.md5,
+    }
+
+
+class FakeGCSError(Exception):
+
+  def __init__(self, code, reason, message):
+    super(FakeGCSError, self).__init__(message)
+    self.code = code
+    self.reason = reason
+
+
+class FakeGCS(object):
+  """An in-memory GCS JSON API, served over HTTP from a thread.
+
+  Supports what the handlers use for single objects: listings, metadata,
+  media downloads with ranges, multipart and resumable uploads, deletes,
+  rewrites and composes, with generation preconditions.
+  """
+
+  def __init__(self, latency=0.0, max_qps=0, throttle_rate=0.0):
+    self.latency = latency
+    self.max_qps = max_qps
+    self.throttle_rate = throttle_rate
+    self.requests = 0
+    self.throttled = 0
+    self._lock = threading.Lock()
+    self._buckets = collections.defaultdict(dict)
+    self._sorted = {}
+    self._generation = 1600000000000000
+    self._tokens = float(max_qps)
+    self._refilled = time.monotonic()
+    self._server = None
+    # Resumable uploads in progress, by upload ID.
+    self.uploads = {}
+
+  def start(self):
+    """Serve the API on a local port. Returns its base URL."""
+    self._server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGCSHandler)
+    self._server.daemon_threads = True
+    self._server.gcs = self
+    threading.Thread(target=self._server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%d' % self._server.server_address[1]
+
+  def stop(self):
+    self._server.shutdown()
+
+  def put(self, bucket, name, data, content_type='application/octet-stream',
+          if_generation_match=None):
+    with self._lock:
+      objects = self._buckets[bucket]
+      self._check_generation(objects.get(name), if_generation_match)
+      self._generation += 1
+      obj = FakeObject(bucket, name, data, self._generation, content_type)
+      if name not in objects:
+        self._sorted.pop(bucket, None)
+      objects[name] = obj
+      return obj
+
+  def get(self, bucket, name):
+    with self._lock:
+      obj = self._buckets[bucket].get(name)
+    if obj is None:
+      raise FakeGCSError(404, 'notFound', 'No such object: %s' % name)
+    return obj
+
+  def delete(self, bucket, name, if_generation_match=None):
+    with self._lock:
+      objects = self._buckets[bucket]
+      if name not in objects:
+        raise FakeGCSError(404, 'notFound', 'No such object: %s' % name)
+      self._check_generation(objects[name], if_generation_match)
+      del objects[name]
+      self._sorted.pop(bucket, None)
+
+  @staticmethod
+  def _check_generation(obj, if_generation_match):
+    if if_generation_match is None:
+      return
+    generation = obj.generation if obj is not None else 0
+    if generation != int(if_generation_match):
+      raise FakeGCSError(412, 'conditionNotMet', 'Precondition failed')
+
+  def list(self, bucket, prefix='', delimiter=None, start_offset=None,
+           end_offset=None, page_token=None, max_results=1000):
+    with self._lock:
+      names = self._sorted.get(bucket)
+      if names is None:
+        names = self._sorted[bucket] = sorted(self._buckets[bucket])
+      objects = self._buckets[bucket]
+
+      index = bisect.bisect_left(
+        names, max(prefix, start_offset or '', page_token or ''))
+      items, prefixes = [], []
+      while index < len(names) and len(items) + len(prefixes) < max_results:
+        name = names[index]
+        if not name.startswith(prefix) or (end_offset and name >= end_offset):
+          return items, prefixes, None
+        rest = name[len(prefix):]
+        if delimiter and delimiter in rest:
+          sub_prefix = prefix + rest.split(delimiter, 1)[0] + delimiter
+          prefixes.append(sub_prefix)
+          # Skip everything below the sub-prefix.
+          index = bisect.bisect_left(
+            names, sub_prefix[:-1] + chr(ord(sub_prefix[-1]) + 1))
+        else:
+          items.append(objects[name].resource())
+          index += 1
+      next_token = None
+      if (index < len(names) and names[index].startswith(prefix)
+          and not (end_offset and names[index] >= end_offset)):
+        next_token = names[index]
+      return items, prefixes, next_token
+
+  def admit(self):
+    """Count a request. Returns False if it is throttled."""
+    with self._lock:
+      self.requests += 1
+      throttled = random.random() < self.throttle_rate
+      if self.max_qps:
+        now = time.monotonic()
+        self._tokens = min(float(self.max_qps), self._tokens + (
+          now - self._refilled) * self.max_qps)
+        self._refilled = now
+        if self._tokens < 1:
+          throttled = True
+        else:
+          self._tokens -= 1
+      if throttled:
+        self.throttled += 1
+      return not throttled
+
+
+class FakeGCSHandler(BaseHTTPRequestHandler):
+  """Routes requests of the GCS JSON API to the FakeGCS of the server."""
+  protocol_version = 'HTTP/1.1'
+  # Headers and body are written separately, which Nagle's algorithm would
+  # delay on keep-alive connections.
+  disable_nagle_algorithm = True
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    self._dispatch('GET')
+
+  def do_POST(self):
+    self._dispatch('POST')
+
+  def do_DELETE(self):
+    self._dispatch('DELETE')
+
+  def do_PATCH(self):
+    self._dispatch('PATCH')
+
+  def do_PUT(self):
+    self._dispatch('PUT')
+
+  def _dispatch(self, method):
+    gcs = self.server.gcs
+    url = urllib.parse.urlsplit(self.path)
+    self.query = {k: v[-1] for k, v in urllib.parse.parse_qs(url.query).items()}
+    parts = [urllib.parse.unquote(p) for p in url.path.split('/')[1:]]
+    body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    if gcs.latency:
+      time.sleep(gcs.latency * random.uniform(0.5, 1.5))
+    try:
+      if not gcs.admit():
+        raise FakeGCSError(429, 'rateLimitExceeded', 'Too many requests')
+      self._route(gcs, method, parts, body)
+    except FakeGCSError as e:
+      self._send_json({'error': {
+        'code': e.code, 'message': str(e),
+        'errors': [{'reason': e.reason, 'message': str(e)}],
+      }}, e.code)
+
+  def _route(self, gcs, method, parts, body):
+    if parts[:1] == ['download']:
+      parts = parts[1:]
+      self.query['alt'] = 'media'
+    if parts[:1] == ['upload'] and method == 'POST':
+      return self._upload(gcs, parts[4], body)
+    if parts[:1] == ['upload'] and method == 'PUT':
+      return self._upload_chunk(gcs, body)
+    if parts[:3] != ['storage', 'v1', 'b']:
+      raise FakeGCSError(501, 'notImplemented', 'Not supported by the fake')
+    parts = parts[3:]
+
+    if not parts:
+      return self._send_json({'items': [
+        {'kind': 'storage#bucket', 'name': BUCKET,
+         'timeCreated': '2020-01-01T00:00:00.000Z'}]})
+    bucket = parts[0]
+    if len(parts) == 1:
+      return self._send_json({'kind': 'storage#bucket', 'name': bucket})
+    if len(parts) == 2:
+      items, prefixes, token = gcs.list(
+        bucket, self.query.get('prefix', ''), self.query.get('delimiter'),
+        self.query.get('startOffset'), self.query.get('endOffset'),
+        self.query.get('pageToken'), int(self.query.get('maxResults', 1000)))
+      response = {'kind': 'storage#objects', 'items': items,
+                  'prefixes': prefixes}
+      if token:
+        response['nextPageToken'] = token
+      return self._send_json(response)
+
+    name = parts[2]
+    if len(parts) == 3 and method == 'GET':
+      obj = gcs.get(bucket, name)
+      if self.query.get('alt') == 'media':
+        return self._send_media(obj)
+      return self._send_json(obj.resource())
+    if len(parts) == 3 and method == 'PATCH':
+      return self._send_json(gcs.get(bucket, name).resource())
+    if len(parts) == 3 and method == 'DELETE':
+      gcs.delete(bucket, name, self.query.get('ifGenerationMatch'))
+      return self._send(204, b'')
+    if len(parts) == 8 and parts[3] == 'rewriteTo':
+      source = gcs.get(bucket, name)
+      if self.query.get('ifSourceGenerationMatch') not in (
+          None, str(source.generation)):
+        raise FakeGCSError(412, 'conditionNotMet', 'Precondition failed')
+      obj = gcs.put(parts[5], parts[7], source.data, source.content_type,
+                    self.query.get('ifGenerationMatch'))
+      return self._send_json({
+        'kind': 'storage#rewriteResponse', 'done': True,
+        'totalBytesRewritten': str(len(obj.data)),
+        'objectSize': str(len(obj.data)), 'resource': obj.resource()})
+    if len(parts) == 4 and parts[3] == 'compose':
+      request = json.loads(body)
+      data = b''.join(gcs.get(bucket, s['name']).data
+                      for s in request['sourceObjects'])
+      obj = gcs.put(bucket, name, data,
+                    request.get('destination', {}).get(
+                      'contentType', 'application/octet-stream'),
+                    self.query.get('ifGenerationMatch'))
+      return self._send_json(obj.resource())
+    raise FakeGCSError(501, 'notImplemented', 'Not supported by the fake')
+
+  def _upload(self, gcs, bucket, body):
+    if self.query.get('uploadType') == 'resumable':
+      metadata = json.loads(body or b'{}')
+      upload_id = '%x' % random.getrandbits(64)
+      gcs.uploads[upload_id] = (
+        bucket, metadata.get('name') or self.query['name'],
+        metadata.get('contentType', 'application/octet-stream'),
+        self.query.get('ifGenerationMatch'), bytearray())
+      return self._send(200, b'', {'Location': '%s&upload_id=%s' % (
+        'http://%s:%d%s' % (self.server.server_address + (self.path,)),
+        upload_id)})
+    boundary = self.headers['Content-Type'].split('boundary=')[1].strip('"')
+    metadata_part, data_part = body.split(
+      b'--' + boundary.encode('ascii'))[1:3]
+    metadata = json.loads(metadata_part.split(b'\r\n\r\n', 1)[1])
+    data_headers, data = data_part.split(b'\r\n\r\n', 1)
+    content_type = 'application/octet-stream'
+    for line in data_headers.decode('ascii').split('\r\n'):
+      if line.lower().startswith('content-type:'):
+        content_type = line.split(':', 1)[1].strip()
+    obj = gcs.put(bucket, metadata.get('name') or self.query['name'],
+                  data[:-2], metadata.get('contentType', content_type),
+                  self.query.get('ifGenerationMatch'))
+    self._send_json(obj.resource())
+
+  def _upload_chunk(self, gcs, body):
+    upload_id = self.query['upload_id']
+    bucket, name, content_type, if_generation_match, data = gcs.uploads[
+      upload_id]
+    data.extend(body)
+    total = self.headers.get('Content-Range', '').rsplit('/', 1)[-1]
+    if total == '*' or len(data) < int(total):
+      return self._send(308, b'', {'Range': 'bytes=0-%d' % (len(data) - 1)})
+    del gcs.uploads[upload_id]
+    obj = gcs.put(bucket, name, bytes(data), content_type, if_generation_match)
+    self._send_json(obj.resource())
+
+  def _send_media(self, obj):
+    data = obj.data
+    headers = {'Content-Type': obj.content_type,
+               'X-Goog-Generation': str(obj.generation)}
+    status = 200
+    byte_range = self.headers.get('Range')
+    if byte_range:
+      start, end = byte_range.split('=', 1)[1].split('-')
+      start, end = int(start), min(int(end or len(data) - 1), len(data) - 1)
+      headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, len(data))
+      data = data[start:end + 1]
+      status = 206
+    else:
+      headers['X-Goog-Hash'] = 'crc32c=%s,md5=%s' % (obj.crc32c, obj.md5)
+    self._send(status, data, headers)
+
+  def _send_json(self, value, status=200):
+    self._send(status, json.dumps(value).encode('utf-8'),
+               {'Content-Type': 'application/json; charset=UTF-8'})
+
+  def _send(self, status, data, headers=None):
+    self.send_response(status)
+    for key, value in (headers or {}).items():
+      self.send_header(key, value)
+    self.send_header('Content-Length', str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+
+def make_notebook(size, revision=0):
+  """A notebook of about size bytes, with code cells and stream outputs."""
+  cells = []
+  cell_text = 'x = %d\n' % revision + '# ' + 'padding ' * 60 + '\n'
+  output_text = 'result ' * 70 + '\n'
+  while len(cells) * (len(cell_text) + len(output_text) + 300) < size:
+    cells.append({
+      'cell_type': 'code',
+      'execution_count': len(cells) + 1,
+      'metadata': {},
+      'source': cell_text,
+      'outputs': [{'output_type': 'stream', 'name': 'stdout',
+                   'text': output_text}],
+    })
+  return {'cells': cells, 'metadata': {}, 'nbformat': 4, 'nbformat_minor': 4}
+
+
+def make_app(args):
+  settings = {
+    'base_url': '/',
+    'gcs_single_flight': SingleFlight(args.request_workers),
+    'gcs_usage_cache': UsageCache(300),
+  }
+  return Application([
+    (url_path_join(ENDPOINT, 'files') + '(.*)', handlers.GCSHandler),
+    (url_path_join(ENDPOINT, 'upload') + '(.*)', handlers.UploadHandler),
+    (url_path_join(ENDPOINT, 'delete') + '(.*)', handlers.DeleteHandler),
+    (url_path_join(ENDPOINT, 'move') + '(.*)', handlers.MoveHandler),
+    (url_path_join(ENDPOINT, 'copy') + '(.*)', handlers.CopyHandler),
+    (url_path_join(ENDPOINT, 'new') + '(.*)', handlers.NewHandler),
+    (url_path_join(ENDPOINT, 'checkpoint') + '(.*)',
+     handlers.CheckpointHandler),
+  ], **settings)
+
+
+class ServerThread(threading.Thread):
+  """Runs the extension's app on its own event loop, probing the loop's lag."""
+
+  def __init__(self, app):
+    super(ServerThread, self).__init__(daemon=True)
+    self.app = app
+    self.lags = []
+    self.port = None
+    self.loop = None
+    self._ready = threading.Event()
+
+  def run(self):
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    self.loop = IOLoop.current()
+    sock, self.port = bind_unused_port()
+    HTTPServer(self.app).add_sockets([sock])
+    self.loop.add_callback(self._probe, self.loop.time())
+    self._ready.set()
+    self.loop.start()
+
+  def _probe(self, scheduled):
+    now = self.loop.time()
+    self.lags.append(now - scheduled)
+    self.loop.call_at(now + LAG_PROBE_INTERVAL, self._probe,
+                      now + LAG_PROBE_INTERVAL)
+
+  def start_and_wait(self):
+    self.start()
+    self._ready.wait()
+    return 'http://127.0.0.1:%d%s' % (self.port, ENDPOINT)
+
+  def stop(self):
+    self.loop.add_callback(self.loop.stop)
+
+
+class User(object):
+  """One simulated user of the file browser."""
+
+  def __init__(self, index, base_url, http, stats, args):
+    self.base_url = base_url
+    self.http = http
+    self.stats = stats
+    self.args = args
+    self.directory = '%s/user-%03d' % (BUCKET, index)
+    self.notebook_path = '%s/notebook.ipynb' % self.directory
+    self.revision = 0
+
+  async def request(self, operation, method, path, body=None):
+    start = time.monotonic()
+    response = await self.http.fetch(
+      self.base_url + urllib.parse.quote(path), method=method,
+      body=None if body is None else json.dumps(body),
+      allow_nonstandard_methods=True, raise_error=False,
+      request_timeout=600)
+    self.stats.record(operation, time.monotonic() - start, response)
+    return json.loads(response.body) if response.code == 200 else None
+
+  async def think(self):
+    if self.args.think_ms:
+      await asyncio.sleep(random.uniform(0, 2 * self.args.think_ms) / 1000.0)
+
+  async def session(self):
+    await self.request('browse', 'GET', '/files/%s/' % self.directory)
+    await self.request('browse', 'GET', '/files/%s/shared/' % BUCKET)
+    await self.think()
+
+    model = await self.request('open', 'GET', '/files/' + self.notebook_path)
+    generation = model and model['content'].get('generation')
+    await self.request('checkpoint', 'POST', '/checkpoint/', {
+      'action': 'listCheckpoints', 'localPath': self.notebook_path})
+
+    for _ in range(self.args.saves):
+      await self.think()
+      self.revision += 1
+      saved = await self.request('save', 'POST', '/upload/', {
+        'path': self.notebook_path,
+        'format': 'json',
+        'content': make_notebook(self.args.notebook_kb * 1024, self.revision),
+        'expected_generation': generation,
+      })
+      generation = saved['generation'] if saved else None
+    await self.request('checkpoint', 'POST', '/checkpoint/', {
+      'action': 'createCheckpoint', 'localPath': self.notebook_path})
+    await self.think()
+
+    created = await self.request('new', 'POST', '/new/', {
+      'type': 'file', 'ext': 'txt', 'path': self.directory})
+    if not created:
+      return
+    path = created['content']['path']
+    copied = await self.request('copy', 'POST', '/copy/', {
+      'localPath': path, 'toLocalDir': self.directory})
+    await self.request('delete', 'DELETE', '/delete/' + path)
+    if copied:
+      moved = await self.request('move', 'POST', '/move/', {
+        'oldLocalPath': copied['path'],
+        'newLocalPath': '%s/moved-%d.txt' % (self.directory, self.revision)})
+      if moved:
+        await self.request('delete', 'DELETE',
+                           '/delete/' + moved['content']['path'])
+
+  async def run(self, deadline):
+    while time.monotonic() < deadline:
+      await self.session()
+
+
+class Stats(object):
+
+  def __init__(self):
+    self.latencies = collections.defaultdict(list)
+    self.errors = collections.Counter()
+
+  def record(self, operation, seconds, response):
+    self.latencies[operation].append(seconds)
+    if response.code >= 400 or response.error and response.code != 200:
+      self.errors['%s %d %s' % (operation, response.code,
+                                response.reason)] += 1
+
+
+def percentile(values, p):
+  values = sorted(values)
+  if not values:
+    return 0.0
+  return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+def peak_rss_bytes():
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, macOS bytes.
+  return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def populate(gcs, args):
+  for i in range(args.listing_objects):
+    gcs.put(BUCKET, 'shared/file-%06d.csv' % i, b'a,b\n1,2\n', 'text/csv')
+  notebook = json.dumps(make_notebook(args.notebook_kb * 1024)).encode('utf-8')
+  for i in range(args.users):
+    gcs.put(BUCKET, 'user-%03d/notebook.ipynb' % i, notebook,
+            'application/json')
+
+
+def storage_client(api_endpoint):
+  client = storage.Client(
+    project='load-test', credentials=AnonymousCredentials(),
+    client_options={'api_endpoint': api_endpoint})
+  adapter = HTTPAdapter(pool_connections=handlers.CONNECTION_POOL_SIZE,
+                        pool_maxsize=handlers.CONNECTION_POOL_SIZE)
+  client._http.mount('http://', adapter)
+  return client
+
+
+async def run_users(base_url, args, stats):
+  AsyncHTTPClient.configure(None, max_clients=args.users)
+  http = AsyncHTTPClient()
+  deadline = time.monotonic() + args.duration
+  users = [User(i, base_url, http, stats, args) for i in range(args.users)]
+  await asyncio.gather(*(u.run(deadline) for u in users))
+
+
+def report(args, stats, elapsed, lags, gcs):
+  total = sum(len(v) for v in stats.latencies.values())
+  print('%d users for %.1f s: %d requests, %.1f requests/s, %d errors' % (
+    args.users, elapsed, total, total / elapsed, sum(stats.errors.values())))
+  print('%-12s %8s %10s %10s' % ('operation', 'count', 'p50 ms', 'p99 ms'))
+  for operation, latencies in sorted(stats.latencies.items()):
+    print('%-12s %8d %10.1f %10.1f' % (
+      operation, len(latencies), 1000 * percentile(latencies, 50),
+      1000 * percentile(latencies, 99)))
+  print('event loop lag: p50 %.1f ms, p99 %.1f ms, max %.1f ms' % (
+    1000 * percentile(lags, 50), 1000 * percentile(lags, 99),
+    1000 * max(lags or [0])))
+  print('fake GCS: %d requests, %d throttled' % (gcs.requests, gcs.throttled))
+  print('peak RSS: %.1f MB' % (peak_rss_bytes() / 1024.0 / 1024.0))
+  for error, count in stats.errors.most_common(5):
+    print('  %6d x %s' % (count, error))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--users', type=int, default=20,
+                      help='Simulated concurrent users.')
+  parser.add_argument('--duration', type=float, default=30,
+                      help='Seconds to run the users for.')
+  parser.add_argument('--think-ms', type=float, default=0,
+                      help='Mean pause of a user between steps.')
+  parser.add_argument('--saves', type=int, default=3,
+                      help='Autosaves per opened notebook.')
+  parser.add_argument('--notebook-kb', type=int, default=256,
+                      help='Size of each user\'s notebook.')
+  parser.add_argument('--listing-objects', type=int, default=1000,
+                      help='Objects in the shared directory users browse.')
+  parser.add_argument('--latency-ms', type=float, default=20,
+                      help='Mean latency the fake GCS adds to each request.')
+  parser.add_argument('--max-qps', type=float, default=0,
+                      help='Requests per second the fake GCS serves before '
+                           'throttling with 429. 0 never throttles.')
+  parser.add_argument('--throttle-rate', type=float, default=0,
+                      help='Fraction of requests randomly throttled.')
+  parser.add_argument('--request-workers', type=int, default=16,
+                      help='Threads serving reads, as max_request_workers.')
+  args = parser.parse_args()
+
+  gcs = FakeGCS(args.latency_ms / 1000.0, args.max_qps, args.throttle_rate)
+  populate(gcs, args)
+  api_endpoint = gcs.start()
+  # Every handler and job uses the shared client, which now talks to the fake.
+  handlers._shared_client = storage_client(api_endpoint)
+
+  server = ServerThread(make_app(args))
+  base_url = server.start_and_wait()
+  stats = Stats()
+  start = time.monotonic()
+  try:
+    asyncio.run(run_users(base_url, args, stats))
+  finally:
+    elapsed = time.monotonic() - start
+    server.stop()
+    gcs.stop()
+  report(args, stats, elapsed, server.lags, gcs)
+  if stats.errors:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
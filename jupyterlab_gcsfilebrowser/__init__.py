@@ -1,10 +1,30 @@
+from notebook.base.handlers import app_log
 from notebook.utils import url_path_join
 
-from jupyterlab_gcsfilebrowser.handlers import CheckpointHandler, CopyHandler, DeleteHandler, GCSHandler, GCSNbConvert, MoveHandler, NewHandler, UploadHandler
+from jupyterlab_gcsfilebrowser.cache import ContentCache
+from jupyterlab_gcsfilebrowser.compression import configure_gzip_transcoding
+from jupyterlab_gcsfilebrowser.config import GCSFileBrowser, default_cache_dir, default_journal_dir
+from jupyterlab_gcsfilebrowser.jobs import JobManager
+from jupyterlab_gcsfilebrowser.lazy import lazy_function, lazy_handler
+from jupyterlab_gcsfilebrowser.memory import BUDGET
+from jupyterlab_gcsfilebrowser.notebooks import configure_notebook_pool
+from jupyterlab_gcsfilebrowser.prefetch import Prefetcher
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+from jupyterlab_gcsfilebrowser.usage import UsageCache
 from jupyterlab_gcsfilebrowser.version import VERSION
+from jupyterlab_gcsfilebrowser.warmup import WarmUp
+from jupyterlab_gcsfilebrowser.watchdog import Watchdog
 
 __version__ = VERSION
 
+# The handlers module is slow to import, so it is only loaded by the first
+# request or job that needs it.
+JOB_RUNNERS = {
+    'delete': lazy_function('delete_job'),
+    'move': lazy_function('move_job'),
+    'copy': lazy_function('copy_job'),
+}
+
 def _jupyter_server_extension_paths():
     return [{
         'module': 'jupyterlab_gcsfilebrowser'
@@ -18,18 +38,70 @@ def load_jupyter_server_extension(nb_server_app):
     """
     host_pattern = '.*$'
     app = nb_server_app.web_app
+
+    config = GCSFileBrowser(parent=nb_server_app)
+    app.settings['gcs_filebrowser_config'] = config
+    if config.content_cache_enabled:
+        app.settings['gcs_content_cache'] = ContentCache(
+          config.content_cache_dir or default_cache_dir(),
+          config.content_cache_max_bytes)
+    if config.prefetch_enabled:
+        if 'gcs_content_cache' in app.settings:
+            app.settings['gcs_prefetcher'] = Prefetcher(
+              app.settings['gcs_content_cache'],
+              config.prefetch_max_object_bytes,
+              config.prefetch_max_workers,
+              config.prefetch_max_bytes_per_second)
+        else:
+            app_log.warning(
+              'GCSFileBrowser.prefetch_enabled requires content_cache_enabled')
+
+    BUDGET.configure(config.memory_budget_bytes, config.memory_wait_timeout)
+    configure_notebook_pool(
+      config.notebook_process_workers, config.notebook_process_threshold)
+    configure_gzip_transcoding(config.gzip_transcoding_enabled)
+    app.settings['gcs_usage_cache'] = UsageCache(config.usage_cache_ttl)
+    app.settings['gcs_single_flight'] = SingleFlight(
+      config.max_request_workers)
+
+    if config.warmup_enabled:
+        warm_up = WarmUp(config.warmup_connections)
+        warm_up.start()
+        app.settings['gcs_warmup'] = warm_up
+
+    if config.watchdog_enabled:
+        watchdog = Watchdog(
+          config.watchdog_lag_threshold,
+          config.watchdog_slow_request_threshold)
+        watchdog.start()
+        app.settings['gcs_watchdog'] = watchdog
+
+    job_manager = JobManager(
+      JOB_RUNNERS,
+      config.job_journal_dir or default_journal_dir(),
+      config.max_concurrent_jobs)
+    job_manager.resume()
+    app.settings['gcs_job_manager'] = job_manager
+
     gcp_v1_endpoint = url_path_join(
       app.settings['base_url'], 'gcp', 'v1', 'gcs')
     app.add_handlers(host_pattern, [
       # TODO(cbwilkes): Add auth checking if needed.
       # (url_path_join(gcp_v1_endpoint, auth'), AuthHandler)
-      (url_path_join(gcp_v1_endpoint, 'files') + '(.*)', GCSHandler),
-      (url_path_join(gcp_v1_endpoint, 'upload', ) + '(.*)', UploadHandler),
-      (url_path_join(gcp_v1_endpoint, 'delete', ) + '(.*)', DeleteHandler),
-      (url_path_join(gcp_v1_endpoint, 'move', ) + '(.*)', MoveHandler),
-      (url_path_join(gcp_v1_endpoint, 'copy', ) + '(.*)', CopyHandler),
-      (url_path_join(gcp_v1_endpoint, 'new', ) + '(.*)', NewHandler),
-      (url_path_join(gcp_v1_endpoint, 'checkpoint', ) + '(.*)', CheckpointHandler),
-      ('/nbconvert/(.*)/GCS%3A(.*)', GCSNbConvert),
+      (url_path_join(gcp_v1_endpoint, 'files') + '(.*)', lazy_handler('GCSHandler')),
+      (url_path_join(gcp_v1_endpoint, 'upload', ) + '(.*)', lazy_handler('UploadHandler')),
+      (url_path_join(gcp_v1_endpoint, 'delete', ) + '(.*)', lazy_handler('DeleteHandler')),
+      (url_path_join(gcp_v1_endpoint, 'move', ) + '(.*)', lazy_handler('MoveHandler')),
+      (url_path_join(gcp_v1_endpoint, 'copy', ) + '(.*)', lazy_handler('CopyHandler')),
+      (url_path_join(gcp_v1_endpoint, 'new', ) + '(.*)', lazy_handler('NewHandler')),
+      (url_path_join(gcp_v1_endpoint, 'bulk', ) + '(.*)', lazy_handler('BulkHandler')),
+      (url_path_join(gcp_v1_endpoint, 'jobs', ) + '(.*)', lazy_handler('JobsHandler')),
+      (url_path_join(gcp_v1_endpoint, 'archive', ) + '(.*)', lazy_handler('ArchiveHandler')),
+      (url_path_join(gcp_v1_endpoint, 'du', ) + '(.*)', lazy_handler('UsageHandler')),
+      (url_path_join(gcp_v1_endpoint, 'output', ) + '(.*)', lazy_handler('OutputHandler')),
+      (url_path_join(gcp_v1_endpoint, 'metrics', ) + '(.*)', lazy_handler('MetricsHandler')),
+      (url_path_join(gcp_v1_endpoint, 'checkpoint', ) + '(.*)', lazy_handler('CheckpointHandler')),
+      (url_path_join(gcp_v1_endpoint, 'diagnostics', ) + '(.*)', lazy_handler('DiagnosticsHandler')),
+      ('/nbconvert/(.*)/GCS%3A(.*)', lazy_handler('GCSNbConvert')),
     ])
 
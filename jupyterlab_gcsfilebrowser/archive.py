@@ -0,0 +1,225 @@
+# Lint as: python3
+"""Streaming zip and tar.gz archives of GCS directories."""
+
+import collections
+import datetime
+import itertools
+import posixpath
+import shutil
+import tarfile
+import threading
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from notebook.base.handlers import app_log
+from tornado import gen
+from tornado.queues import Queue
+from jupyterlab_gcsfilebrowser.compression import content_size
+from jupyterlab_gcsfilebrowser.download import DownloadAborted, READ_CHUNK_SIZE, ReadAhead
+
+# Archive format name to (content type, file extension).
+ARCHIVE_FORMATS = collections.OrderedDict([
+  ('zip', ('application/zip', '.zip')),
+  ('tar.gz', ('application/gzip', '.tar.gz')),
+])
+
+# Threads fetching object ranges for one archive.
+READ_WORKERS = 8
+# Bytes collected before the archive output is handed to the response.
+OUTPUT_CHUNK_SIZE = 256 * 1024
+# Output chunks buffered for the response before the writer blocks.
+MAX_QUEUED_OUTPUT_CHUNKS = 16
+
+
+class ArchiveAborted(DownloadAborted):
+  """The client went away while the archive was being written."""
+  pass
+
+
+def entries(read_ahead):
+  """Yields a (blob, file object) pair for each blob of a ReadAhead."""
+  for blob, chunks in itertools.groupby(read_ahead, key=lambda item: item[0]):
+    yield blob, ChunkReader(data for _, data in chunks)
+
+
+class ChunkReader(object):
+  """Read-only file object over an iterator of byte strings."""
+
+  def __init__(self, chunks):
+    self._chunks = chunks
+    self._chunk = memoryview(b'')
+
+  def read(self, size=-1):
+    parts = []
+    while size != 0:
+      if not self._chunk:
+        chunk = next(self._chunks, None)
+        if chunk is None:
+          break
+        self._chunk = memoryview(chunk)
+      elif size < 0 or size >= len(self._chunk):
+        parts.append(self._chunk)
+        if size > 0:
+          size -= len(self._chunk)
+        self._chunk = memoryview(b'')
+      else:
+        parts.append(self._chunk[:size])
+        self._chunk = self._chunk[size:]
+        size = 0
+    return b''.join(parts)
+
+
+class OutputWriter(object):
+  """Write-only file object that batches archive output into chunks."""
+
+  def __init__(self, emit):
+    self._emit = emit
+    self._buffer = bytearray()
+
+  def write(self, data):
+    self._buffer += data
+    if len(self._buffer) >= OUTPUT_CHUNK_SIZE:
+      self.flush()
+    return len(data)
+
+  def flush(self):
+    if self._buffer:
+      self._emit(bytes(self._buffer))
+      self._buffer = bytearray()
+
+
+def _date_time(blob):
+  updated = blob.updated or datetime.datetime.now(datetime.timezone.utc)
+  return max(updated.timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+
+
+def write_zip(entries, fileobj):
+  with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED,
+                       allowZip64=True) as zf:
+    for name, blob, reader in entries:
+      zinfo = zipfile.ZipInfo(name, _date_time(blob))
+      if name.endswith('/'):
+        zf.writestr(zinfo, b'')
+        continue
+      zinfo.compress_type = zipfile.ZIP_DEFLATED
+      size = content_size(blob)
+      zinfo.file_size = size or 0
+      with zf.open(zinfo, 'w',
+                   force_zip64=size is None or size > 2 ** 31) as dest:
+        shutil.copyfileobj(reader, dest, READ_CHUNK_SIZE)
+
+
+def write_tar_gz(entries, fileobj):
+  with tarfile.open(fileobj=fileobj, mode='w|gz') as tar:
+    for name, blob, reader in entries:
+      tarinfo = tarfile.TarInfo(name.rstrip('/'))
+      tarinfo.mtime = (blob.updated or datetime.datetime.now()).timestamp()
+      if name.endswith('/'):
+        tarinfo.type = tarfile.DIRTYPE
+        tarinfo.mode = 0o755
+        tar.addfile(tarinfo)
+      else:
+        tarinfo.size = content_size(blob)
+        if tarinfo.size is None:
+          # A tar header needs the size, which a gzip-encoded object may not
+          # record. Such objects are text files, read into memory to count.
+          data = reader.read()
+          tarinfo.size = len(data)
+          reader = BytesIO(data)
+        tarinfo.mode = 0o644
+        tar.addfile(tarinfo, reader)
+
+
+ARCHIVE_WRITERS = {
+  'zip': write_zip,
+  'tar.gz': write_tar_gz,
+}
+
+
+class DirectoryArchive(object):
+  """Writes an archive of listed blobs on a background thread.
+
+  The archive is produced as a stream of chunks that the request handler
+  reads with next_chunk(). When the handler falls behind, the writer blocks
+  instead of buffering, so memory use does not depend on the archive size.
+  """
+
+  def __init__(self, archive_format, blobs, prefix, root, io_loop,
+               max_workers=READ_WORKERS):
+    """
+    Args:
+      archive_format: One of ARCHIVE_FORMATS.
+      blobs: The blobs to add, e.g. a lazy listing of prefix.
+      prefix: The blob name prefix removed from entry names.
+      root: The top-level directory name inside the archive.
+      io_loop: The IOLoop of the request handler.
+    """
+    self.archive_format = archive_format
+    self.blobs = blobs
+    self.prefix = prefix
+    self.root = root
+    self._io_loop = io_loop
+    self._pool = ThreadPoolExecutor(
+      max_workers=max_workers, thread_name_prefix='gcs-archive-read')
+    self._output = Queue()
+    self._slots = threading.Semaphore(MAX_QUEUED_OUTPUT_CHUNKS)
+    self._aborted = threading.Event()
+
+  def start(self):
+    thread = threading.Thread(
+      target=self._run, name='gcs-archive-write', daemon=True)
+    thread.start()
+
+  def abort(self):
+    self._aborted.set()
+
+  def _put(self, item):
+    self._io_loop.add_callback(self._output.put_nowait, item)
+
+  def _emit(self, chunk):
+    while not self._slots.acquire(timeout=1):
+      if self._aborted.is_set():
+        raise ArchiveAborted()
+    if self._aborted.is_set():
+      raise ArchiveAborted()
+    self._put(chunk)
+
+  def _entries(self):
+    read_ahead = ReadAhead(self.blobs, self._pool, self._aborted.is_set)
+    for blob, reader in entries(read_ahead):
+      name = blob.name[len(self.prefix):]
+      if not name:
+        # The placeholder of the archived directory itself.
+        continue
+      yield posixpath.join(self.root, name), blob, reader
+
+  def _run(self):
+    try:
+      output = OutputWriter(self._emit)
+      ARCHIVE_WRITERS[self.archive_format](self._entries(), output)
+      output.flush()
+      self._put(None)
+    except DownloadAborted:
+      pass
+    except Exception as e:
+      app_log.exception('Archive of %s failed', self.root)
+      self._put(e)
+    finally:
+      self._pool.shutdown(wait=False)
+
+  @gen.coroutine
+  def next_chunk(self):
+    """Wait for the next chunk of the archive.
+
+    Returns:
+      The chunk as bytes, or None once the archive is complete.
+    Raises:
+      The exception that stopped the writer, if any.
+    """
+    chunk = yield self._output.get()
+    if isinstance(chunk, Exception):
+      raise chunk
+    if chunk is not None:
+      self._slots.release()
+    return chunk
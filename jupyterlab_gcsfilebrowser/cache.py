@@ -0,0 +1,194 @@
+# Lint as: python3
+"""Local disk cache for GCS blob contents."""
+
+import collections
+import contextlib
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+
+from notebook.base.handlers import app_log
+
+from jupyterlab_gcsfilebrowser.compression import content_size
+
+TEMP_SUFFIX = '.tmp'
+
+
+class ContentCache(object):
+  """Read-through cache of blob contents with a byte-budget LRU policy.
+
+  Entries are keyed by (bucket, name, generation). A generation always refers
+  to the same bytes, so an entry never goes stale; callers only need to know
+  the current generation of an object, from a listing or a metadata call, to
+  decide whether the cached copy is still the live one.
+  """
+
+  def __init__(self, cache_dir, max_bytes):
+    self.cache_dir = cache_dir
+    self.max_bytes = max_bytes
+    self._lock = threading.Lock()
+    # Maps entry file name to entry size, least recently used first.
+    self._entries = collections.OrderedDict()
+    self._size = 0
+
+    os.makedirs(cache_dir, exist_ok=True)
+    self._load_entries()
+
+  @property
+  def size(self):
+    return self._size
+
+  def _load_entries(self):
+    """Index entries left by a previous server, oldest access first."""
+    found = []
+    for name in os.listdir(self.cache_dir):
+      filename = os.path.join(self.cache_dir, name)
+      if name.endswith(TEMP_SUFFIX):
+        # Leftover from an interrupted download.
+        _remove(filename)
+        continue
+      try:
+        stat = os.stat(filename)
+      except OSError:
+        continue
+      found.append((stat.st_mtime, name, stat.st_size))
+
+    with self._lock:
+      for _, name, size in sorted(found):
+        self._entries[name] = size
+        self._size += size
+      self._evict()
+
+  def _entry_name(self, bucket_name, blob_name, generation):
+    key = '%s\0%s\0%s' % (bucket_name, blob_name, generation)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+  def _evict(self):
+    """Remove least recently used entries until within budget.
+
+    Must be called with the lock held.
+    """
+    while self._size > self.max_bytes and self._entries:
+      name, size = self._entries.popitem(last=False)
+      self._size -= size
+      _remove(os.path.join(self.cache_dir, name))
+
+  def _touch(self, name):
+    """Mark an entry as most recently used.
+
+    Returns:
+      True if the entry exists.
+    """
+    with self._lock:
+      if name not in self._entries:
+        return False
+      self._entries.move_to_end(name)
+    try:
+      os.utime(os.path.join(self.cache_dir, name))
+    except OSError:
+      pass
+    return True
+
+  def contains(self, bucket_name, blob_name, generation):
+    name = self._entry_name(bucket_name, blob_name, generation)
+    with self._lock:
+      return name in self._entries
+
+  @contextlib.contextmanager
+  def open(self, bucket_name, blob_name, generation):
+    """Memory-map a cached entry.
+
+    Yields:
+      A read-only buffer with the entry contents, or None on a cache miss.
+    """
+    name = self._entry_name(bucket_name, blob_name, generation)
+    buf = None
+    if self._touch(name):
+      buf = _map_file(os.path.join(self.cache_dir, name))
+    try:
+      yield buf
+    finally:
+      if isinstance(buf, mmap.mmap):
+        buf.close()
+
+  def put(self, bucket_name, blob_name, generation, download):
+    """Add an entry by calling download(file_obj) into a temporary file.
+
+    Objects larger than the whole budget are not cached.
+
+    Returns:
+      True if the entry was added to the cache.
+    """
+    name = self._entry_name(bucket_name, blob_name, generation)
+    fd, temp_filename = tempfile.mkstemp(
+      dir=self.cache_dir, suffix=TEMP_SUFFIX)
+    try:
+      with os.fdopen(fd, 'wb') as f:
+        download(f)
+        size = f.tell()
+      if size > self.max_bytes:
+        _remove(temp_filename)
+        return False
+      os.replace(temp_filename, os.path.join(self.cache_dir, name))
+    except Exception:
+      _remove(temp_filename)
+      raise
+
+    with self._lock:
+      self._size -= self._entries.pop(name, 0)
+      self._entries[name] = size
+      self._size += size
+      self._evict()
+    return True
+
+  @contextlib.contextmanager
+  def read_through(self, blob):
+    """Serve the contents of a blob, downloading it on a cache miss.
+
+    The blob's generation must already be known, e.g. from a listing.
+
+    Yields:
+      A read-only buffer with the blob contents, or None if the blob could
+      not be cached. Blobs known to be larger than the whole budget are not
+      downloaded.
+    """
+    bucket_name, generation = blob.bucket.name, blob.generation
+    with self.open(bucket_name, blob.name, generation) as buf:
+      if buf is not None:
+        yield buf
+        return
+
+    size = content_size(blob)
+    if size is not None and size > self.max_bytes:
+      yield None
+      return
+
+    # Imported here since the storage libraries are slow to load and the
+    # cache is created at server start.
+    from jupyterlab_gcsfilebrowser.download import download_to_file
+
+    app_log.debug('Content cache miss for gs://%s/%s#%s',
+                  bucket_name, blob.name, generation)
+    self.put(bucket_name, blob.name, generation,
+             lambda f: download_to_file(blob, f))
+    with self.open(bucket_name, blob.name, generation) as buf:
+      yield buf
+
+
+def _map_file(filename):
+  try:
+    with open(filename, 'rb') as f:
+      if os.fstat(f.fileno()).st_size == 0:
+        return b''
+      return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except OSError:
+    return None
+
+
+def _remove(filename):
+  try:
+    os.remove(filename)
+  except OSError:
+    pass
@@ -0,0 +1,97 @@
+# Lint as: python3
+"""Gzip-encoded storage of text files and compressed responses.
+
+Text files and notebooks are stored with Content-Encoding: gzip when this is
+enabled, so that GCS keeps and sends the compressed bytes. Downloads ask for
+gzip and decompress as the bytes arrive, and other clients of the bucket
+still get the original contents through decompressive transcoding. Contents
+responses are gzip-encoded for browsers that accept it.
+"""
+
+import gzip
+import threading
+
+# Files smaller than this are stored as they are. Compressing them saves
+# little and costs a gzip header and trailer.
+GZIP_MIN_BYTES = 1024
+# zlib compression level of stored objects.
+GZIP_LEVEL = 6
+# zlib compression level of responses, which are compressed on every request.
+GZIP_RESPONSE_LEVEL = 1
+# Object metadata key recording the size of the contents before compression.
+UNCOMPRESSED_SIZE_KEY = 'gcsfilebrowser-uncompressed-size'
+# Assumed ratio of contents to compressed size when a gzip-encoded object
+# does not record the size of its contents.
+GZIP_EXPANSION_ESTIMATE = 10
+
+_lock = threading.Lock()
+_enabled = False
+
+
+def configure_gzip_transcoding(enabled):
+  """Turn gzip-encoded storage and compressed responses on or off."""
+  global _enabled
+  with _lock:
+    _enabled = enabled
+
+
+def gzip_transcoding_enabled():
+  return _enabled
+
+
+def should_compress(size):
+  """Whether text contents of size bytes are stored gzip-encoded."""
+  return _enabled and size >= GZIP_MIN_BYTES
+
+
+def gzip_compress(data, level=GZIP_LEVEL):
+  """Compress data into a gzip member.
+
+  The header carries no modification time, so the same contents always
+  compress to the same bytes and CRC32C.
+  """
+  return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def is_gzip_encoded(blob):
+  return blob.content_encoding == 'gzip'
+
+
+def content_size(blob):
+  """The size of a blob's contents once decompressed.
+
+  Returns:
+    The size in bytes, or None for a gzip-encoded blob that does not record
+    it.
+  """
+  if not is_gzip_encoded(blob):
+    return blob.size
+  size = (blob.metadata or {}).get(UNCOMPRESSED_SIZE_KEY)
+  try:
+    return int(size) if size is not None else None
+  except ValueError:
+    return None
+
+
+def estimated_content_size(blob):
+  """content_size, estimated from the compressed size when unknown."""
+  size = content_size(blob)
+  if size is None:
+    size = GZIP_EXPANSION_ESTIMATE * (blob.size or 0)
+  return size or 0
+
+
+def accepts_gzip(accept_encoding):
+  """Whether an Accept-Encoding header value allows a gzip response."""
+  for coding in (accept_encoding or '').split(','):
+    name, _, params = coding.partition(';')
+    if name.strip().lower() not in ('gzip', '*'):
+      continue
+    q = params.strip().lower()
+    if q.startswith('q='):
+      try:
+        return float(q[2:]) > 0
+      except ValueError:
+        return False
+    return True
+  return False
@@ -0,0 +1,121 @@
+# Lint as: python3
+"""Server-side configuration for the GCS file browser extension.
+
+Options can be set in jupyter_notebook_config.py, for example:
+
+  c.GCSFileBrowser.content_cache_enabled = True
+"""
+
+import os
+
+from jupyter_core.paths import jupyter_data_dir
+from traitlets import Bool, Float, Integer, Unicode
+from traitlets.config import Configurable
+
+
+def default_cache_dir():
+  cache_home = os.environ.get(
+    'XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+  return os.path.join(cache_home, 'jupyterlab_gcsfilebrowser')
+
+
+def default_journal_dir():
+  return os.path.join(
+    jupyter_data_dir(), 'jupyterlab_gcsfilebrowser', 'jobs')
+
+
+class GCSFileBrowser(Configurable):
+  """Configuration for the GCS file browser server extension."""
+
+  content_cache_enabled = Bool(False, config=True,
+    help='Cache downloaded blob contents on local disk.')
+
+  content_cache_dir = Unicode('', config=True,
+    help='Directory for the content cache. Defaults to '
+         '$XDG_CACHE_HOME/jupyterlab_gcsfilebrowser.')
+
+  content_cache_max_bytes = Integer(1024 * 1024 * 1024, config=True,
+    help='Maximum size of the content cache in bytes. Least recently used '
+         'entries are evicted once the budget is exceeded.')
+
+  prefetch_enabled = Bool(False, config=True,
+    help='After a directory listing, download its small files into the '
+         'content cache in the background. Requires content_cache_enabled.')
+
+  prefetch_max_object_bytes = Integer(1024 * 1024, config=True,
+    help='Only prefetch objects up to this size in bytes.')
+
+  prefetch_max_workers = Integer(2, config=True,
+    help='Maximum number of concurrent prefetch downloads.')
+
+  prefetch_max_bytes_per_second = Integer(8 * 1024 * 1024, config=True,
+    help='Bandwidth cap shared by all prefetch downloads. 0 disables the '
+         'cap.')
+
+  max_concurrent_jobs = Integer(2, config=True,
+    help='Maximum number of background jobs (directory delete, move and '
+         'copy) running at once. Further jobs wait in a queue.')
+
+  job_journal_dir = Unicode('', config=True,
+    help='Directory where unfinished jobs are recorded so that they resume '
+         'after a server restart. Defaults to a directory in the Jupyter '
+         'data dir.')
+
+  usage_cache_ttl = Float(300, config=True,
+    help='Seconds for which directory sizes from the du endpoint are cached. '
+         'Changes made through this server update cached sizes right away; '
+         'changes made elsewhere show once the entry expires.')
+
+  lazy_output_size = Integer(0, config=True,
+    help='When a notebook is opened, outputs of at least this many bytes are '
+         'replaced by placeholders and fetched on demand. Saving the notebook '
+         'keeps the original outputs. 0 disables.')
+
+  warmup_enabled = Bool(False, config=True,
+    help='At server start, build the storage client, fetch an access token '
+         'and open connections to GCS in the background, and keep the token '
+         'refreshed ahead of its expiry.')
+
+  warmup_connections = Integer(4, config=True,
+    help='Connections to GCS opened by the warm-up.')
+
+  max_request_workers = Integer(16, config=True,
+    help='Threads that serve file and directory reads off the event loop. '
+         'Concurrent reads of the same path share one request to GCS.')
+
+  memory_budget_bytes = Integer(1024 * 1024 * 1024, config=True,
+    help='Bytes that file opens, saves and exports may hold in memory at '
+         'once, across all users. Transfers beyond it wait for memory, and '
+         'downloads that do not fit are buffered on disk. 0 disables.')
+
+  memory_wait_timeout = Float(60, config=True,
+    help='Seconds a transfer waits for memory before it fails with HTTP '
+         '503.')
+
+  notebook_process_workers = Integer(2, config=True,
+    help='Worker processes that parse and encode large notebooks on save '
+         'and nbconvert export, off the server process. 0 does all of it in '
+         'the server process.')
+
+  notebook_process_threshold = Integer(4 * 1024 * 1024, config=True,
+    help='Notebooks of at least this many bytes are handled by the worker '
+         'processes. Smaller ones are handled in the server process.')
+
+  watchdog_enabled = Bool(False, config=True,
+    help='Measure event loop lag, and log and record the requests that block '
+         'the event loop or run slowly. The records are served by the '
+         'diagnostics endpoint.')
+
+  watchdog_lag_threshold = Float(0.25, config=True,
+    help='Seconds the event loop must be blocked before the watchdog samples '
+         'the stack of the request that blocks it.')
+
+  watchdog_slow_request_threshold = Float(2.0, config=True,
+    help='Requests that take at least this many seconds are recorded as '
+         'slow.')
+
+  gzip_transcoding_enabled = Bool(False, config=True,
+    help='Store saved notebooks and text files of 1 KB or more with '
+         'Content-Encoding: gzip, and gzip file contents sent to browsers '
+         'that accept it. GCS serves the original contents to other clients '
+         'through decompressive transcoding.')
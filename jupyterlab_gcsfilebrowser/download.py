@@ -0,0 +1,163 @@
+# Lint as: python3
+"""Concurrent ranged downloads of GCS objects."""
+
+import base64
+import collections
+import threading
+
+import google_crc32c
+
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from jupyterlab_gcsfilebrowser.compression import is_gzip_encoded
+from jupyterlab_gcsfilebrowser.retry import STORAGE_RETRY
+
+# Bytes fetched per ranged read of an object.
+READ_CHUNK_SIZE = 4 * 1024 * 1024
+# Ranged reads in flight or buffered ahead of the reader.
+READ_AHEAD_CHUNKS = 8
+# Objects at least this big are downloaded as parallel ranges.
+PARALLEL_DOWNLOAD_THRESHOLD = 32 * 1024 * 1024
+# Threads shared by all parallel downloads of the server.
+PARALLEL_DOWNLOAD_WORKERS = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class DownloadAborted(Exception):
+  """The download was abandoned before it completed."""
+  pass
+
+
+class ChecksumMismatch(Exception):
+  """The downloaded contents do not match the object's CRC32C."""
+  pass
+
+
+def crc32c(data):
+  """The CRC32C of data, encoded like Blob.crc32c."""
+  return base64.b64encode(google_crc32c.Checksum(data).digest()).decode('utf-8')
+
+
+def download_range(blob, start, end):
+  """Download bytes start to end of a blob, or all of it if end is None."""
+  data = BytesIO()
+  if end is None:
+    blob.download_to_file(data, retry=STORAGE_RETRY)
+  elif end >= start:
+    blob.download_to_file(data, start=start, end=end, retry=STORAGE_RETRY)
+  return data.getvalue()
+
+
+def download_stored(blob, file_obj):
+  """Download a blob's bytes as they are stored.
+
+  A gzip-encoded blob stays compressed, rather than being decompressed as
+  download_to_file does.
+  """
+  blob.download_to_file(file_obj, raw_download=True, retry=STORAGE_RETRY)
+
+
+class ReadAhead(object):
+  """Reads the contents of blobs in order, fetching ahead of use.
+
+  Objects are split into ranges that are fetched concurrently, with at most
+  read_ahead ranges in flight or waiting to be consumed, which bounds memory
+  whatever the size of the objects. Gzip-encoded objects are fetched whole,
+  since their ranges would be ranges of the compressed bytes. Reads of a blob with a known generation
+  are pinned to that generation, so the ranges always belong together.
+  """
+
+  def __init__(self, blobs, pool, is_aborted=None,
+               chunk_size=READ_CHUNK_SIZE, read_ahead=READ_AHEAD_CHUNKS):
+    self._ranges = self._iter_ranges(blobs, chunk_size)
+    self._pool = pool
+    self._is_aborted = is_aborted or (lambda: False)
+    self._read_ahead = read_ahead
+    self._pending = collections.deque()
+
+  @staticmethod
+  def _iter_ranges(blobs, chunk_size):
+    for blob in blobs:
+      size = blob.size or 0
+      if is_gzip_encoded(blob):
+        yield blob, 0, None
+        continue
+      if size == 0:
+        yield blob, 0, -1
+      for start in range(0, size, chunk_size):
+        yield blob, start, min(start + chunk_size, size) - 1
+
+  def _fill(self):
+    while len(self._pending) < self._read_ahead:
+      try:
+        blob, start, end = next(self._ranges)
+      except StopIteration:
+        return
+      self._pending.append(
+        (blob, self._pool.submit(download_range, blob, start, end)))
+
+  def __iter__(self):
+    """Yields (blob, data) pairs, in listing order and byte order."""
+    self._fill()
+    try:
+      while self._pending:
+        if self._is_aborted():
+          raise DownloadAborted()
+        blob, future = self._pending.popleft()
+        data = future.result()
+        self._fill()
+        yield blob, data
+    finally:
+      for _, future in self._pending:
+        future.cancel()
+
+
+def shared_pool():
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      _pool = ThreadPoolExecutor(
+        max_workers=PARALLEL_DOWNLOAD_WORKERS,
+        thread_name_prefix='gcs-download')
+    return _pool
+
+
+def download_to_file(blob, file_obj, pool=None,
+                     threshold=PARALLEL_DOWNLOAD_THRESHOLD,
+                     chunk_size=READ_CHUNK_SIZE):
+  """Download a blob into a file object, in parallel ranges if it is large.
+
+  The ranges are written to file_obj in order as they arrive. When the blob
+  has a CRC32C, the assembled contents are checked against it. Gzip-encoded
+  blobs are downloaded compressed in one request and decompressed as they
+  arrive.
+
+  Args:
+    blob: The Blob to download. Its size must be known, e.g. from a listing,
+      for a parallel download.
+    file_obj: A writable file object.
+    pool: Executor for the ranged reads, shared_pool() by default.
+    threshold: The smallest size downloaded in parallel.
+    chunk_size: Bytes fetched per ranged read.
+  Raises:
+    ChecksumMismatch if the contents do not match the blob's CRC32C.
+  """
+  if blob.size is None or blob.size < threshold or is_gzip_encoded(blob):
+    blob.download_to_file(file_obj, retry=STORAGE_RETRY)
+    return
+
+  checksum = google_crc32c.Checksum()
+  for _, data in ReadAhead(
+      [blob], pool or shared_pool(), chunk_size=chunk_size):
+    checksum.update(data)
+    file_obj.write(data)
+
+  if blob.crc32c:
+    actual = base64.b64encode(checksum.digest()).decode('utf-8')
+    if actual != blob.crc32c:
+      raise ChecksumMismatch(
+        'Error: Downloaded gs://%s/%s does not match its CRC32C' % (
+          blob.bucket.name, blob.name))
@@ -2,21 +2,51 @@
 """Request handler classes for the extensions."""
 
 import base64
+import contextlib
+import contextvars
 import json
+import mmap
 import re
+import threading
 import tornado.gen as gen
 import os
+import posixpath
 import datetime
-import notebook
 import nbformat
+import requests
+import tempfile
 
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from notebook.base.handlers import APIHandler, app_log
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+from tornado.iostream import StreamClosedError
 
+try:
+  import orjson # optional, a faster encoder for large listings
+except ImportError:
+  orjson = None
+
+import google.auth
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage # used for connecting to GCS
+from google.cloud.exceptions import NotFound, PreconditionFailed
 from google.api_core.client_info import ClientInfo
 from io import BytesIO, StringIO # used for sending GCS blobs in JSON objects
+from jupyterlab_gcsfilebrowser.archive import ARCHIVE_FORMATS, DirectoryArchive
+from jupyterlab_gcsfilebrowser.compression import GZIP_MIN_BYTES, GZIP_RESPONSE_LEVEL, UNCOMPRESSED_SIZE_KEY, accepts_gzip, estimated_content_size, gzip_compress, gzip_transcoding_enabled, is_gzip_encoded, should_compress
+from jupyterlab_gcsfilebrowser.download import crc32c, download_stored, download_to_file
+from jupyterlab_gcsfilebrowser.jobs import JobCancelled, UnknownJob
+from jupyterlab_gcsfilebrowser.memory import BUDGET, MemoryBudgetExceeded
+from jupyterlab_gcsfilebrowser.metrics import METRICS
+from jupyterlab_gcsfilebrowser.notebooks import InvalidUpload, decode_upload, export_notebook, notebook_task
+from jupyterlab_gcsfilebrowser.outputs import LAZY_OUTPUT_KEY, LOCATIONS, StaleOutputs, cell_outputs, get_output, merge_outputs, strip_outputs
+from jupyterlab_gcsfilebrowser.retry import CONCURRENCY, STORAGE_RETRY, is_throttled
+from jupyterlab_gcsfilebrowser.shards import list_prefix
+from jupyterlab_gcsfilebrowser.usage import directory_usage
 from jupyterlab_gcsfilebrowser.version import VERSION
+from jupyterlab_gcsfilebrowser.watchdog import count_objects, count_storage_request
 
 TEMPLATE_COPY_FILE = '-Copy%s'
 TEMPLATE_NEW_FILE = '%s'
@@ -24,6 +54,44 @@ NEW_FILE_NAME = 'Untitled'
 NEW_DIRECTORY_NAME = 'Untitled Folder'
 CHECKPOINT_FOLDER = '.ipynb_checkpoints'
 CHECKPOINT_ID = '-checkpoint'
+# Requests per batched JSON API call. GCS accepts at most 100.
+BATCH_SIZE = 100
+# Threads used for parallel rewrites and batched requests.
+MAX_PARALLEL_REQUESTS = 16
+# Connections kept open to the storage API by the shared client.
+CONNECTION_POOL_SIZE = 32
+# Objects combined by one compose request. GCS accepts at most 32.
+MAX_COMPOSE_SOURCES = 32
+# IDs chosen by the client for parallel sliced uploads.
+UPLOAD_ID_PATTERN = re.compile(r'^[A-Za-z0-9-]{1,64}$')
+# Content formats of file models, as in the Jupyter contents API.
+CONTENT_FORMATS = ('text', 'json', 'base64')
+# Content types sent as base64 without trying to decode them as text.
+BINARY_CONTENT_TYPE_PREFIXES = ('image/', 'audio/', 'video/', 'font/')
+BINARY_CONTENT_TYPES = frozenset([
+  'application/gzip',
+  'application/pdf',
+  'application/x-tar',
+  'application/zip',
+])
+# Saves of at least this many bytes are skipped when the stored object
+# already has the same contents. Smaller ones are cheaper to write than to
+# check.
+SKIP_UNCHANGED_MIN_BYTES = 16 * 1024
+# Bytes reserved from the memory budget per byte of a file whose content is
+# sent: copies of the decoded content, the parsed JSON and the response.
+CONTENT_MEMORY_FACTOR = 4
+# Bytes reserved per byte of an upload request body: the decoded contents and
+# the copy that is sent to GCS.
+UPLOAD_MEMORY_FACTOR = 2
+# Bytes reserved per byte of a notebook exported with nbconvert.
+NBCONVERT_MEMORY_FACTOR = 4
+# Bytes written per chunk of a raw file response.
+RAW_CHUNK_SIZE = 64 * 1024
+# Objects deleted per step of a delete job.
+JOB_CHUNK_SIZE = 1000
+# Seconds between progress checks when streaming job events.
+JOB_EVENT_INTERVAL = 0.5
 
 class Error(Exception):
   """GCS Filebrowser exception."""
@@ -35,56 +103,59 @@ class FileNotFound(Error):
   pass
 
 
-def list_dir(bucket_name, path, blobs_dir_list):
-  items = []
-  directories = set()
-  directory_last_modified = dict()
+class FileChanged(Error):
+  """The file changed since the generation a save was based on."""
+  pass
 
-  path = '%s%s' % (path, '' if re.match(".*/$", path) else '/')
 
-  for blob in blobs_dir_list:
-    relative_blob_name = re.sub(r'^' + path, '', blob.name)
-
-    relative_path_parts = [
-      dir
-      for dir in relative_blob_name.split('/')
-      if dir
-      ]
-
-    if re.match(".*/$", blob.name):
-      # Add the top directory to the set of directories if one exist
-      if relative_path_parts:
-        directories.add(relative_path_parts[0])
-        directory_last_modified[
-          relative_path_parts[0]] = blob_last_modified(blob)
-    else:
-      if relative_path_parts:
-        dir_name = relative_path_parts[0]
+class BadRequest(Error):
+  """A request argument is missing or malformed."""
+  pass
 
-        def blobInDir(parts):
-          return len(parts) > 1
 
-        if blobInDir(relative_path_parts):
-          directories.add(relative_path_parts[0])
-          directory_last_modified[
-            relative_path_parts[0]] = blob_last_modified(blob)
-        else:
-          items.append({
-                  'type': 'file',
-                  'path': ('%s/%s' % (bucket_name, blob.name)),
-                  'name': dir_name,
-                  'last_modified':  blob_last_modified(blob),
-                })
+def list_dir(bucket_name, path, blobs_dir_list):
+  """Build the directory listing of path from the blobs listed below it.
+
+  A single pass over the listing: the prefix is sliced off each name and only
+  the first part of the rest is looked at, so a listing of a million objects
+  does no per-blob regex or date parsing work.
+  """
+  items = []
+  # Directories in the order they are first seen, mapped to the last blob
+  # listed inside each of them.
+  directories = {}
 
-  if path != '/':
-    path = '/' + path
+  prefix = path if not path or path.endswith('/') else path + '/'
+  if prefix == '/':
+    prefix = ''
+  prefix_length = len(prefix)
 
-  items = items + [{
-                  'type': 'directory',
-                  'path': ('%s%s%s/' % (bucket_name, path, d)),
-                  'name': d + '/',
-                  'last_modified':  directory_last_modified[d],
-                  } for d in directories]
+  for blob in blobs_dir_list:
+    name = blob.name
+    if not name.startswith(prefix):
+      continue
+    relative_blob_name = name[prefix_length:].lstrip('/')
+    if not relative_blob_name:
+      continue
+
+    top, _, rest = relative_blob_name.partition('/')
+    if name.endswith('/') or rest.strip('/'):
+      directories[top] = blob
+    else:
+      items.append({
+        'type': 'file',
+        'path': '%s/%s' % (bucket_name, name),
+        'name': top,
+        'last_modified': listing_last_modified(blob),
+      })
+
+  directory_path = '%s/%s' % (bucket_name, prefix)
+  items.extend({
+    'type': 'directory',
+    'path': '%s%s/' % (directory_path, d),
+    'name': d + '/',
+    'last_modified': listing_last_modified(blob),
+  } for d, blob in directories.items())
 
   return items
 
@@ -105,7 +176,7 @@ def parse_path(path):
 
 def prefixed_blobs(bucket_name, prefix, storage_client):
   return list(storage_client.list_blobs(
-    bucket_name, prefix=prefix))
+    bucket_name, prefix=prefix, retry=STORAGE_RETRY))
 
 
 def matching_blobs(path, storage_client):
@@ -123,14 +194,15 @@ def matching_blobs(path, storage_client):
   # List blobs in the bucket with the blob_path prefix
   blobs = prefixed_blobs(bucket_name, blob_path, storage_client)
 
-  # Find a blob that is not a directory name and fully matches the blob_path
-  # If there are any matches, we are retriving a single blob
-  blobs_matching = [b
-        for b in blobs
-        # TODO(cbwilkes): protect against empty names
-        if not re.match(".*/$", b.name) and b.name == blob_path]
+  return exact_blobs(blob_path, blobs)
 
-  return blobs_matching
+
+def exact_blobs(blob_path, blobs):
+  """Filter listed blobs down to a file named exactly blob_path."""
+  # TODO(cbwilkes): protect against empty names
+  return [b
+          for b in blobs
+          if b.name == blob_path and not b.name.endswith('/')]
 
 
 def matching_directory(path, storage_client):
@@ -176,26 +248,121 @@ def matching_directory_contents(path, storage_client):
   # TODO(cbwilkes): Return matching blobs for directories.
   bucket_name, blob_path = parse_path(path)
 
-  # List blobs in the bucket with the blob_path prefix
-  blobs = prefixed_blobs(bucket_name, blob_path, storage_client)
+  # List blobs in the bucket with the blob_path prefix, in parallel shards
+  return list(list_prefix(bucket_name, blob_path, storage_client))
 
-  return blobs
+
+def directory_exists(bucket_name, prefix, storage_client):
+  """Check for a directory placeholder or any blob below prefix."""
+  return bool(list(storage_client.list_blobs(
+    bucket_name, prefix=prefix, max_results=1, retry=STORAGE_RETRY)))
 
 
 def matching_bucket(path, storage_client):
   bucket_name, _ = parse_path(path)
 
   # Raises google.cloud.exceptions.NotFound – If the bucket is not found.
-  return storage_client.get_bucket(bucket_name)
+  return storage_client.get_bucket(bucket_name, retry=STORAGE_RETRY)
+
 
+@contextlib.contextmanager
+def blob_contents(blob, content_cache=None):
+  """Download the contents of a blob.
 
-def getPathContents(path, storage_client):
+  When a content cache is given, the blob's generation decides freshness. The
+  generation is taken from the blob's listing metadata, falling back to a
+  metadata-only reload when the blob was not listed.
+
+  Without a cache, the contents are buffered in memory when the memory
+  budget has room for them, and in a temporary file otherwise.
+
+  Yields:
+    A bytes-like object with the blob contents.
+  """
+  if content_cache is not None:
+    if blob.generation is None:
+      blob.reload(retry=STORAGE_RETRY)
+    with content_cache.read_through(blob) as buf:
+      if buf is not None:
+        yield buf
+        return
+
+  with BUDGET.try_reserve(estimated_content_size(blob)) as reserved:
+    if reserved:
+      file_bytes = BytesIO()
+      download_to_file(blob, file_bytes)
+      yield file_bytes.getbuffer()
+      return
+
+  METRICS.add('memory_spills')
+  with tempfile.TemporaryFile() as f:
+    download_to_file(blob, f)
+    if not f.tell():
+      yield b''
+      return
+    f.flush()
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+      yield buf
+
+
+def read_file_content(blob, content_format=None):
+  """Download a blob and encode its contents with file_content."""
+  with BUDGET.reserve(CONTENT_MEMORY_FACTOR * estimated_content_size(blob)):
+    with blob_contents(blob) as file_bytes:
+      return file_content(
+        blob.name, blob.content_type, file_bytes, content_format)
+
+
+def raw_contents(path, storage_client, keep_gzip=False, content_cache=None):
+  """Download the contents of a file as they are.
+
+  Args:
+    path: The path of the file.
+    storage_client: The storage client.
+    keep_gzip: Whether a gzip-encoded file is left compressed, as stored.
+    content_cache: The content cache that other contents are read through.
+  Returns:
+    A tuple of the file's Blob and its contents.
+  """
+  bucket_name, blob_path = parse_path(path or '/')
+  blob = None
+  if blob_path and not blob_path.endswith('/'):
+    blob = storage_client.bucket(bucket_name).get_blob(
+      blob_path, retry=STORAGE_RETRY)
+  if blob is None:
+    raise FileNotFound('File "%s" not found' % path)
+  if keep_gzip and is_gzip_encoded(blob):
+    stored = BytesIO()
+    download_stored(blob, stored)
+    return blob, stored.getvalue()
+  with BUDGET.reserve(estimated_content_size(blob)), \
+      blob_contents(blob, content_cache) as file_bytes:
+    return blob, bytes(file_bytes)
+
+
+def directory_children(blob_path, blobs):
+  """Filter listed blobs down to the files directly inside blob_path."""
+  prefix = blob_path
+  if prefix and not prefix.endswith('/'):
+    prefix += '/'
+
+  return [b
+          for b in blobs
+          if b.name.startswith(prefix) and b.name != prefix
+          and '/' not in b.name[len(prefix):]]
+
+
+def getPathContents(path, storage_client, content_cache=None, prefetcher=None,
+                    usage_cache=None, lazy_output_size=0, content_format=None):
   path = path or '/'
   addDir = '/' if re.match(".+/$", path) else ''
   path = os.path.normpath(path) + addDir
 
   if path == '/':
-    buckets = storage_client.list_buckets()
+    if prefetcher is not None:
+      prefetcher.cancel()
+
+    buckets = storage_client.list_buckets(retry=STORAGE_RETRY)
     return {
         'type':'directory',
         'content': [{
@@ -210,27 +377,45 @@ def getPathContents(path, storage_client):
 
     blobs_prefixed = prefixed_blobs(bucket_name, blob_path, storage_client)
 
-    blobs_matching = matching_blobs(path, storage_client)
+    # The file, if any, is in the same listing as the directory contents.
+    blobs_matching = exact_blobs(blob_path, blobs_prefixed)
 
     if len(blobs_matching) == 1: # Single blob
       blob = blobs_matching[0]
-      file_bytes = BytesIO()
-      blob.download_to_file(file_bytes)
-
-      return {
+      blob_name = '%s/%s' % (bucket_name, blob.name)
+      lazy_outputs = 0
+      with BUDGET.reserve(
+          CONTENT_MEMORY_FACTOR * estimated_content_size(blob)), \
+          blob_contents(blob, content_cache) as file_bytes:
+        if lazy_output_size and blob.name.endswith('.ipynb'):
+          file_bytes, lazy_outputs = strip_large_outputs(
+            blob_name, blob, file_bytes, lazy_output_size)
+        content_format, content = file_content(
+          blob.name, blob.content_type, file_bytes, content_format)
+
+      model = {
         'type': 'file',
         'content': {
-          'path': ('%s/%s' % (bucket_name, blob.name)),
+          'path': blob_name,
           'type': 'file',
           'mimetype': blob.content_type,
-          'content': base64.encodebytes(
-            file_bytes.getvalue()).decode('ascii'),
+          'format': content_format,
+          'content': content,
           'last_modified':  blob_last_modified(blob),
+          'generation': blob_generation(blob),
           }
         }
+      if lazy_outputs:
+        model['content']['lazy_outputs'] = lazy_outputs
+      return model
     else:
       contents = list_dir(bucket_name, blob_path, blobs_prefixed)
+      count_objects(len(blobs_prefixed))
       if contents: # Directory
+        if usage_cache is not None:
+          add_cached_usage(contents, usage_cache)
+        if prefetcher is not None:
+          prefetcher.prefetch(directory_children(blob_path, blobs_prefixed))
         return {
           'type': 'directory',
           'content': contents
@@ -239,7 +424,144 @@ def getPathContents(path, storage_client):
         raise FileNotFound('File "%s" not found' % path)
 
 
-def delete(path, storage_client):
+def stat(path, storage_client):
+  """Get the metadata of a file or directory without its contents.
+
+  A file takes a single metadata request.
+  """
+  path = path or '/'
+  if path == '/':
+    return {'type': 'directory', 'path': path, 'content': None}
+
+  bucket_name, blob_path = parse_path(path)
+  if blob_path and not blob_path.endswith('/'):
+    blob = storage_client.bucket(bucket_name).get_blob(
+      blob_path, retry=STORAGE_RETRY)
+    if blob is not None:
+      return {
+        'type': 'file',
+        'content': {
+          'path': '%s/%s' % (bucket_name, blob.name),
+          'type': 'file',
+          'mimetype': blob.content_type,
+          'format': None,
+          'content': None,
+          'size': blob.size,
+          'md5': blob.md5_hash,
+          'last_modified': blob_last_modified(blob),
+          'generation': blob_generation(blob),
+          }
+        }
+
+  if not blob_path or directory_exists(
+      bucket_name, add_directory_slash(blob_path), storage_client):
+    return {'type': 'directory', 'path': path, 'content': None}
+  raise FileNotFound('File "%s" not found' % path)
+
+
+def is_binary_content_type(content_type):
+  content_type = (content_type or '').split(';', 1)[0].strip().lower()
+  if content_type.endswith('+xml') or content_type.endswith('+json'):
+    return False
+  return (content_type in BINARY_CONTENT_TYPES
+          or content_type.startswith(BINARY_CONTENT_TYPE_PREFIXES))
+
+
+def file_content(name, content_type, file_bytes, content_format=None):
+  """Encode the contents of a file for a file model.
+
+  Without a requested format, notebooks are sent as JSON, other files that
+  decode as UTF-8 as text, and the rest, including anything with a binary
+  content type, as base64.
+
+  Args:
+    name: The object name.
+    content_type: The object's content type.
+    file_bytes: A bytes-like object with the file contents.
+    content_format: 'text', 'json', 'base64' or None to choose one.
+  Returns:
+    A tuple of the format and the content.
+  Raises:
+    Error if the contents cannot be sent in the requested format.
+  """
+  if content_format not in CONTENT_FORMATS + (None,):
+    raise Error('Error: Unknown format "%s"' % content_format)
+
+  if content_format == 'base64' or (
+      content_format is None and is_binary_content_type(content_type)):
+    return 'base64', base64.b64encode(file_bytes).decode('ascii')
+
+  try:
+    text = bytes(file_bytes).decode('utf-8')
+  except UnicodeDecodeError:
+    if content_format:
+      raise Error('Error: "%s" is not UTF-8 encoded text' % name)
+    return 'base64', base64.b64encode(file_bytes).decode('ascii')
+
+  if content_format == 'json' or (
+      content_format is None and name.endswith('.ipynb')):
+    try:
+      return 'json', json.loads(text)
+    except ValueError:
+      if content_format:
+        raise Error('Error: "%s" is not valid JSON' % name)
+  return 'text', text
+
+
+def strip_large_outputs(path, blob, file_bytes, min_size):
+  """Replace the outputs of a notebook of at least min_size bytes.
+
+  Returns:
+    A tuple of the notebook contents and the number of outputs replaced.
+  """
+  # The contents rather than the blob size, which is the compressed size of a
+  # gzip-encoded notebook.
+  if len(file_bytes) < min_size:
+    return file_bytes, 0
+  try:
+    nb = nbformat.reads(bytes(file_bytes).decode('utf-8'), as_version=4)
+  except Exception as e:
+    app_log.warning('Could not parse notebook %s: %s', path, e)
+    return file_bytes, 0
+  replaced = strip_outputs(nb, path, blob.generation, min_size)
+  if not replaced:
+    return file_bytes, 0
+  return nbformat.writes(nb).encode('utf-8'), replaced
+
+
+def read_notebook(path, storage_client, content_cache=None):
+  """Returns the stored notebook at path and its generation."""
+  blobs_matching = matching_blobs(path, storage_client)
+  if len(blobs_matching) != 1:
+    raise FileNotFound('File "%s" not found' % path)
+  blob = blobs_matching[0]
+  with blob_contents(blob, content_cache) as file_bytes:
+    nb = nbformat.reads(bytes(file_bytes).decode('utf-8'), as_version=4)
+  return nb, blob.generation
+
+
+def merge_lazy_outputs(model, storage_client, content_cache=None):
+  """Put back the outputs that were not loaded into a saved notebook.
+
+  Returns:
+    The model to upload, and the (reference, cell, output) positions of the
+    outputs that were put back.
+  """
+  def read(path):
+    return read_notebook(path, storage_client, content_cache)
+
+  if model.get('format') == 'json':
+    nb = model['content']
+    return model, merge_outputs(nb, read, LOCATIONS)
+  content = model.get('content')
+  if not isinstance(content, str) or LAZY_OUTPUT_KEY not in content:
+    return model, []
+  nb = nbformat.reads(content, as_version=nbformat.NO_CONVERT)
+  merged = merge_outputs(nb, read, LOCATIONS)
+  return dict(model, content=nbformat.writes(nb)), merged
+
+
+def delete(path, storage_client, usage_cache=None):
   path = path or '/'
   addDir = '/' if re.match(".+/$", path) else ''
   path = os.path.normpath(path) + addDir
@@ -251,50 +573,125 @@ def delete(path, storage_client):
 
     if len(blobs_matching) == 1: # Single blob
       blob = blobs_matching[0]
-      blob.delete()
+      delete_blob(blob)
+      record_removed(usage_cache, blob)
     elif not blobs_matching:
       # Fallback to deleting a directory if single blob is not found
       blobs_matching = matching_directory_contents(
         os.path.join(path, ''), storage_client)
 
+      # Keep going past failures, so that one error does not leave the
+      # directory half deleted without saying what is left.
+      errors = delete_blobs(blobs_matching, storage_client)
       for b in blobs_matching:
-        b.delete()
+        if (b.bucket.name, b.name) not in errors:
+          record_removed(usage_cache, b)
+      if errors:
+        (_, name), e = next(iter(errors.items()))
+        raise Error('Error: Failed to delete %d objects, including "%s": %s' % (
+          len(errors), name, e))
 
     return {}
 
 
-def upload(model, storage_client):
+def upload(model, storage_client, usage_cache=None, content_cache=None):
+  """Store an uploaded model, see UploadHandler.
+
+  Blocks on storage and compresses large text, so handlers call it on the
+  request threads with in_thread.
+
+  Returns:
+    The blob stored.
+  """
   bucket_name, blob_path = parse_path(model['path'])
 
-  def uploadModel(storage_client, model, blob_path):
-    bucket = storage_client.get_bucket(bucket_name)
+  if usage_cache is not None and model.get('chunk', -1) == -1 and (
+      'part' not in model):
+    # The final request of an upload. The size of any object it replaces is
+    # unknown, so the usage is recomputed on the next request for it.
+    usage_cache.invalidate(bucket_name, blob_path)
+
+  def uploadModel(storage_client, model, blob_path, if_generation_match=None,
+                  data=None, uncompressed_size=None):
+    bucket = storage_client.get_bucket(bucket_name, retry=STORAGE_RETRY)
     blob = bucket.blob(blob_path)
+    if data is None:
+      data = model_bytes(model)
+    if uncompressed_size is not None:
+      blob.content_encoding = 'gzip'
+      blob.metadata = {UNCOMPRESSED_SIZE_KEY: str(uncompressed_size)}
+    # Each upload writes the whole object, so repeating it is harmless.
+    kwargs = {'retry': STORAGE_RETRY}
+    if if_generation_match is not None:
+      kwargs['if_generation_match'] = if_generation_match
     if model['format'] == 'base64':
-      bytes_file = BytesIO(base64.b64decode(model['content']))
-      blob.upload_from_file(bytes_file)
-    elif model['format'] == 'json':
-      blob.upload_from_string(json.dumps(model['content']))
+      blob.upload_from_file(BytesIO(data), **kwargs)
     else:
-      blob.upload_from_string(model['content'])
+      blob.upload_from_string(data, content_type='text/plain', **kwargs)
+    return blob
 
   def appendChunk(storage_client, model, last, temp, composite, deleteLast=False):
-    bucket = storage_client.get_bucket(bucket_name)
-    uploadModel(storage_client, model, temp)
+    bucket = storage_client.bucket(bucket_name)
+    blob_temp = uploadModel(storage_client, model, temp)
+
+    blob_last = bucket.get_blob(last, retry=STORAGE_RETRY)
+    if blob_last is None:
+      raise FileNotFound(
+        'Error: The earlier chunks of "%s" are missing' % model['path'])
+    if composite == last:
+      generation = blob_last.generation
+    else:
+      existing = bucket.get_blob(composite, retry=STORAGE_RETRY)
+      generation = existing.generation if existing is not None else 0
 
+    # The precondition keeps a retried compose from appending the chunk twice.
     blob = bucket.blob(composite)
+    blob.compose([blob_last, blob_temp], if_generation_match=generation,
+                 retry=STORAGE_RETRY)
 
-    blob_last = bucket.blob(last)
-    blob_temp = bucket.blob(temp)
-
-    blob.compose([blob_last, blob_temp])
-
-    blob_temp.delete()
+    delete_blob(blob_temp)
 
     if deleteLast:
-      blob_last.delete()
+      delete_blob(blob_last)
+
+  if 'upload_id' in model:
+    return upload_slice(model, bucket_name, blob_path, storage_client)
 
   if 'chunk' not in model:
-    uploadModel(storage_client, model, blob_path)
+    merged = []
+    if blob_path.endswith('.ipynb'):
+      model, merged = merge_lazy_outputs(model, storage_client, content_cache)
+    data = model_bytes(model)
+    stored, uncompressed_size = data, None
+    if model['format'] != 'base64' and should_compress(len(data)):
+      # Decompressive transcoding serves the original text to other clients.
+      stored, uncompressed_size = gzip_compress(data), len(data)
+      METRICS.add('gzip_saves')
+      METRICS.add('gzip_saved_bytes', len(data) - len(stored))
+    if len(data) >= SKIP_UNCHANGED_MIN_BYTES:
+      blob = unchanged_blob(bucket_name, blob_path, stored, storage_client)
+      if blob is not None:
+        METRICS.add('unchanged_saves')
+        METRICS.add('unchanged_save_bytes', len(data))
+        if merged:
+          LOCATIONS.record(model['path'], blob.generation, merged)
+        return blob
+
+    expected_generation = model.get('expected_generation')
+    try:
+      # A generation of 0 means the file must not exist yet.
+      blob = uploadModel(
+        storage_client, model, blob_path,
+        None if expected_generation is None else int(expected_generation),
+        stored, uncompressed_size)
+    except PreconditionFailed:
+      raise FileChanged(
+        'Error: "%s" was changed by someone else since it was opened' %
+        model['path'])
+    if merged:
+      # The placeholders the client keeps now refer to this generation.
+      LOCATIONS.record(model['path'], blob.generation, merged)
+    return blob
   else:
     if model['chunk'] == 1:
       blob_path_composite = '%s.temporary' % (blob_path)
@@ -315,10 +712,123 @@ def upload(model, storage_client):
         '%s.temporary-%s.tmp' % (blob_path, model['chunk']),
         '%s.temporary' % (blob_path))
 
-  bucket = storage_client.get_bucket(bucket_name)
+  bucket = storage_client.get_bucket(bucket_name, retry=STORAGE_RETRY)
   return bucket.blob(blob_path)
 
 
+def model_bytes(model):
+  """The bytes to store for the content of an uploaded model."""
+  if model['format'] == 'base64':
+    return base64.b64decode(model['content'])
+  elif model['format'] == 'json':
+    return json.dumps(model['content']).encode('utf-8')
+  else:
+    return model['content'].encode('utf-8')
+
+
+def unchanged_blob(bucket_name, blob_path, data, storage_client):
+  """Returns the stored blob if it already holds data, otherwise None.
+
+  Takes one metadata request, and compares the size and CRC32C. For a
+  gzip-encoded save, data are the compressed bytes, which are the same for
+  the same contents.
+  """
+  blob = storage_client.bucket(bucket_name).get_blob(
+    blob_path, retry=STORAGE_RETRY)
+  if blob is None or blob.size != len(data) or not blob.crc32c:
+    return None
+  return blob if blob.crc32c == crc32c(data) else None
+
+
+def upload_part_prefix(blob_path, upload_id):
+  if not UPLOAD_ID_PATTERN.match(str(upload_id)):
+    raise ValueError('Error: Invalid upload ID "%s"' % upload_id)
+  return '%s.temporary-%s-' % (blob_path, upload_id)
+
+
+def upload_part_name(blob_path, upload_id, part):
+  return '%s%05d.tmp' % (upload_part_prefix(blob_path, upload_id), part)
+
+
+def compose_tree(bucket, sources, destination_name, intermediate_prefix):
+  """Compose any number of blobs into one, in order.
+
+  A compose request takes at most MAX_COMPOSE_SOURCES sources, so longer lists
+  are first composed in groups into intermediate blobs named with
+  intermediate_prefix, one level at a time with the groups of a level composed
+  in parallel. Deleting the intermediate blobs is left to the caller.
+
+  Returns:
+    The composed Blob.
+  """
+  level = 0
+  while len(sources) > MAX_COMPOSE_SOURCES:
+    level += 1
+
+    def compose_group(index):
+      group = sources[index:index + MAX_COMPOSE_SOURCES]
+      blob = bucket.blob('%sc%d-%05d.tmp' % (intermediate_prefix, level, index))
+      blob.compose(group, retry=STORAGE_RETRY)
+      return blob
+
+    results = parallel_map(
+      compose_group, range(0, len(sources), MAX_COMPOSE_SOURCES))
+    for _, e in results:
+      if e:
+        raise e
+    sources = [blob for blob, _ in results]
+
+  destination = bucket.blob(destination_name)
+  destination.compose(sources, retry=STORAGE_RETRY)
+  return destination
+
+
+def upload_slice(model, bucket_name, blob_path, storage_client):
+  """Handle one request of a parallel sliced upload.
+
+  The client sends the slices of a file concurrently, each with the
+  'upload_id' of the upload and its 1-based 'part' number, and each slice is
+  written as an independent part object. A last request with the number of
+  'parts' composes them into the file, or one with 'abort' set gives up. Both
+  delete every part and intermediate object of the upload.
+  """
+  bucket = storage_client.bucket(bucket_name)
+  upload_id = model['upload_id']
+  prefix = upload_part_prefix(blob_path, upload_id)
+
+  if 'part' in model:
+    blob = bucket.blob(upload_part_name(blob_path, upload_id, model['part']))
+    blob.upload_from_file(BytesIO(base64.b64decode(model['content'])),
+                          retry=STORAGE_RETRY)
+    return blob
+
+  try:
+    if not model.get('abort'):
+      parts = int(model['parts'])
+      if parts < 1:
+        raise ValueError('Error: An upload needs at least one part')
+      return compose_tree(
+        bucket,
+        [bucket.blob(upload_part_name(blob_path, upload_id, part))
+         for part in range(1, parts + 1)],
+        blob_path,
+        prefix)
+  finally:
+    delete_upload_parts(bucket_name, prefix, storage_client)
+
+
+def delete_upload_parts(bucket_name, prefix, storage_client):
+  try:
+    errors = delete_blobs(
+      list(storage_client.list_blobs(
+        bucket_name, prefix=prefix, retry=STORAGE_RETRY)),
+      storage_client)
+  except Exception as e:
+    errors = {(bucket_name, prefix): e}
+  for (_, name), e in errors.items():
+    app_log.warning('Could not delete upload part %s: %s', name, e)
+
+
 def generate_next_unique_name(
   bucket_name,
   blob_name,
@@ -347,9 +857,7 @@ def generate_next_unique_name(
   if is_dir:
     proposed_blob_name = generate_directory_name(
       blob_name, name_addendum)
-    while matching_directory(
-      os.path.normpath('/%s/%s' % (bucket_name, proposed_blob_name)) + '/',
-      storage_client):
+    while directory_exists(bucket_name, proposed_blob_name, storage_client):
       if not name_addendum:
         name_addendum = 1
       else:
@@ -373,12 +881,18 @@ def generate_next_unique_name(
     return generate_name(blob_name, name_addendum)
 
 
-def copy(path, directory, storage_client):
+def copy_destination(path, directory, storage_client):
+  """Choose where a copy of path inside directory will be written.
+
+  Returns:
+    The source Blob, or None when path is a directory, the destination bucket
+    name and the new blob name. Directory names end with a '/'.
+  """
 
   def copyFileName(path, directory):
     _, blob_name = parse_path(path)
     destination_bucket, destination_blob_name_dir = parse_path(directory)
-    basename = os.path.basename(blob_name)
+    basename = os.path.basename(blob_name.rstrip('/'))
 
     if not basename:
       raise ValueError('"path" is not a valid blob name.')
@@ -394,34 +908,89 @@ def copy(path, directory, storage_client):
     raise ValueError('Error: Cannot copy file to the root directory. '
                      'Only GCS buckets can be created here.')
 
-  blobs_matching = matching_blobs(path, storage_client)
-  if not blobs_matching:
+  bucket_name, blob_path = parse_path(path)
+  source_prefix = '%s/' % blob_path.rstrip('/')
+
+  # A metadata request and a one-object listing, rather than a listing of
+  # the whole directory, which may hold millions of objects.
+  source_blob = None
+  if blob_path and not blob_path.endswith('/'):
+    source_blob = storage_client.bucket(bucket_name).get_blob(
+      blob_path, retry=STORAGE_RETRY)
+  if source_blob is None and (
+      not blob_path.strip('/')
+      or not directory_exists(bucket_name, source_prefix, storage_client)):
     raise ValueError('Error: Blob not found "%s"' % (path))
 
-  current_bucket = matching_bucket(path, storage_client)
   destination_bucket_name, new_blob_name = copyFileName(path, directory)
 
   new_blob_name = generate_next_unique_name(
-    destination_bucket_name, new_blob_name, storage_client, TEMPLATE_COPY_FILE)
+    destination_bucket_name, new_blob_name, storage_client,
+    TEMPLATE_COPY_FILE, is_dir=source_blob is None)
+
+  return source_blob, destination_bucket_name, new_blob_name
+
+
+def copy(path, directory, storage_client, usage_cache=None):
+  source_blob, destination_bucket_name, new_blob_name = copy_destination(
+    path, directory, storage_client)
+  destination_bucket = storage_client.get_bucket(
+    destination_bucket_name, retry=STORAGE_RETRY)
+
+  if source_blob: # Copy single blob
+    blob = rewrite_blob(source_blob, destination_bucket, new_blob_name)
+    record_added(usage_cache, blob, source_blob.size)
+    return blob
+  else: # Copy directory
+    bucket_name, blob_path = parse_path(path)
+    copy_directory(bucket_name, '%s/' % blob_path.rstrip('/'),
+                   destination_bucket, new_blob_name, storage_client,
+                   usage_cache)
+
+    return destination_bucket.blob(new_blob_name)
+
+
+def copy_directory(bucket_name, source_prefix, destination_bucket,
+                   destination_prefix, storage_client, usage_cache=None):
+  """Copy every blob below source_prefix using parallel rewrites.
+
+  The source is enumerated in parallel shards, and rewrites start while the
+  rest is still being listed.
+
+  Raises:
+    Error if any blob could not be copied.
+  """
+  def source_blobs():
+    for b in list_prefix(bucket_name, source_prefix, storage_client):
+      # Skip the new copies when a directory is copied into itself.
+      if (destination_bucket.name == bucket_name
+          and b.name.startswith(destination_prefix)):
+        continue
+      yield b
+
+  def copy_blob(b):
+    record_added(usage_cache, rewrite_blob(
+      b, destination_bucket, destination_prefix + b.name[len(source_prefix):]),
+      b.size)
 
-  destination_bucket = storage_client.get_bucket(destination_bucket_name)
+  failures = parallel_for_each(copy_blob, source_blobs())
+  if failures:
+    b, e = failures[0]
+    raise Error('Error: Failed to copy %d objects, including "%s": %s' % (
+      len(failures), b.name, e))
 
-  return current_bucket.copy_blob(
-    blobs_matching[0], destination_bucket, new_blob_name)
 
+def add_directory_slash(path):
+  return '%s/' % path if not path or path[-1] != '/' else path
 
-def move(old, new, storage_client):
-  def add_directory_slash(path):
-    return '%s/' % path if not path or path[-1] != '/' else path
 
+def check_move_destination(old, new, storage_client):
+  """Raises ValueError if old cannot be moved to new."""
   _, blob_path_new = parse_path(new)
   if not blob_path_new:
     raise ValueError('Error: Cannot copy file to the root directory. '
                      'Only GCS buckets can be created here.')
 
-  blobs_matching = matching_blobs(old, storage_client)
-  destination_bucket = matching_bucket(new, storage_client)
-
   new_blob = matching_blobs(new, storage_client)
   if new_blob:
     raise ValueError(
@@ -436,155 +1005,996 @@ def move(old, new, storage_client):
       'directory already exist with the same name. (%s)' % new)
 
 
+def move(old, new, storage_client, usage_cache=None):
+  _, blob_path_new = parse_path(new)
+  check_move_destination(old, new, storage_client)
+
+  blobs_matching = matching_blobs(old, storage_client)
+  destination_bucket = matching_bucket(new, storage_client)
+
   # Fallback to moving directory if single blob is not found
   if not blobs_matching:
     blobs_matching = matching_directory_contents(
       add_directory_slash(old), storage_client)
 
     _, blob_path_old = parse_path(old)
-    for b in blobs_matching:
+
+    def move_one(b):
       new_blob_name = re.sub(r'^%s' % blob_path_old, blob_path_new,  b.name)
-      destination_bucket.rename_blob(b, new_blob_name)
+      record_moved(usage_cache, b,
+                   move_blob(b, destination_bucket, new_blob_name))
+
+    failures = parallel_for_each(move_one, blobs_matching)
+    if failures:
+      b, e = failures[0]
+      raise Error('Error: Failed to move %d objects, including "%s": %s' % (
+        len(failures), b.name, e))
 
     return matching_directory(add_directory_slash(new), storage_client)[0]
   else: # Move single blob
-    return destination_bucket.rename_blob(blobs_matching[0], blob_path_new)
+    blob = move_blob(blobs_matching[0], destination_bucket, blob_path_new)
+    record_moved(usage_cache, blobs_matching[0], blob)
+    return blob
 
 
-def create_storage_client():
-  return storage.Client(
-    client_info=ClientInfo(
-      user_agent='jupyterlab_gcsfilebrowser/{}'.format(VERSION)
-      )
-    )
+def record_added(usage_cache, blob, size=None):
+  """Add a blob created by this server to the cached directory usage."""
+  if usage_cache is not None:
+    usage_cache.added(blob.bucket.name, blob.name,
+                      blob.size if size is None else size, blob.updated)
 
 
-def new_file(file_type, ext, path, storage_client):
-  model = dict()
-  content = ''
-  file_format = 'text'
+def record_removed(usage_cache, blob):
+  """Remove a blob deleted by this server from the cached directory usage."""
+  if usage_cache is not None:
+    usage_cache.removed(blob.bucket.name, blob.name, blob.size)
 
-  if file_type and file_type in ('notebook', 'file'):
-    if file_type == 'notebook':
-      ext = 'ipynb'
-      file_format = 'json'
-      content = {
-        "cells": [],
-        "metadata": {},
-        "nbformat": 4,
-        "nbformat_minor": 4
-      }
 
-    new_blob_name = '%s/%s.%s' % (
-      path, NEW_FILE_NAME, ext)
+def record_moved(usage_cache, old_blob, new_blob):
+  record_removed(usage_cache, old_blob)
+  record_added(usage_cache, new_blob, old_blob.size)
 
-    destination_bucket_name, blob_path = parse_path(new_blob_name)
 
-    new_blob_name = generate_next_unique_name(
-      destination_bucket_name,
-      blob_path,
-      storage_client,
-      TEMPLATE_NEW_FILE)
+def invalidate_usage(usage_cache, *paths):
+  """Forget the cached usage of local paths changed in unknown ways."""
+  if usage_cache is None:
+    return
+  for path in paths:
+    if path:
+      bucket_name, blob_path = parse_path(path)
+      usage_cache.invalidate(bucket_name, blob_path.strip('/'))
 
-    model['path'] = '%s/%s' % (
-      destination_bucket_name, new_blob_name)
-    model['content'] = content
-    model['format'] = file_format
-    blob = upload(model, storage_client)
 
-    file_bytes = BytesIO()
-    blob.download_to_file(file_bytes)
+def parallel_map(fn, items, max_workers=MAX_PARALLEL_REQUESTS):
+  """Call fn on every item using a pool of threads.
 
-    return {
-      'type': 'file',
-      'content': {
-        'path': ('%s/%s' % (blob.bucket.name, blob.name)),
-        'name': os.path.basename(blob.name),
-        'type': 'file',
-        'mimetype': blob.content_type,
-        'content': base64.encodebytes(
-          file_bytes.getvalue()).decode('ascii')
-      }
-    }
-  elif file_type and file_type == 'directory':
-    new_blob_name = '%s/%s/' % (path, NEW_DIRECTORY_NAME)
+  Returns:
+    A list of (result, exception) tuples in the same order as items.
+  """
+  items = list(items)
+  results = [None] * len(items)
 
-    destination_bucket_name, blob_path = parse_path(new_blob_name)
+  def call(indexed_item):
+    index, item = indexed_item
+    try:
+      results[index] = (fn(item), None)
+    except Exception as e:
+      results[index] = (None, e)
+      raise
 
-    new_blob_name = generate_next_unique_name(
-      destination_bucket_name,
-      blob_path,
-      storage_client,
-      TEMPLATE_NEW_FILE,
-      is_dir=True)
+  parallel_for_each(call, enumerate(items), min(max_workers, len(items)))
+  return results
 
-    model['path'] = '%s/%s' % (
-      destination_bucket_name, new_blob_name)
-    model['content'] = ''
-    model['format'] = 'text'
-    blob = upload(model, storage_client)
 
-    return {
-      'type': 'directory',
-      'path': ('%s/%s' % (blob.bucket.name, blob.name)),
-      'name': blob.name,
-      'content': []
-    }
+def parallel_for_each(fn, items, max_workers=MAX_PARALLEL_REQUESTS):
+  """Call fn on every item of a possibly lazy iterable using a thread pool.
 
+  The number of calls in flight follows the adaptive CONCURRENCY limit, up
+  to max_workers: it shrinks when GCS throttles requests and grows back as
+  they succeed. Items are only taken from the iterable when a call can
+  start, so a lazy listing is only read as fast as the pool works through it.
 
-def checkpoint_prefix(path):
-  checkpoint_dir = os.path.join(os.path.dirname(path), CHECKPOINT_FOLDER)
+  Returns:
+    A list of (item, exception) tuples for the calls that failed.
+  """
+  failures = []
+  condition = threading.Condition()
+  in_flight = [0]
 
-  return os.path.join(
-    os.path.dirname(path),
-    CHECKPOINT_FOLDER,
-    os.path.basename(path)
-    )
+  def call(item):
+    try:
+      fn(item)
+      CONCURRENCY.succeeded()
+    except Exception as e:
+      if is_throttled(e):
+        CONCURRENCY.throttled()
+      failures.append((item, e))
+    finally:
+      with condition:
+        in_flight[0] -= 1
+        condition.notify()
+
+  if max_workers < 1:
+    return failures
+
+  with ThreadPoolExecutor(max_workers=max_workers) as pool:
+    for item in items:
+      with condition:
+        while in_flight[0] >= min(max_workers, CONCURRENCY.limit):
+          condition.wait()
+        in_flight[0] += 1
+      count_objects(1)
+      # Calls run in the caller's context, so that their storage requests
+      # count towards the request that made them.
+      pool.submit(contextvars.copy_context().run, call, item)
+
+  return failures
+
+
+def rewrite_blob(source_blob, destination_bucket, new_blob_name):
+  """Copy a blob server-side, following rewrite tokens until it completes.
+
+  Unlike Bucket.copy_blob, this handles large objects copied across locations
+  or storage classes, which need more than one rewrite call.
+  """
+  destination_blob = destination_bucket.blob(new_blob_name)
+  # Writing the same source generation again is harmless, so the rewrite is
+  # safe to retry once it is pinned to the listed generation.
+  token = None
+  while True:
+    token, _, _ = destination_blob.rewrite(
+      source_blob, token=token,
+      if_source_generation_match=source_blob.generation, retry=STORAGE_RETRY)
+    if token is None:
+      return destination_blob
+
+
+def delete_blob(blob):
+  """Delete a blob, unless it changed since it was listed.
+
+  A blob that is already gone counts as deleted, which also covers a retry of
+  a delete that succeeded.
+  """
+  try:
+    blob.delete(if_generation_match=blob.generation, retry=STORAGE_RETRY)
+  except NotFound:
+    pass
 
 
-def checkpoint_filename(path, checkpoint_id):
-  checkpoint_dir = os.path.join(os.path.dirname(path), CHECKPOINT_FOLDER)
+def move_blob(blob, destination_bucket, new_blob_name):
+  """Copy a blob to its new name, then delete the original.
 
-  return '%s%s' % (checkpoint_prefix(path), checkpoint_id)
+  Returns:
+    The new Blob.
+  """
+  new_blob = rewrite_blob(blob, destination_bucket, new_blob_name)
+  delete_blob(blob)
+  return new_blob
 
 
-def create_checkpoint(path, storage_client):
-  checkpoint_pathname = checkpoint_filename(path, CHECKPOINT_ID)
+def delete_blobs(blobs, storage_client):
+  """Delete blobs using batched JSON API requests.
 
-  content = getPathContents(path, storage_client)
+  Returns:
+    A dict mapping (bucket name, blob name) to the exception raised while
+    deleting that blob.
+  """
+  def delete_chunk(chunk):
+    errors = {}
+    try:
+      with storage_client.batch():
+        for b in chunk:
+          b.delete(if_generation_match=b.generation)
+    except Exception:
+      # A failed batch only reports one of its errors. Retry the requests one
+      # by one to find out which blobs could not be deleted.
+      for b in chunk:
+        try:
+          delete_blob(b)
+        except Exception as e:
+          errors[(b.bucket.name, b.name)] = e
+    return errors
+
+  chunks = [blobs[i:i + BATCH_SIZE] for i in range(0, len(blobs), BATCH_SIZE)]
+
+  errors = {}
+  for chunk_errors, e in parallel_map(delete_chunk, chunks):
+    if e:
+      raise e
+    errors.update(chunk_errors)
+  return errors
+
+
+class PathResolver(object):
+  """Resolves many paths against shared, cached listings.
+
+  Paths that share a parent directory are resolved from a single delimited
+  listing of that directory, rather than from a listing per path.
+  """
 
-  model = {
-    'format': 'base64',
-    'content': content['content']['content'],
-    'path': checkpoint_pathname,
-  }
+  def __init__(self, storage_client):
+    self.storage_client = storage_client
+    self._buckets = {}
+    self._listings = {}
+    self._contents = {}
+    self._reserved = set()
+
+  def bucket(self, bucket_name):
+    if bucket_name not in self._buckets:
+      self._buckets[bucket_name] = self.storage_client.bucket(bucket_name)
+    return self._buckets[bucket_name]
+
+  def _listing(self, bucket_name, blob_path):
+    """List the directory containing blob_path.
+
+    Returns:
+      A dict of blob name to Blob, and a set of subdirectory prefixes.
+    """
+    parent = posixpath.dirname(blob_path.rstrip('/'))
+    prefix = parent + '/' if parent else ''
+
+    if (bucket_name, prefix) not in self._listings:
+      iterator = self.storage_client.list_blobs(
+        bucket_name, prefix=prefix, delimiter='/', retry=STORAGE_RETRY)
+      blobs = {b.name: b for b in iterator}
+      self._listings[(bucket_name, prefix)] = (blobs, set(iterator.prefixes))
+    return self._listings[(bucket_name, prefix)]
+
+  def file(self, path):
+    """Find the Blob for a file path.
+
+    Returns:
+      The Blob, or None if no file exists at path.
+    """
+    bucket_name, blob_path = parse_path(path)
+    if not blob_path or blob_path.endswith('/'):
+      return None
 
-  blob = upload(model, storage_client)
+    blobs, _ = self._listing(bucket_name, blob_path)
+    return blobs.get(blob_path)
 
-  return {
-          'checkpoint': {
-            'id': CHECKPOINT_ID,
-            'last_modified': blob_last_modified(blob)
-          }
-        }
+  def is_directory(self, path):
+    bucket_name, blob_path = parse_path(path)
+    if not blob_path.strip('/'):
+      return False
 
+    directory = blob_path.rstrip('/') + '/'
+    blobs, prefixes = self._listing(bucket_name, blob_path)
+    return directory in prefixes or directory in blobs
 
-def list_checkpoints(path, storage_client):
-  bucket_name, blob_path = parse_path(checkpoint_prefix(path))
-  blobs =  prefixed_blobs(bucket_name, blob_path, storage_client)
-  return {
-            'checkpoints': [{
-              'id': CHECKPOINT_ID,
-              'last_modified': blob_last_modified(blob)
-            } for blob in blobs]
-          }
+  def directory_contents(self, path):
+    """List every blob below a directory, including its placeholder."""
+    bucket_name, blob_path = parse_path(path)
+    prefix = blob_path.rstrip('/') + '/'
+
+    if (bucket_name, prefix) not in self._contents:
+      self._contents[(bucket_name, prefix)] = prefixed_blobs(
+        bucket_name, prefix, self.storage_client)
+    return self._contents[(bucket_name, prefix)]
+
+  def unique_name(self, bucket_name, blob_name, template, is_dir=False):
+    """Pick a free name, like generate_next_unique_name.
+
+    Names handed out earlier by this resolver count as taken, so that several
+    copies of the same file planned together get distinct names.
+    """
+    if is_dir:
+      root, ext = blob_name.rstrip('/'), '/'
+      exists = self.is_directory
+    else:
+      root, ext = os.path.splitext(blob_name)
+      exists = self.file
+
+    name_addendum = 0
+    while True:
+      addendum = template % name_addendum if name_addendum else ''
+      proposed_blob_name = '%s%s%s' % (root, addendum, ext)
+      if ((bucket_name, proposed_blob_name) not in self._reserved
+          and not exists('%s/%s' % (bucket_name, proposed_blob_name))):
+        self._reserved.add((bucket_name, proposed_blob_name))
+        return proposed_blob_name
+      name_addendum += 1
+
+
+class BulkItem(object):
+  """The planned work and result of one operation in a bulk request."""
+
+  def __init__(self, operation):
+    self.operation = operation
+    self.rewrites = []
+    self.deletes = []
+    self.path = None
+    self.error = None
+
+  def result(self):
+    result = dict(self.operation)
+    if self.error:
+      result['status'] = 'error'
+      result['error'] = {'message': str(self.error)}
+    else:
+      result['status'] = 'ok'
+      if self.path:
+        result['path'] = self.path
+    return result
+
+
+def plan_delete(item, resolver):
+  path = item.operation['localPath']
+  blob = resolver.file(path)
+  if blob:
+    item.deletes = [blob]
+  elif resolver.is_directory(path):
+    item.deletes = resolver.directory_contents(path)
+  else:
+    raise FileNotFound('File "%s" not found' % path)
 
 
-def restore_checkpoint(path, checkpoint_id, storage_client):
-  checkpoint_pathname = checkpoint_filename(path, checkpoint_id)
-  content = getPathContents(checkpoint_pathname, storage_client)
+def plan_move(item, resolver):
+  old, new = item.operation['oldLocalPath'], item.operation['newLocalPath']
+  bucket_name_new, blob_path_new = parse_path(new)
+  if not blob_path_new:
+    raise ValueError('Error: Cannot copy file to the root directory. '
+                     'Only GCS buckets can be created here.')
 
-  model = {
+  if resolver.file(new):
+    raise ValueError(
+      'Error: Cannot move object. A destination '
+      'object already exist with the same name.')
+  if resolver.is_directory(new):
+    raise ValueError(
+      'Error: Cannot move object. The destination '
+      'directory already exist with the same name. (%s)' % new)
+
+  destination_bucket = resolver.bucket(bucket_name_new)
+  blob = resolver.file(old)
+  if blob:
+    item.rewrites = [(blob, destination_bucket, blob_path_new)]
+    item.deletes = [blob]
+  elif resolver.is_directory(old):
+    _, blob_path_old = parse_path(old)
+    old_prefix = blob_path_old.rstrip('/') + '/'
+    new_prefix = blob_path_new.rstrip('/') + '/'
+    blobs = resolver.directory_contents(old)
+    item.rewrites = [
+      (b, destination_bucket, new_prefix + b.name[len(old_prefix):])
+      for b in blobs]
+    item.deletes = blobs
+  else:
+    raise FileNotFound('File "%s" not found' % old)
+
+  item.path = '%s/%s' % (bucket_name_new, blob_path_new)
+
+
+def plan_copy(item, resolver):
+  path, directory = item.operation['localPath'], item.operation['toLocalDir']
+  if directory in ('/', ''):
+    raise ValueError('Error: Cannot copy file to the root directory. '
+                     'Only GCS buckets can be created here.')
+
+  _, blob_path = parse_path(path)
+  destination_bucket_name, destination_dir = parse_path(directory)
+  destination_bucket = resolver.bucket(destination_bucket_name)
+  destination_dir = destination_dir.strip('/')
+  basename = os.path.basename(blob_path.rstrip('/'))
+  new_blob_name = ('%s/%s' % (destination_dir, basename)
+                   if destination_dir else basename)
+
+  blob = resolver.file(path)
+  if blob:
+    new_blob_name = resolver.unique_name(
+      destination_bucket_name, new_blob_name, TEMPLATE_COPY_FILE)
+    item.rewrites = [(blob, destination_bucket, new_blob_name)]
+  elif resolver.is_directory(path):
+    new_blob_name = resolver.unique_name(
+      destination_bucket_name, new_blob_name, TEMPLATE_COPY_FILE, is_dir=True)
+    source_prefix = '%s/' % blob_path.rstrip('/')
+    item.rewrites = [
+      (b, destination_bucket, new_blob_name + b.name[len(source_prefix):])
+      for b in resolver.directory_contents(path)]
+  else:
+    raise ValueError('Error: Blob not found "%s"' % (path))
+
+  item.path = '%s/%s' % (destination_bucket_name, new_blob_name)
+
+
+BULK_PLANNERS = {
+  'delete': plan_delete,
+  'move': plan_move,
+  'copy': plan_copy,
+}
+
+
+def bulk(operations, storage_client):
+  """Run many delete, move and copy operations as one batch.
+
+  All paths are resolved up front against shared listings. The planned
+  copies then run on a parallel rewrite pool, and the deletes, including the
+  sources of moves, go through batched JSON API requests.
+
+  Returns:
+    A list with the result of each operation, in request order.
+  """
+  resolver = PathResolver(storage_client)
+  items = [BulkItem(operation) for operation in operations]
+
+  for item in items:
+    try:
+      planner = BULK_PLANNERS.get(item.operation.get('action'))
+      if not planner:
+        raise ValueError(
+          'Error: Unknown action "%s"' % item.operation.get('action'))
+      planner(item, resolver)
+    except Exception as e:
+      item.error = e
+
+  rewrites = [(item, rewrite)
+              for item in items if not item.error
+              for rewrite in item.rewrites]
+  results = parallel_map(
+    lambda item_rewrite: rewrite_blob(*item_rewrite[1]), rewrites)
+  for (item, _), (_, e) in zip(rewrites, results):
+    if e and not item.error:
+      item.error = e
+
+  # Only delete sources once every copy for the operation succeeded.
+  deletes = {}
+  for item in items:
+    if not item.error:
+      for b in item.deletes:
+        deletes.setdefault((b.bucket.name, b.name), (b, []))[1].append(item)
+
+  errors = delete_blobs([b for b, _ in deletes.values()], storage_client)
+  for key, e in errors.items():
+    for item in deletes[key][1]:
+      if not item.error:
+        item.error = e
+
+  return [item.result() for item in items]
+
+
+def chunked(iterable, size):
+  chunk = []
+  for item in iterable:
+    chunk.append(item)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def job_params(job_obj, storage_client):
+  """Validate a job request and resolve the parameters of its runner.
+
+  Destination checks and unique names are resolved before the job is queued,
+  so that a resumed job carries on with the same destination.
+  """
+  action = job_obj.get('action')
+  if action == 'delete':
+    _, blob_path = parse_path(job_obj['localPath'])
+    if not blob_path.strip('/'):
+      raise ValueError('Error: Cannot delete a bucket.')
+    return {'path': job_obj['localPath']}
+  elif action == 'move':
+    check_move_destination(
+      job_obj['oldLocalPath'], job_obj['newLocalPath'], storage_client)
+    return {'old': job_obj['oldLocalPath'], 'new': job_obj['newLocalPath']}
+  elif action == 'copy':
+    _, destination_bucket_name, new_blob_name = copy_destination(
+      job_obj['localPath'], job_obj['toLocalDir'], storage_client)
+    return {
+      'path': job_obj['localPath'],
+      'destination_bucket': destination_bucket_name,
+      'destination': new_blob_name,
+      }
+  raise ValueError('Error: Unknown action "%s"' % action)
+
+
+def start_job(job_manager, job_obj, storage_client, usage_cache=None):
+  """Validate a job request and queue it.
+
+  Returns:
+    The new Job.
+  """
+  params = job_params(job_obj, storage_client)
+  job = job_manager.submit(job_obj['action'], params)
+  paths = [params.get(key) for key in ('path', 'old', 'new')]
+  if 'destination' in params:
+    paths.append('%s/%s' % (params['destination_bucket'], params['destination']))
+  # Usage cached while the job runs may still be stale until it expires.
+  invalidate_usage(usage_cache, *paths)
+  return job
+
+
+def is_file(path, storage_client):
+  """Whether path names an object rather than a directory or bucket.
+
+  Takes a single metadata request, however large the directory.
+  """
+  bucket_name, blob_path = parse_path(path)
+  if not blob_path or blob_path.endswith('/'):
+    return False
+  return storage_client.bucket(bucket_name).get_blob(
+    blob_path, retry=STORAGE_RETRY) is not None
+
+
+def directory_job(job_manager, job_obj, storage_client, usage_cache=None):
+  """Queue a delete, move or copy of a directory as a background job.
+
+  Files are left to the caller, which handles them within the request.
+
+  Returns:
+    The new Job, or None if the source is a file, a bucket or the root, or
+    there is no job manager.
+  """
+  path = job_obj.get('oldLocalPath', job_obj.get('localPath'))
+  _, blob_path = parse_path(path or '/')
+  if (job_manager is None or not blob_path.strip('/')
+      or is_file(path, storage_client)):
+    return None
+  return start_job(job_manager, job_obj, storage_client, usage_cache)
+
+
+def bulk_with_jobs(operations, storage_client, job_manager=None,
+                   usage_cache=None):
+  """Run a bulk request, queuing directory operations as background jobs.
+
+  Files are handled together by bulk. A directory is handed to a job as a
+  single-item request would, and its result carries the job to poll.
+
+  Returns:
+    A list with the result of each operation, in request order.
+  """
+  results = [None] * len(operations)
+  inline = []
+  for i, operation in enumerate(operations):
+    item = BulkItem(operation)
+    try:
+      job = directory_job(job_manager, operation, storage_client, usage_cache)
+    except Exception as e:
+      item.error = e
+      results[i] = item.result()
+      continue
+    if job is None:
+      inline.append(i)
+    else:
+      results[i] = dict(item.result(), job=job.to_dict())
+
+  for i, result in zip(
+      inline, bulk([operations[i] for i in inline], storage_client)):
+    results[i] = result
+  return results
+
+
+def run_job_items(job, fn, items):
+  """Apply fn to (blob, ...) items in parallel, recording job progress.
+
+  Raises:
+    JobCancelled if the job was cancelled.
+    Error if any item failed.
+  """
+  def counted(items):
+    for item in items:
+      job.check_cancelled()
+      job.add_total(1, item[0].size)
+      yield item
+
+  def run(item):
+    job.check_cancelled()
+    fn(*item)
+    job.advance(1, item[0].size)
+
+  for item, e in parallel_for_each(run, counted(items)):
+    if not isinstance(e, JobCancelled):
+      job.fail(item[0].name, e)
+
+  job.check_cancelled()
+  if job.failed:
+    raise Error('Error: %d objects failed' % job.failed)
+
+
+def delete_job(job):
+  """Job runner that deletes a file or a directory."""
+  storage_client = shared_storage_client()
+  path = job.params['path']
+
+  blobs_matching = matching_blobs(path, storage_client)
+  if blobs_matching:
+    chunks = [blobs_matching]
+  else:
+    bucket_name, blob_path = parse_path(path)
+    chunks = chunked(list_prefix(
+      bucket_name, '%s/' % blob_path.rstrip('/'), storage_client),
+      JOB_CHUNK_SIZE)
+
+  for chunk in chunks:
+    job.check_cancelled()
+    job.add_total(len(chunk), sum(b.size or 0 for b in chunk))
+    errors = delete_blobs(chunk, storage_client)
+    for b in chunk:
+      if (b.bucket.name, b.name) in errors:
+        job.fail(b.name, errors[(b.bucket.name, b.name)])
+      else:
+        job.advance(1, b.size)
+
+  if job.failed:
+    raise Error('Error: %d objects failed' % job.failed)
+
+
+def move_job(job):
+  """Job runner that moves a file or a directory.
+
+  Each object is deleted as soon as its copy completes, so running the job
+  again after an interruption only moves the objects that are left.
+  """
+  storage_client = shared_storage_client()
+  old, new = job.params['old'], job.params['new']
+  bucket_name_old, blob_path_old = parse_path(old)
+  bucket_name_new, blob_path_new = parse_path(new)
+  destination_bucket = storage_client.bucket(bucket_name_new)
+
+  def move_one(b, new_blob_name):
+    move_blob(b, destination_bucket, new_blob_name)
+
+  blobs_matching = matching_blobs(old, storage_client)
+  if blobs_matching:
+    items = [(blobs_matching[0], blob_path_new)]
+  else:
+    old_prefix = '%s/' % blob_path_old.rstrip('/')
+    new_prefix = '%s/' % blob_path_new.rstrip('/')
+    items = ((b, new_prefix + b.name[len(old_prefix):])
+             for b in list_prefix(bucket_name_old, old_prefix, storage_client)
+             # Skip objects already moved into a subdirectory of old.
+             if not (bucket_name_old == bucket_name_new
+                     and b.name.startswith(new_prefix)))
+
+  run_job_items(job, move_one, items)
+
+
+def copy_job(job):
+  """Job runner that copies a file or a directory.
+
+  A resumed job skips objects that were already copied with the same
+  checksum.
+  """
+  storage_client = shared_storage_client()
+  path, destination = job.params['path'], job.params['destination']
+  bucket_name, blob_path = parse_path(path)
+  destination_bucket = storage_client.bucket(job.params['destination_bucket'])
+
+  copied = {}
+  if job.resumed:
+    copied = {b.name: b.crc32c
+              for b in list_prefix(
+                destination_bucket.name, destination, storage_client)}
+
+  def copy_blob(b, new_blob_name):
+    if b.crc32c is None or copied.get(new_blob_name) != b.crc32c:
+      rewrite_blob(b, destination_bucket, new_blob_name)
+
+  if not destination.endswith('/'):
+    blobs_matching = matching_blobs(path, storage_client)
+    if not blobs_matching:
+      raise FileNotFound('File "%s" not found' % path)
+    items = [(blobs_matching[0], destination)]
+  else:
+    source_prefix = '%s/' % blob_path.rstrip('/')
+    items = ((b, destination + b.name[len(source_prefix):])
+             for b in list_prefix(bucket_name, source_prefix, storage_client)
+             # Skip the new copies when a directory is copied into itself.
+             if not (destination_bucket.name == bucket_name
+                     and b.name.startswith(destination)))
+
+  run_job_items(job, copy_blob, items)
+
+
+def directory_archive(path, archive_format, storage_client):
+  """Prepare a streaming archive of a directory or bucket.
+
+  Returns:
+    A DirectoryArchive that has not been started yet.
+  Raises:
+    ValueError if archive_format is not supported.
+    FileNotFound if the directory does not exist.
+  """
+  if archive_format not in ARCHIVE_FORMATS:
+    raise ValueError('Error: Unsupported archive format "%s"' % archive_format)
+
+  bucket_name, blob_path = parse_path(path)
+  blob_path = blob_path.strip('/')
+  if not bucket_name:
+    raise ValueError('Error: Cannot archive the root directory')
+
+  prefix = '%s/' % blob_path if blob_path else ''
+  if prefix and not directory_exists(bucket_name, prefix, storage_client):
+    raise FileNotFound('Directory "%s" not found' % path)
+
+  root = posixpath.basename(blob_path) if blob_path else bucket_name
+  return DirectoryArchive(
+    archive_format,
+    storage_client.list_blobs(bucket_name, prefix=prefix, retry=STORAGE_RETRY),
+    prefix, root, IOLoop.current())
+
+
+def path_usage(path, storage_client, usage_cache=None, refresh=False):
+  """Total size, object count and newest modification time of a directory.
+
+  Returns:
+    A dict with the usage of the directory or bucket at path.
+  Raises:
+    FileNotFound if the directory does not exist.
+  """
+  bucket_name, blob_path = parse_path(path)
+  if not bucket_name:
+    raise ValueError('Error: Cannot compute the usage of the root directory')
+  blob_path = blob_path.strip('/')
+  prefix = '%s/' % blob_path if blob_path else ''
+
+  usage = None
+  if usage_cache is not None and not refresh:
+    usage = usage_cache.get(bucket_name, prefix)
+  cached = usage is not None
+
+  if usage is None:
+    version = usage_cache.version if usage_cache is not None else None
+    usage = directory_usage(bucket_name, prefix, storage_client)
+    if prefix and not usage.objects:
+      raise FileNotFound('Directory "%s" not found' % path)
+    if usage_cache is not None:
+      usage_cache.put(bucket_name, prefix, usage, version)
+
+  return {
+    'path': '%s/%s' % (bucket_name, prefix),
+    'size': usage.size,
+    'objects': usage.objects,
+    'last_modified': format_time(usage.last_modified),
+    'cached': cached,
+    }
+
+
+def add_cached_usage(contents, usage_cache):
+  """Add cached sizes and modification times to listed directories."""
+  for item in contents:
+    if item['type'] != 'directory':
+      continue
+    bucket_name, prefix = parse_path(item['path'])
+    usage = usage_cache.get(bucket_name, prefix)
+    if usage is not None:
+      item['size'] = usage.size
+      item['objects'] = usage.objects
+      if usage.last_modified:
+        item['last_modified'] = format_time(usage.last_modified)
+
+
+def contents_key(path, lazy_output_size=0, content_format=None):
+  """Key under which identical getPathContents calls are coalesced."""
+  path = path or '/'
+  return ('contents', os.path.normpath('/' + path.lstrip('/')),
+          path.endswith('/'), lazy_output_size, content_format)
+
+
+def coalesce(single_flight, key, fn, *args):
+  """Call fn(*args) through single_flight, or directly without one.
+
+  Returns:
+    A future that a coroutine can yield for the result.
+  """
+  if single_flight is not None:
+    return single_flight.do(key, fn, *args)
+  future = Future()
+  future.set_result(fn(*args))
+  return future
+
+
+def in_thread(single_flight, fn, *args):
+  """Call fn(*args) on the request threads of single_flight, or directly
+  without one.
+
+  Unlike coalesce, every call runs, so it suits calls that change things.
+
+  Returns:
+    A future that a coroutine can yield for the result.
+  """
+  if single_flight is not None:
+    return single_flight.run(fn, *args)
+  future = Future()
+  future.set_result(fn(*args))
+  return future
+
+
+def error_status(e):
+  """The HTTP status for an unexpected error.
+
+  Throttling that outlasted the retries, or a server that ran out of memory
+  for transfers, is reported as 503, so that clients back off rather than
+  treat it as a server fault.
+  """
+  if isinstance(e, MemoryBudgetExceeded) or is_throttled(e):
+    return 503
+  return 500
+
+
+def storage_session():
+  """An authorized session for GCS with the default credentials.
+
+  Returns:
+    The session, and the project of the credentials or None.
+  """
+  credentials, project = google.auth.default(scopes=storage.Client.SCOPE)
+  session = AuthorizedSession(credentials)
+  # The default pool keeps 10 connections per host, fewer than the requests
+  # that run in parallel, so connections would be closed and reopened.
+  session.mount('https://', requests.adapters.HTTPAdapter(
+    pool_maxsize=CONNECTION_POOL_SIZE))
+  session.hooks['response'].append(count_storage_request)
+  return session, project
+
+
+def create_storage_client(session=None, project=None):
+  if session is None:
+    session, project = storage_session()
+  kwargs = {} if project is None else {'project': project}
+  return storage.Client(
+    credentials=session.credentials,
+    _http=session,
+    client_info=ClientInfo(
+      user_agent='jupyterlab_gcsfilebrowser/{}'.format(VERSION)
+      ),
+    **kwargs
+    )
+
+
+_shared_client = None
+_shared_session = None
+_shared_client_lock = threading.Lock()
+
+
+def shared_storage_client():
+  """The storage client of the server, created on first use.
+
+  Requests and jobs share it, so credentials are discovered and connections
+  are opened once rather than for every request.
+  """
+  global _shared_client, _shared_session
+  with _shared_client_lock:
+    if _shared_client is None:
+      _shared_session, project = storage_session()
+      _shared_client = create_storage_client(_shared_session, project)
+    return _shared_client
+
+
+def shared_storage_session():
+  """The authorized session that the shared storage client sends through."""
+  shared_storage_client()
+  return _shared_session
+
+
+def new_file(file_type, ext, path, storage_client, usage_cache=None):
+  model = dict()
+  content = ''
+  file_format = 'text'
+
+  if file_type and file_type in ('notebook', 'file'):
+    if file_type == 'notebook':
+      ext = 'ipynb'
+      file_format = 'json'
+      content = {
+        "cells": [],
+        "metadata": {},
+        "nbformat": 4,
+        "nbformat_minor": 4
+      }
+
+    new_blob_name = '%s/%s.%s' % (
+      path, NEW_FILE_NAME, ext)
+
+    destination_bucket_name, blob_path = parse_path(new_blob_name)
+
+    new_blob_name = generate_next_unique_name(
+      destination_bucket_name,
+      blob_path,
+      storage_client,
+      TEMPLATE_NEW_FILE)
+
+    model['path'] = '%s/%s' % (
+      destination_bucket_name, new_blob_name)
+    model['content'] = content
+    model['format'] = file_format
+    blob = upload(model, storage_client, usage_cache)
+
+    content_format, content = read_file_content(blob)
+
+    return {
+      'type': 'file',
+      'content': {
+        'path': ('%s/%s' % (blob.bucket.name, blob.name)),
+        'name': os.path.basename(blob.name),
+        'type': 'file',
+        'mimetype': blob.content_type,
+        'format': content_format,
+        'content': content,
+      }
+    }
+  elif file_type and file_type == 'directory':
+    new_blob_name = '%s/%s/' % (path, NEW_DIRECTORY_NAME)
+
+    destination_bucket_name, blob_path = parse_path(new_blob_name)
+
+    new_blob_name = generate_next_unique_name(
+      destination_bucket_name,
+      blob_path,
+      storage_client,
+      TEMPLATE_NEW_FILE,
+      is_dir=True)
+
+    model['path'] = '%s/%s' % (
+      destination_bucket_name, new_blob_name)
+    model['content'] = ''
+    model['format'] = 'text'
+    blob = upload(model, storage_client, usage_cache)
+
+    return {
+      'type': 'directory',
+      'path': ('%s/%s' % (blob.bucket.name, blob.name)),
+      'name': blob.name,
+      'content': []
+    }
+
+
+def checkpoint_prefix(path):
+  checkpoint_dir = os.path.join(os.path.dirname(path), CHECKPOINT_FOLDER)
+
+  return os.path.join(
+    os.path.dirname(path),
+    CHECKPOINT_FOLDER,
+    os.path.basename(path)
+    )
+
+
+def checkpoint_filename(path, checkpoint_id):
+  checkpoint_dir = os.path.join(os.path.dirname(path), CHECKPOINT_FOLDER)
+
+  return '%s%s' % (checkpoint_prefix(path), checkpoint_id)
+
+
+def create_checkpoint(path, storage_client):
+  checkpoint_pathname = checkpoint_filename(path, CHECKPOINT_ID)
+
+  content = getPathContents(path, storage_client, content_format='base64')
+
+  model = {
+    'format': 'base64',
+    'content': content['content']['content'],
+    'path': checkpoint_pathname,
+  }
+
+  blob = upload(model, storage_client)
+
+  return {
+          'checkpoint': {
+            'id': CHECKPOINT_ID,
+            'last_modified': blob_last_modified(blob)
+          }
+        }
+
+
+def list_checkpoints(path, storage_client):
+  bucket_name, blob_path = parse_path(checkpoint_prefix(path))
+  blobs =  prefixed_blobs(bucket_name, blob_path, storage_client)
+  return {
+            'checkpoints': [{
+              'id': CHECKPOINT_ID,
+              'last_modified': blob_last_modified(blob)
+            } for blob in blobs]
+          }
+
+
+def restore_checkpoint(path, checkpoint_id, storage_client):
+  checkpoint_pathname = checkpoint_filename(path, checkpoint_id)
+  content = getPathContents(
+    checkpoint_pathname, storage_client, content_format='base64')
+
+  model = {
     'format': 'base64',
     'content': content['content']['content'],
     'path': path,
@@ -605,16 +2015,81 @@ def delete_checkpoint(path, checkpoint_id, storage_client):
   return {}
 
 
+def dumps(value):
+  """Encode a response as JSON, with orjson when it is installed."""
+  if orjson is not None:
+    try:
+      return orjson.dumps(value)
+    except TypeError:
+      pass
+  return json.dumps(value)
+
+
+def format_time(value):
+  return value.strftime("%Y-%m-%d %H:%M:%S %z") if value else ''
+
+
 def blob_last_modified(blob):
-  return blob.updated.strftime("%Y-%m-%d %H:%M:%S %z") if blob.updated else ''
+  return format_time(blob.updated)
+
+
+def listing_last_modified(blob):
+  """blob_last_modified, read straight from the listed RFC 3339 timestamp.
+
+  GCS lists times in UTC, so formatting them is a matter of slicing. Anything
+  else goes through blob_last_modified.
+  """
+  properties = getattr(blob, '_properties', None)
+  updated = properties.get('updated') if isinstance(properties, dict) else None
+  if (isinstance(updated, str) and len(updated) >= 20
+      and updated.endswith('Z') and updated[10] == 'T'):
+    return '%s %s +0000' % (updated[:10], updated[11:19])
+  return blob_last_modified(blob)
+
+
+def blob_generation(blob):
+  # Sent as a string, since generations do not fit in a JavaScript number.
+  return str(blob.generation) if blob.generation is not None else None
 
 
 def bucket_time_created(bucket):
   return bucket.time_created.strftime("%Y-%m-%d %H:%M:%S %z") if bucket.time_created else ''
 
 
+class StorageHandler(APIHandler):
+  """Base class of the handlers, which reports requests to the watchdog."""
+  _watchdog_record = None
+
+  def prepare(self):
+    watchdog = self.settings.get('gcs_watchdog')
+    if watchdog is not None:
+      self._watchdog_record = watchdog.request_started(self)
+    return super(StorageHandler, self).prepare()
 
-class GCSHandler(APIHandler):
+  def on_finish(self):
+    if self._watchdog_record is not None:
+      self.settings['gcs_watchdog'].request_finished(
+        self._watchdog_record, self.get_status())
+    super(StorageHandler, self).on_finish()
+
+  @gen.coroutine
+  def finish_compressed(self, body):
+    """Finish with body, gzip-encoded if gzip transcoding is enabled and the
+    client accepts it."""
+    if gzip_transcoding_enabled():
+      self.add_header('Vary', 'Accept-Encoding')
+      if len(body) >= GZIP_MIN_BYTES and accepts_gzip(
+          self.request.headers.get('Accept-Encoding')):
+        if isinstance(body, str):
+          body = body.encode('utf-8')
+        # Compressed off the event loop, since notebooks can be large.
+        body = yield IOLoop.current().run_in_executor(
+          None, gzip_compress, body, GZIP_RESPONSE_LEVEL)
+        self.set_header('Content-Encoding', 'gzip')
+    self.finish(body)
+
+
+class GCSHandler(StorageHandler):
   """Handles requests for GCS operations."""
   storage_client = None
 
@@ -622,11 +2097,151 @@ class GCSHandler(APIHandler):
   def get(self, path=''):
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
+        self.storage_client = shared_storage_client()
+
+      lazy_output_size = 0
+      config = self.settings.get('gcs_filebrowser_config')
+      if config is not None and self.get_argument('outputs', '') == 'lazy':
+        lazy_output_size = config.lazy_output_size
+      content_format = self.get_argument('format', None)
+
+      if self.get_argument('raw', '0') == '1':
+        yield self.send_raw(path)
+        return
+
+      if self.get_argument('content', '1') == '0':
+        contents = yield coalesce(
+          self.settings.get('gcs_single_flight'),
+          ('stat', os.path.normpath('/' + (path or '/').lstrip('/'))),
+          stat, path, self.storage_client)
+        self.finish(dumps(contents))
+        return
+
+      contents = yield coalesce(
+        self.settings.get('gcs_single_flight'),
+        contents_key(path, lazy_output_size, content_format),
+        getPathContents, path, self.storage_client,
+        self.settings.get('gcs_content_cache'),
+        self.settings.get('gcs_prefetcher'),
+        self.settings.get('gcs_usage_cache'),
+        lazy_output_size, content_format)
+      yield self.finish_compressed(dumps(contents))
+
+    except FileNotFound as e:
+      app_log.exception(str(e))
+      self.set_status(404, str(e))
+      self.finish({
+        'error':{
+          'message': str(e),
+          'response': {
+            'status': 404,
+            },
+          }
+        })
+    except Exception as e:
+      app_log.exception(str(e))
+      self.set_status(error_status(e), str(e))
+      self.finish({
+        'error':{
+          'message': str(e)
+          }
+        })
 
-      self.finish(json.dumps(
-        getPathContents(path, self.storage_client)))
+  @gen.coroutine
+  def send_raw(self, path):
+    """Send the contents of a file as they are rather than a file model.
+
+    A gzip-encoded file is sent as it is stored, with Content-Encoding: gzip,
+    to clients that accept gzip, and decompressed for the others. Other
+    files are read through the content cache. Concurrent requests for a file
+    share one download. The generation and modification time go in
+    X-GCS-Generation and X-GCS-Last-Modified headers.
+    """
+    keep_gzip = accepts_gzip(self.request.headers.get('Accept-Encoding'))
+    blob, contents = yield coalesce(
+      self.settings.get('gcs_single_flight'),
+      ('raw', os.path.normpath('/' + (path or '/').lstrip('/')), keep_gzip),
+      raw_contents, path, self.storage_client, keep_gzip,
+      self.settings.get('gcs_content_cache'))
+    if is_gzip_encoded(blob):
+      self.add_header('Vary', 'Accept-Encoding')
+      if keep_gzip:
+        self.set_header('Content-Encoding', 'gzip')
+    self.set_header(
+      'Content-Type', blob.content_type or 'application/octet-stream')
+    if blob.generation is not None:
+      self.set_header('X-GCS-Generation', blob_generation(blob))
+    if blob.updated is not None:
+      self.set_header('X-GCS-Last-Modified', blob_last_modified(blob))
+
+    for start in range(0, len(contents), RAW_CHUNK_SIZE):
+      self.write(contents[start:start + RAW_CHUNK_SIZE])
+      yield self.flush()
+    self.finish()
+
+
+class OutputHandler(StorageHandler):
+  """Handles requests for notebook outputs that were not loaded.
+
+  Takes the cell index, and optionally the output index and the notebook
+  generation from a placeholder. Without an output index, returns every
+  output of the cell.
+  """
+  storage_client = None
 
+  @gen.coroutine
+  def get(self, path=''):
+    try:
+      if not self.storage_client:
+        self.storage_client = shared_storage_client()
+
+      try:
+        cell = int(self.get_argument('cell', ''))
+        output = self.get_argument('output', None)
+        if output is not None:
+          output = int(output)
+      except ValueError:
+        raise BadRequest('Error: cell and output must be integers')
+      generation = self.get_argument('generation', None)
+
+      # Outputs of one notebook are usually requested together, so they
+      # share a single read of the notebook.
+      nb, current_generation = yield coalesce(
+        self.settings.get('gcs_single_flight'),
+        ('notebook', os.path.normpath('/' + path.lstrip('/')), generation),
+        read_notebook, path, self.storage_client,
+        self.settings.get('gcs_content_cache'))
+      if output is not None and generation is not None:
+        # The notebook may have been saved since the placeholder was made.
+        location = LOCATIONS.locate({
+          'path': path, 'generation': generation,
+          'cell': cell, 'output': output}, current_generation)
+        if location is None:
+          raise StaleOutputs('Error: "%s" changed since it was opened' % path)
+        cell, output = location
+      elif generation is not None and generation != str(current_generation):
+        raise StaleOutputs('Error: "%s" changed since it was opened' % path)
+
+      try:
+        if output is None:
+          result = {'outputs': cell_outputs(nb, cell)}
+        else:
+          result = {'output': get_output(nb, cell, output)}
+      except IndexError as e:
+        raise FileNotFound('Error: %s in "%s"' % (e, path))
+
+      yield self.finish_compressed(json.dumps(result))
+    except BadRequest as e:
+      app_log.warning(str(e))
+      self.set_status(400, str(e))
+      self.finish({
+        'error':{
+          'message': str(e),
+          'response': {
+            'status': 400,
+            },
+          }
+        })
     except FileNotFound as e:
       app_log.exception(str(e))
       self.set_status(404, str(e))
@@ -638,9 +2253,20 @@ class GCSHandler(APIHandler):
             },
           }
         })
+    except StaleOutputs as e:
+      app_log.warning(str(e))
+      self.set_status(409, str(e))
+      self.finish({
+        'error':{
+          'message': str(e),
+          'response': {
+            'status': 409,
+            },
+          }
+        })
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
@@ -648,7 +2274,40 @@ class GCSHandler(APIHandler):
         })
 
 
-class UploadHandler(APIHandler):
+class MetricsHandler(StorageHandler):
+  """Reports the counters of the server's storage work and its memory
+  reservations."""
+
+  @gen.coroutine
+  def get(self, *args, **kwargs):
+    metrics = METRICS.snapshot()
+    metrics.update(BUDGET.snapshot())
+    self.finish(json.dumps(metrics))
+
+
+class DiagnosticsHandler(StorageHandler):
+  """Reports event loop lag, requests that blocked the loop and slow
+  requests, as recorded by the watchdog."""
+
+  @gen.coroutine
+  def get(self, *args, **kwargs):
+    watchdog = self.settings.get('gcs_watchdog')
+    if watchdog is None:
+      message = 'Error: The watchdog is not enabled'
+      self.set_status(404, message)
+      self.finish({
+        'error':{
+          'message': message,
+          'response': {
+            'status': 404,
+            },
+          }
+        })
+      return
+    self.finish(json.dumps(watchdog.snapshot()))
+
+
+class UploadHandler(StorageHandler):
 
   storage_client = None
 
@@ -657,16 +2316,52 @@ class UploadHandler(APIHandler):
 
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
+        self.storage_client = shared_storage_client()
+
+      body = self.request.body
+      cost = yield BUDGET.acquire_async(UPLOAD_MEMORY_FACTOR * len(body))
+      try:
+        # Large notebooks are parsed and encoded off the event loop.
+        model = yield notebook_task(decode_upload, len(body), body)
+
+        # So is the rest of the save, which for a notebook with unloaded
+        # outputs downloads, parses and encodes the stored notebook.
+        blob = yield in_thread(
+          self.settings.get('gcs_single_flight'), upload, model,
+          self.storage_client, self.settings.get('gcs_usage_cache'),
+          self.settings.get('gcs_content_cache'))
+      finally:
+        BUDGET.release(cost)
 
-      model = self.get_json_body()
-
-      upload(model, self.storage_client)
-
-      self.finish({})
+      self.finish({
+        'last_modified': blob_last_modified(blob),
+        'generation': blob_generation(blob),
+        })
+    except InvalidUpload as e:
+      app_log.warning(str(e))
+      self.set_status(400, str(e))
+      self.finish({
+        'error':{
+          'message': str(e),
+          'response': {
+            'status': 400,
+            },
+          }
+        })
+    except (FileChanged, StaleOutputs) as e:
+      app_log.warning(str(e))
+      self.set_status(409, str(e))
+      self.finish({
+        'error':{
+          'message': str(e),
+          'response': {
+            'status': 409,
+            },
+          }
+        })
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
@@ -674,7 +2369,7 @@ class UploadHandler(APIHandler):
         })
 
 
-class DeleteHandler(APIHandler):
+class DeleteHandler(StorageHandler):
 
   storage_client = None
 
@@ -683,13 +2378,24 @@ class DeleteHandler(APIHandler):
 
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
+        self.storage_client = shared_storage_client()
 
-      self.finish(json.dumps(delete(path, self.storage_client)))
+      # Directories are deleted by a background job, which the client polls.
+      job = directory_job(
+        self.settings.get('gcs_job_manager'),
+        {'action': 'delete', 'localPath': path}, self.storage_client,
+        self.settings.get('gcs_usage_cache'))
+      if job is not None:
+        self.set_status(202)
+        self.finish({'job': job.to_dict()})
+        return
+
+      self.finish(json.dumps(delete(
+        path, self.storage_client, self.settings.get('gcs_usage_cache'))))
 
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
@@ -697,7 +2403,7 @@ class DeleteHandler(APIHandler):
         })
 
 
-class MoveHandler(APIHandler):
+class MoveHandler(StorageHandler):
 
   storage_client = None
 
@@ -708,12 +2414,32 @@ class MoveHandler(APIHandler):
 
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
+        self.storage_client = shared_storage_client()
+
+      job = directory_job(
+        self.settings.get('gcs_job_manager'),
+        dict(move_obj, action='move'), self.storage_client,
+        self.settings.get('gcs_usage_cache'))
+      if job is not None:
+        new_path = add_directory_slash(job.params['new'])
+        self.set_status(202)
+        self.finish({
+          'job': job.to_dict(),
+          'type': 'directory',
+          'path': new_path,
+          'name': new_path,
+          'content': [],
+          })
+        return
 
-      blob = move(move_obj['oldLocalPath'], move_obj['newLocalPath'], self.storage_client)
+      single_flight = self.settings.get('gcs_single_flight')
+      blob = yield in_thread(
+        single_flight, move, move_obj['oldLocalPath'],
+        move_obj['newLocalPath'], self.storage_client,
+        self.settings.get('gcs_usage_cache'))
 
-      file_bytes = BytesIO()
-      blob.download_to_file(file_bytes)
+      content_format, content = yield in_thread(
+        single_flight, read_file_content, blob)
 
       self.finish({
                   'type': 'file',
@@ -721,8 +2447,8 @@ class MoveHandler(APIHandler):
                     'path': ('%s/%s' % (blob.bucket.name, blob.name)),
                     'name': blob.name,
                     'mimetype': blob.content_type,
-                    'content': base64.encodebytes(
-                      file_bytes.getvalue()).decode('ascii'),
+                    'format': content_format,
+                    'content': content,
                     'last_modified':  blob_last_modified(blob),
                     },
                   })
@@ -730,7 +2456,7 @@ class MoveHandler(APIHandler):
 
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
@@ -738,7 +2464,7 @@ class MoveHandler(APIHandler):
         })
 
 
-class CopyHandler(APIHandler):
+class CopyHandler(StorageHandler):
 
   storage_client = None
 
@@ -749,27 +2475,294 @@ class CopyHandler(APIHandler):
 
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
+        self.storage_client = shared_storage_client()
+
+      job = directory_job(
+        self.settings.get('gcs_job_manager'),
+        dict(copy_obj, action='copy'), self.storage_client,
+        self.settings.get('gcs_usage_cache'))
+      if job is not None:
+        self.set_status(202)
+        self.finish({
+          'job': job.to_dict(),
+          'type': 'directory',
+          'path': '%s/%s' % (job.params['destination_bucket'],
+                             job.params['destination']),
+          'name': job.params['destination'],
+          })
+        return
 
       blob = copy(
-        copy_obj['localPath'], copy_obj['toLocalDir'], self.storage_client)
+        copy_obj['localPath'], copy_obj['toLocalDir'], self.storage_client,
+        self.settings.get('gcs_usage_cache'))
       self.finish({
-                  'type': 'file',
+                  'type': 'directory' if blob.name.endswith('/') else 'file',
                   'path': ('%s/%s' % (blob.bucket.name, blob.name)),
                   'name': blob.name
                 })
 
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
+      self.finish({
+        'error':{
+          'message': str(e)
+          }
+        })
+
+
+class BulkHandler(StorageHandler):
+
+  storage_client = None
+
+  @gen.coroutine
+  def post(self, *args, **kwargs):
+
+    bulk_obj = self.get_json_body()
+
+    try:
+      if not self.storage_client:
+        self.storage_client = shared_storage_client()
+
+      results = yield in_thread(
+        self.settings.get('gcs_single_flight'), bulk_with_jobs,
+        bulk_obj['operations'], self.storage_client,
+        self.settings.get('gcs_job_manager'),
+        self.settings.get('gcs_usage_cache'))
+      invalidate_usage(
+        self.settings.get('gcs_usage_cache'),
+        *[r.get(key) for r in results
+          for key in ('localPath', 'oldLocalPath', 'newLocalPath', 'path')])
+
+      self.finish({
+        'results': results
+        })
+
+    except Exception as e:
+      app_log.exception(str(e))
+      self.set_status(error_status(e), str(e))
+      self.finish({
+        'error':{
+          'message': str(e)
+          }
+        })
+
+
+class JobsHandler(StorageHandler):
+  """Starts, reports on and cancels background jobs.
+
+  GET jobs/ lists jobs, GET jobs/<id> returns one job, GET jobs/<id>/events
+  streams its progress as server-sent events and DELETE jobs/<id> cancels it.
+  """
+  storage_client = None
+
+  def _not_found(self, e):
+    self.set_status(404, str(e))
+    self.finish({
+      'error':{
+        'message': str(e),
+        'response': {
+          'status': 404,
+          },
+        }
+      })
+
+  @gen.coroutine
+  def get(self, path=''):
+    job_id, _, resource = path.strip('/').partition('/')
+
+    try:
+      job_manager = self.settings['gcs_job_manager']
+
+      if not job_id:
+        self.finish({'jobs': [job.to_dict() for job in job_manager.list()]})
+      elif resource == 'events':
+        yield self._stream_events(job_manager.get(job_id))
+      else:
+        self.finish({'job': job_manager.get(job_id).to_dict()})
+
+    except UnknownJob as e:
+      self._not_found(e)
+    except StreamClosedError:
+      pass
+    except Exception as e:
+      app_log.exception(str(e))
+      self.set_status(error_status(e), str(e))
+      self.finish({
+        'error':{
+          'message': str(e)
+          }
+        })
+
+  @gen.coroutine
+  def _stream_events(self, job):
+    self.set_header('Content-Type', 'text/event-stream')
+    self.set_header('Cache-Control', 'no-cache')
+
+    version = None
+    while True:
+      if job.version != version:
+        version = job.version
+        self.write('data: %s\n\n' % json.dumps(job.to_dict()))
+        yield self.flush()
+      if job.finished:
+        break
+      yield gen.sleep(JOB_EVENT_INTERVAL)
+
+    self.finish()
+
+  @gen.coroutine
+  def post(self, *args, **kwargs):
+
+    job_obj = self.get_json_body()
+
+    try:
+      if not self.storage_client:
+        self.storage_client = shared_storage_client()
+
+      job = start_job(
+        self.settings['gcs_job_manager'], job_obj, self.storage_client,
+        self.settings.get('gcs_usage_cache'))
+
+      self.set_status(202)
+      self.finish({'job': job.to_dict()})
+
+    except Exception as e:
+      app_log.exception(str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
           }
         })
 
+  @gen.coroutine
+  def delete(self, path=''):
+
+    try:
+      job = self.settings['gcs_job_manager'].cancel(path.strip('/'))
+      self.finish({'job': job.to_dict()})
+
+    except UnknownJob as e:
+      self._not_found(e)
+    except Exception as e:
+      app_log.exception(str(e))
+      self.set_status(error_status(e), str(e))
+      self.finish({
+        'error':{
+          'message': str(e)
+          }
+        })
 
-class NewHandler(APIHandler):
+
+class ArchiveHandler(StorageHandler):
+  """Streams a directory as a zip or tar.gz download."""
+  storage_client = None
+  archive = None
+
+  def on_connection_close(self):
+    if self.archive:
+      self.archive.abort()
+
+  @gen.coroutine
+  def get(self, path=''):
+
+    try:
+      if not self.storage_client:
+        self.storage_client = shared_storage_client()
+
+      archive_format = self.get_argument('format', 'zip')
+      self.archive = directory_archive(
+        path, archive_format, self.storage_client)
+
+      content_type, extension = ARCHIVE_FORMATS[archive_format]
+      self.set_header('Content-Type', content_type)
+      self.set_header('Content-Disposition', 'attachment; filename="%s%s"' % (
+        self.archive.root, extension))
+      self.archive.start()
+
+      while True:
+        chunk = yield self.archive.next_chunk()
+        if chunk is None:
+          break
+        self.write(chunk)
+        yield self.flush()
+
+      self.finish()
+
+    except FileNotFound as e:
+      app_log.exception(str(e))
+      self.set_status(404, str(e))
+      self.finish({
+        'error':{
+          'message': str(e),
+          'response': {
+            'status': 404,
+            },
+          }
+        })
+    except StreamClosedError:
+      self.archive.abort()
+    except Exception as e:
+      app_log.exception(str(e))
+      if self.archive:
+        self.archive.abort()
+      if self._headers_written:
+        # Part of the archive was sent, so the client can only be told by
+        # cutting the response short.
+        self.request.connection.close()
+        return
+      self.set_status(error_status(e), str(e))
+      self.finish({
+        'error':{
+          'message': str(e)
+          }
+        })
+
+
+class UsageHandler(StorageHandler):
+  """Reports the total size and object count of a directory."""
+  storage_client = None
+
+  @gen.coroutine
+  def get(self, path=''):
+
+    try:
+      if not self.storage_client:
+        self.storage_client = shared_storage_client()
+
+      refresh = self.get_argument('refresh', 'false').lower() == 'true'
+      # A cold scan of a large directory takes a while, so it runs off the
+      # event loop and concurrent requests for the directory share it.
+      result = yield coalesce(
+        self.settings.get('gcs_single_flight'),
+        ('usage', os.path.normpath('/' + (path or '/').strip('/')), refresh),
+        path_usage, path, self.storage_client,
+        self.settings.get('gcs_usage_cache'), refresh)
+      self.finish(result)
+
+    except FileNotFound as e:
+      app_log.exception(str(e))
+      self.set_status(404, str(e))
+      self.finish({
+        'error':{
+          'message': str(e),
+          'response': {
+            'status': 404,
+            },
+          }
+        })
+    except Exception as e:
+      app_log.exception(str(e))
+      self.set_status(error_status(e), str(e))
+      self.finish({
+        'error':{
+          'message': str(e)
+          }
+        })
+
+
+class NewHandler(StorageHandler):
 
   storage_client = None
 
@@ -780,19 +2773,21 @@ class NewHandler(APIHandler):
 
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
+        self.storage_client = shared_storage_client()
 
-      self.finish(new_file(
+      model = yield in_thread(
+        self.settings.get('gcs_single_flight'),
+        new_file,
         new_obj['type'],
         new_obj.get('ext', None),
         new_obj['path'],
-        self.storage_client
-        )
-      )
+        self.storage_client,
+        self.settings.get('gcs_usage_cache'))
+      self.finish(model)
 
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
@@ -800,7 +2795,7 @@ class NewHandler(APIHandler):
         })
 
 
-class CheckpointHandler(APIHandler):
+class CheckpointHandler(StorageHandler):
 
   storage_client = None
 
@@ -811,32 +2806,43 @@ class CheckpointHandler(APIHandler):
 
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
+        self.storage_client = shared_storage_client()
+
+      if checkpoint_obj['action'] != 'listCheckpoints':
+        invalidate_usage(
+          self.settings.get('gcs_usage_cache'),
+          checkpoint_obj['localPath'],
+          checkpoint_prefix(checkpoint_obj['localPath']))
 
+      single_flight = self.settings.get('gcs_single_flight')
       if checkpoint_obj['action'] == 'createCheckpoint':
-        checkpoint = create_checkpoint(
+        checkpoint = yield in_thread(
+          single_flight, create_checkpoint,
           checkpoint_obj['localPath'], self.storage_client)
         self.finish(checkpoint)
       if checkpoint_obj['action'] == 'listCheckpoints':
-        checkpoints = list_checkpoints(
+        checkpoints = yield in_thread(
+          single_flight, list_checkpoints,
           checkpoint_obj['localPath'], self.storage_client)
         self.finish(checkpoints)
       if checkpoint_obj['action'] == 'restoreCheckpoint':
-        checkpoint = restore_checkpoint(
+        checkpoint = yield in_thread(
+          single_flight, restore_checkpoint,
           checkpoint_obj['localPath'],
           checkpoint_obj['checkpointID'],
-           self.storage_client)
+          self.storage_client)
         self.finish(checkpoint)
       if checkpoint_obj['action'] == 'deleteCheckpoint':
-        checkpoint = delete_checkpoint(
+        checkpoint = yield in_thread(
+          single_flight, delete_checkpoint,
           checkpoint_obj['localPath'],
           checkpoint_obj['checkpointID'],
-           self.storage_client)
+          self.storage_client)
         self.finish({})
 
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
@@ -844,7 +2850,7 @@ class CheckpointHandler(APIHandler):
         })
 
 
-class GCSNbConvert(APIHandler):
+class GCSNbConvert(StorageHandler):
   """Handles requests for nbconvert for files in GCS."""
   storage_client = None
 
@@ -853,30 +2859,34 @@ class GCSNbConvert(APIHandler):
 
     try:
       if not self.storage_client:
-        self.storage_client = create_storage_client()
-
-      nb = getPathContents(args[1], self.storage_client)
-
-      gcs_notebook = nbformat.reads(
-        base64.b64decode(nb['content']['content'] ).decode('utf-8'),
-        as_version=4)
-
-      exporter = notebook.nbconvert.handlers.get_exporter(args[0])
-
-      (output, resources) = exporter.from_notebook_node(gcs_notebook)
+        self.storage_client = shared_storage_client()
+
+      nb = yield coalesce(
+        self.settings.get('gcs_single_flight'),
+        contents_key(args[1], content_format='text'),
+        getPathContents, args[1], self.storage_client,
+        self.settings.get('gcs_content_cache'), None, None, 0, 'text')
+
+      text = nb['content']['content']
+      cost = yield BUDGET.acquire_async(NBCONVERT_MEMORY_FACTOR * len(text))
+      try:
+        output, output_extension, output_mimetype = yield notebook_task(
+          export_notebook, len(text), args[0], text)
+      finally:
+        BUDGET.release(cost)
       # Force download if requested
       if self.get_argument('download', 'false').lower() == 'true':
-          filename = os.path.splitext(args[1])[0] + resources['output_extension']
+          filename = os.path.splitext(args[1])[0] + output_extension
           self.set_header('Content-Disposition',
                               'attachment; filename="%s"' % filename)
-      if exporter.output_mimetype:
+      if output_mimetype:
             self.set_header('Content-Type',
-                            '%s; charset=utf-8' % exporter.output_mimetype)
+                            '%s; charset=utf-8' % output_mimetype)
 
       self.finish(output)
     except Exception as e:
       app_log.exception(str(e))
-      self.set_status(500, str(e))
+      self.set_status(error_status(e), str(e))
       self.finish({
         'error':{
           'message': str(e)
@@ -0,0 +1,269 @@
+# Lint as: python3
+"""Background jobs for long-running file operations."""
+
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from notebook.base.handlers import app_log
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+# Number of finished jobs kept around for polling.
+MAX_FINISHED_JOBS = 100
+# Number of per-object failures reported for a job.
+MAX_REPORTED_FAILURES = 20
+
+
+class JobCancelled(Exception):
+  """The job was cancelled."""
+  pass
+
+
+class UnknownJob(Exception):
+  """No job exists with the requested ID."""
+  pass
+
+
+class Job(object):
+  """A long-running operation and its progress.
+
+  Runners report progress through the add_*/advance/fail methods, which may be
+  called from several worker threads at once.
+  """
+
+  def __init__(self, kind, params, job_id=None, resumed=False):
+    self.id = job_id or uuid.uuid4().hex
+    self.kind = kind
+    self.params = params
+    self.resumed = resumed
+    self.state = PENDING
+    self.error = None
+    self.created = time.time()
+    self.updated = self.created
+    self.objects_done = 0
+    self.objects_total = 0
+    self.bytes_done = 0
+    self.bytes_total = 0
+    self.failed = 0
+    self.failures = []
+    # Incremented on every change so that watchers can detect updates.
+    self.version = 0
+    self._lock = threading.Lock()
+    self._cancelled = threading.Event()
+
+  def _changed(self):
+    self.updated = time.time()
+    self.version += 1
+
+  def add_total(self, objects, size=0):
+    with self._lock:
+      self.objects_total += objects
+      self.bytes_total += size or 0
+      self._changed()
+
+  def advance(self, objects, size=0):
+    with self._lock:
+      self.objects_done += objects
+      self.bytes_done += size or 0
+      self._changed()
+
+  def fail(self, name, error):
+    with self._lock:
+      self.failed += 1
+      if len(self.failures) < MAX_REPORTED_FAILURES:
+        self.failures.append({'name': name, 'message': str(error)})
+      self._changed()
+
+  def set_state(self, state, error=None):
+    with self._lock:
+      self.state = state
+      self.error = str(error) if error else None
+      self._changed()
+
+  @property
+  def finished(self):
+    return self.state in FINISHED_STATES
+
+  @property
+  def cancelled(self):
+    return self._cancelled.is_set()
+
+  def cancel(self):
+    self._cancelled.set()
+
+  def check_cancelled(self):
+    if self._cancelled.is_set():
+      raise JobCancelled()
+
+  def to_dict(self):
+    with self._lock:
+      return {
+        'id': self.id,
+        'kind': self.kind,
+        'params': self.params,
+        'state': self.state,
+        'error': self.error,
+        'created': self.created,
+        'updated': self.updated,
+        'progress': {
+          'objects_done': self.objects_done,
+          'objects_total': self.objects_total,
+          'bytes_done': self.bytes_done,
+          'bytes_total': self.bytes_total,
+          'failed': self.failed,
+          'failures': list(self.failures),
+          },
+        }
+
+
+class JobManager(object):
+  """Runs jobs on a bounded pool of threads.
+
+  Unfinished jobs are recorded in a journal directory, one JSON file per job,
+  so that they can be resumed when the server restarts. Runners must therefore
+  be safe to run again on a partially completed operation.
+  """
+
+  def __init__(self, runners, journal_dir=None, max_concurrent_jobs=2):
+    """
+    Args:
+      runners: A dict mapping job kind to a function that takes a Job.
+      journal_dir: Directory for the job journal, or None to disable it.
+      max_concurrent_jobs: Maximum number of jobs running at once.
+    """
+    self.runners = runners
+    self.journal_dir = journal_dir
+    self._executor = ThreadPoolExecutor(
+      max_workers=max_concurrent_jobs, thread_name_prefix='gcs-job')
+    self._lock = threading.Lock()
+    self._jobs = collections.OrderedDict()
+
+    if journal_dir:
+      os.makedirs(journal_dir, exist_ok=True)
+
+  def submit(self, kind, params):
+    """Queue a new job.
+
+    Returns:
+      The new Job.
+    Raises:
+      ValueError if kind is not a known job kind.
+    """
+    if kind not in self.runners:
+      raise ValueError('Error: Unknown job kind "%s"' % kind)
+    return self._submit(Job(kind, params))
+
+  def _submit(self, job):
+    with self._lock:
+      self._jobs[job.id] = job
+      self._trim()
+    self._journal(job)
+    self._executor.submit(self._run, job)
+    return job
+
+  def _trim(self):
+    """Forget the oldest finished jobs. Must be called with the lock held."""
+    finished = [j.id for j in self._jobs.values() if j.finished]
+    for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+      del self._jobs[job_id]
+
+  def get(self, job_id):
+    with self._lock:
+      if job_id not in self._jobs:
+        raise UnknownJob('Job "%s" not found' % job_id)
+      return self._jobs[job_id]
+
+  def list(self):
+    with self._lock:
+      return list(self._jobs.values())
+
+  def cancel(self, job_id):
+    job = self.get(job_id)
+    job.cancel()
+    return job
+
+  def _run(self, job):
+    if job.cancelled:
+      job.set_state(CANCELLED)
+      self._journal(job)
+      return
+
+    job.set_state(RUNNING)
+    self._journal(job)
+    try:
+      self.runners[job.kind](job)
+      job.check_cancelled()
+      job.set_state(SUCCEEDED)
+    except JobCancelled:
+      job.set_state(CANCELLED)
+    except Exception as e:
+      app_log.exception('Job %s (%s) failed', job.id, job.kind)
+      job.set_state(FAILED, e)
+    self._journal(job)
+
+  def _journal_filename(self, job_id):
+    return os.path.join(self.journal_dir, '%s.json' % job_id)
+
+  def _journal(self, job):
+    """Record an unfinished job, or drop the record of a finished one."""
+    if not self.journal_dir:
+      return
+
+    filename = self._journal_filename(job.id)
+    try:
+      if job.finished:
+        if os.path.exists(filename):
+          os.remove(filename)
+        return
+
+      temp_filename = filename + '.tmp'
+      with open(temp_filename, 'w') as f:
+        json.dump({
+          'id': job.id,
+          'kind': job.kind,
+          'params': job.params,
+          'created': job.created,
+          }, f)
+      os.replace(temp_filename, filename)
+    except OSError as e:
+      app_log.warning('Could not update the journal for job %s: %s',
+                      job.id, e)
+
+  def resume(self):
+    """Restart the unfinished jobs recorded in the journal.
+
+    Returns:
+      The resumed Jobs.
+    """
+    if not self.journal_dir:
+      return []
+
+    resumed = []
+    for name in sorted(os.listdir(self.journal_dir)):
+      if not name.endswith('.json'):
+        continue
+      try:
+        with open(os.path.join(self.journal_dir, name)) as f:
+          record = json.load(f)
+      except (OSError, ValueError) as e:
+        app_log.warning('Skipping unreadable job journal %s: %s', name, e)
+        continue
+
+      if record.get('kind') not in self.runners:
+        continue
+      job = Job(record['kind'], record['params'], job_id=record['id'],
+                resumed=True)
+      job.created = record.get('created', job.created)
+      app_log.info('Resuming %s job %s', job.kind, job.id)
+      resumed.append(self._submit(job))
+    return resumed
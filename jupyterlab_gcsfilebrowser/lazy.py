@@ -0,0 +1,38 @@
+# Lint as: python3
+"""Stand-ins that import the modules which are slow to load on first use.
+
+The handlers module pulls in the storage client, nbformat and nbconvert,
+which take over a second to import. Registering stand-ins instead keeps the
+extension from slowing down server start for users who never open the GCS
+file browser.
+"""
+
+import importlib
+
+from tornado.web import RequestHandler
+
+HANDLERS_MODULE = 'jupyterlab_gcsfilebrowser.handlers'
+
+
+def lazy_handler(class_name, module_name=HANDLERS_MODULE):
+  """A RequestHandler class that builds module_name.class_name per request.
+
+  Tornado calls the returned class for every request. Since its __new__
+  returns an instance of the real handler class, the real handler runs the
+  request and the module is only imported by the first one.
+  """
+  def __new__(cls, *args, **kwargs):
+    handler_class = getattr(importlib.import_module(module_name), class_name)
+    return handler_class(*args, **kwargs)
+
+  return type(class_name, (RequestHandler,), {'__new__': __new__})
+
+
+def lazy_function(function_name, module_name=HANDLERS_MODULE):
+  """A function that calls module_name.function_name, importing it first."""
+  def call(*args, **kwargs):
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name)(*args, **kwargs)
+
+  call.__name__ = function_name
+  return call
@@ -0,0 +1,226 @@
+# Lint as: python3
+"""A server-wide budget for the memory held by file transfers."""
+
+import asyncio
+import collections
+import contextlib
+import threading
+
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from jupyterlab_gcsfilebrowser.metrics import METRICS
+
+# Bytes that transfers may hold in memory at once, unless configured.
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+# Seconds a transfer waits for memory before it fails.
+DEFAULT_WAIT_TIMEOUT = 60
+
+
+class MemoryBudgetExceeded(Exception):
+  """Memory for a transfer did not become available in time."""
+  pass
+
+
+def budget_exceeded():
+  return MemoryBudgetExceeded(
+    'Error: The server is busy with other transfers, try again later')
+
+
+def on_event_loop():
+  """Whether the calling thread is running an event loop."""
+  try:
+    asyncio.get_running_loop()
+  except RuntimeError:
+    return False
+  return True
+
+
+class _Waiter(object):
+  """A reservation that a coroutine waits for."""
+
+  def __init__(self, nbytes, future, io_loop):
+    self.nbytes = nbytes
+    self.future = future
+    self.io_loop = io_loop
+    self.timeout = None
+
+
+class MemoryBudget(object):
+  """Limits the bytes that concurrent transfers hold in memory.
+
+  A transfer reserves what it is about to buffer and releases it once done.
+  Reservations that do not fit wait for others to be released, so memory use
+  stays under the budget whatever the number of transfers. A reservation
+  bigger than the whole budget waits until it has the budget to itself. A
+  max_bytes of 0 disables the budget.
+
+  Coroutines wait with acquire_async, which never blocks the event loop.
+  """
+
+  def __init__(self, max_bytes=DEFAULT_MAX_BYTES,
+               wait_timeout=DEFAULT_WAIT_TIMEOUT):
+    self.max_bytes = max_bytes
+    self.wait_timeout = wait_timeout
+    self._condition = threading.Condition()
+    self._reserved = 0
+    self._reservations = 0
+    self._waiting = 0
+    self._peak = 0
+    self._waiters = collections.deque()
+
+  def configure(self, max_bytes, wait_timeout):
+    with self._condition:
+      self.max_bytes = max_bytes
+      self.wait_timeout = wait_timeout
+      self._wake()
+
+  def _cost(self, nbytes):
+    nbytes = max(nbytes or 0, 0)
+    return min(nbytes, self.max_bytes) if self.max_bytes else nbytes
+
+  def _fits(self, cost):
+    return not self.max_bytes or self._reserved + cost <= self.max_bytes
+
+  def _take(self, cost):
+    self._reserved += cost
+    self._reservations += 1
+    self._peak = max(self._peak, self._reserved)
+    return cost
+
+  def try_acquire(self, nbytes):
+    """Reserve nbytes if they fit right away.
+
+    Returns:
+      The bytes reserved, to pass to release, or None.
+    """
+    with self._condition:
+      cost = self._cost(nbytes)
+      return self._take(cost) if self._fits(cost) else None
+
+  def acquire(self, nbytes, timeout=None):
+    """Reserve nbytes, waiting for earlier reservations to be released.
+
+    Returns:
+      The bytes reserved, to pass to release.
+    Raises:
+      MemoryBudgetExceeded if they did not fit within timeout seconds,
+      wait_timeout by default.
+    """
+    with self._condition:
+      cost = self._cost(nbytes)
+      # Coroutines queued by acquire_async are served first.
+      if not self._waiters and self._fits(cost):
+        return self._take(cost)
+      if on_event_loop():
+        # Waiting here would stall every other request of the server.
+        raise budget_exceeded()
+
+      METRICS.add('memory_waits')
+      self._waiting += 1
+      try:
+        if not self._condition.wait_for(
+            lambda: not self._waiters and self._fits(self._cost(nbytes)),
+            self.wait_timeout if timeout is None else timeout):
+          raise budget_exceeded()
+        return self._take(self._cost(nbytes))
+      finally:
+        self._waiting -= 1
+
+  def acquire_async(self, nbytes, timeout=None):
+    """Reserve nbytes from a coroutine, see acquire.
+
+    Must be called on the thread of the current IOLoop.
+
+    Returns:
+      A Future of the bytes reserved, to pass to release. It fails with
+      MemoryBudgetExceeded if they did not fit in time.
+    """
+    future = Future()
+    io_loop = IOLoop.current()
+    with self._condition:
+      cost = self._cost(nbytes)
+      if not self._waiters and self._fits(cost):
+        future.set_result(self._take(cost))
+        return future
+
+      METRICS.add('memory_waits')
+      self._waiting += 1
+      waiter = _Waiter(nbytes, future, io_loop)
+      self._waiters.append(waiter)
+      waiter.timeout = io_loop.call_later(
+        self.wait_timeout if timeout is None else timeout,
+        self._expire, waiter)
+    return future
+
+  def _expire(self, waiter):
+    with self._condition:
+      if waiter not in self._waiters:
+        return
+      self._waiters.remove(waiter)
+      self._waiting -= 1
+      self._wake()
+    waiter.future.set_exception(budget_exceeded())
+
+  def _wake(self):
+    """Grant the waiting coroutines that fit, in the order they came.
+
+    Called with the condition held.
+    """
+    while self._waiters and self._fits(self._cost(self._waiters[0].nbytes)):
+      waiter = self._waiters.popleft()
+      self._waiting -= 1
+      cost = self._take(self._cost(waiter.nbytes))
+      waiter.io_loop.add_callback(self._grant, waiter, cost)
+    self._condition.notify_all()
+
+  def _grant(self, waiter, cost):
+    waiter.io_loop.remove_timeout(waiter.timeout)
+    if waiter.future.done():
+      self.release(cost)
+    else:
+      waiter.future.set_result(cost)
+
+  def release(self, cost):
+    with self._condition:
+      self._reserved -= cost
+      self._reservations -= 1
+      self._wake()
+
+  @contextlib.contextmanager
+  def reserve(self, nbytes, timeout=None):
+    """Hold a reservation of nbytes for the block, see acquire."""
+    cost = self.acquire(nbytes, timeout)
+    try:
+      yield
+    finally:
+      self.release(cost)
+
+  @contextlib.contextmanager
+  def try_reserve(self, nbytes):
+    """Hold a reservation of nbytes if they fit right away.
+
+    Yields:
+      True if the bytes were reserved.
+    """
+    cost = self.try_acquire(nbytes)
+    try:
+      yield cost is not None
+    finally:
+      if cost is not None:
+        self.release(cost)
+
+  def snapshot(self):
+    """Returns a dict of the current reservations, for monitoring."""
+    with self._condition:
+      return {
+        'memory_budget_bytes': self.max_bytes,
+        'memory_reserved_bytes': self._reserved,
+        'memory_peak_reserved_bytes': self._peak,
+        'memory_reservations': self._reservations,
+        'memory_waiting': self._waiting,
+      }
+
+
+# Shared by the whole server.
+BUDGET = MemoryBudget()
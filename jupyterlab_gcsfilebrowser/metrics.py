@@ -0,0 +1,26 @@
+# Lint as: python3
+"""Counters of the server's storage work, reported by the metrics endpoint."""
+
+import collections
+import threading
+
+
+class Counters(object):
+  """Thread-safe named counters."""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._counts = collections.Counter()
+
+  def add(self, name, value=1):
+    with self._lock:
+      self._counts[name] += value
+
+  def snapshot(self):
+    """Returns a dict of the current counts."""
+    with self._lock:
+      return dict(self._counts)
+
+
+# Shared by the whole server.
+METRICS = Counters()
@@ -0,0 +1,146 @@
+# Lint as: python3
+"""Notebook parsing and encoding in worker processes.
+
+Decoding, validating and encoding a notebook of hundreds of MB holds the GIL
+for seconds, which stalls every other request of the server. Work on large
+notebooks runs in a small pool of worker processes instead; small notebooks
+are handled inline, where a round trip to a worker would cost more than the
+work itself. Workers return strings rather than notebook objects, so that
+passing results back is a copy rather than a rebuild of the notebook.
+"""
+
+import json
+import multiprocessing
+import threading
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Notebooks at least this big are handled in a worker process, unless
+# configured.
+DEFAULT_PROCESS_THRESHOLD = 4 * 1024 * 1024
+# Worker processes, unless configured. 0 handles every notebook inline.
+DEFAULT_PROCESS_WORKERS = 2
+
+
+class InvalidUpload(ValueError):
+  """The body of an upload request is not a valid upload model."""
+  pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_threshold = DEFAULT_PROCESS_THRESHOLD
+_workers = DEFAULT_PROCESS_WORKERS
+
+
+def configure_notebook_pool(workers, threshold):
+  """Set the number of worker processes and the size handled by them."""
+  global _workers, _threshold
+  with _pool_lock:
+    _workers = workers
+    _threshold = threshold
+
+
+def shared_pool():
+  global _pool
+  with _pool_lock:
+    if _pool is None:
+      # Workers are spawned rather than forked from the threaded server.
+      _pool = ProcessPoolExecutor(
+        max_workers=_workers,
+        mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+
+def _discard_pool(pool):
+  global _pool
+  with _pool_lock:
+    if _pool is pool:
+      _pool = None
+  pool.shutdown(wait=False)
+
+
+def notebook_task(fn, size, *args):
+  """Call fn(*args) for a notebook of size bytes.
+
+  fn must be a module-level function, so that workers can import it.
+
+  Returns:
+    A future that a coroutine can yield for the result. Small notebooks are
+    handled right away and get a completed future.
+  """
+  if _workers and size >= _threshold:
+    pool = shared_pool()
+    try:
+      return pool.submit(fn, *args)
+    except BrokenProcessPool:
+      # A worker died, e.g. killed for running out of memory. Start over
+      # with a new pool.
+      _discard_pool(pool)
+      return shared_pool().submit(fn, *args)
+
+  future = Future()
+  try:
+    future.set_result(fn(*args))
+  except Exception as e:
+    future.set_exception(e)
+  return future
+
+
+def decode_upload(body):
+  """Parse the JSON body of an upload request.
+
+  A notebook sent as JSON is validated, and encoded to the text that is
+  stored, and sent on as 'text', which writes the same bytes. Notebooks with
+  lazy output placeholders stay JSON, since their outputs are merged before
+  saving.
+
+  Returns:
+    The upload model.
+  Raises:
+    InvalidUpload if the body is not a JSON object, or a JSON notebook that
+    is missing or not valid. Workers raise it too, so a bad body is reported
+    the same way whether or not it was parsed inline.
+  """
+  # Imported here since nbformat is slow to load.
+  from jupyterlab_gcsfilebrowser.outputs import LAZY_OUTPUT_KEY
+
+  try:
+    model = json.loads(body)
+    if model.get('format') != 'json':
+      return model
+    content = model['content']
+  except (ValueError, TypeError, KeyError, AttributeError):
+    raise InvalidUpload('Invalid JSON in body of request')
+  validate_notebook(content)
+  if LAZY_OUTPUT_KEY.encode('utf-8') not in body:
+    model = dict(model, format='text', content=json.dumps(content))
+  return model
+
+
+def validate_notebook(content):
+  """Raises InvalidUpload unless content is a valid notebook."""
+  import nbformat
+
+  try:
+    nbformat.validate(content)
+  except nbformat.ValidationError as e:
+    raise InvalidUpload('Invalid notebook in body of request: %s' % e.message)
+  except (ValueError, TypeError, KeyError, AttributeError, AssertionError):
+    raise InvalidUpload('Invalid notebook in body of request')
+
+
+def export_notebook(exporter_name, text):
+  """Parse, validate and convert a notebook with nbconvert.
+
+  Returns:
+    A tuple of the output, its file extension and its MIME type.
+  """
+  import nbformat
+  from notebook.nbconvert.handlers import get_exporter
+
+  nb = nbformat.reads(text, as_version=4)
+  exporter = get_exporter(exporter_name)
+  output, resources = exporter.from_notebook_node(nb)
+  return output, resources['output_extension'], exporter.output_mimetype
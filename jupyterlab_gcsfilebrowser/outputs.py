@@ -0,0 +1,207 @@
+# Lint as: python3
+"""Placeholders for large notebook outputs, loaded on demand."""
+
+import collections
+import json
+import os
+import threading
+
+import nbformat
+
+# Output metadata key of a placeholder, holding where the real output is.
+LAZY_OUTPUT_KEY = 'gcsfilebrowser_lazy_output'
+# Number of saved notebook generations whose output locations are kept.
+MAX_SAVED_LOCATIONS = 1000
+
+
+class StaleOutputs(Exception):
+  """The notebook holding an output changed since its placeholder was made."""
+  pass
+
+
+def output_size(output):
+  """Approximate size in bytes of an output in the notebook file."""
+  return len(json.dumps(output))
+
+
+def format_size(size):
+  for unit in ('bytes', 'KB', 'MB'):
+    if size < 1024:
+      break
+    size /= 1024.0
+  else:
+    unit = 'GB'
+  return ('%d %s' if unit == 'bytes' else '%.1f %s') % (size, unit)
+
+
+def placeholder(path, generation, cell, output, size):
+  """A display_data output standing in for output of cell in the notebook."""
+  return nbformat.v4.new_output(
+    'display_data',
+    data={
+      'text/plain': 'Output not loaded (%s). Right-click the cell and '
+                    'choose Load Unloaded Outputs to show it. It is kept '
+                    'when the notebook is saved.' % format_size(size),
+    },
+    metadata={
+      LAZY_OUTPUT_KEY: {
+        'path': path,
+        'generation': generation,
+        'cell': cell,
+        'output': output,
+        'size': size,
+      },
+    })
+
+
+def strip_outputs(nb, path, generation, min_size):
+  """Replace the outputs of at least min_size bytes with placeholders.
+
+  Args:
+    nb: A version 4 NotebookNode, changed in place.
+    path: The path of the notebook, recorded in the placeholders.
+    generation: The generation of the notebook object.
+    min_size: The smallest output size in bytes that is replaced.
+  Returns:
+    The number of outputs replaced.
+  """
+  replaced = 0
+  for c, cell in enumerate(nb.cells):
+    outputs = cell.get('outputs') or []
+    for o, output in enumerate(outputs):
+      size = output_size(output)
+      if size >= min_size:
+        outputs[o] = placeholder(path, generation, c, o, size)
+        replaced += 1
+  return replaced
+
+
+def placeholders(nb):
+  """Yields (cell index, outputs, index, reference) for every placeholder."""
+  for c, cell in enumerate(nb.get('cells', ())):
+    outputs = cell.get('outputs') or []
+    for o, output in enumerate(outputs):
+      reference = output.get('metadata', {}).get(LAZY_OUTPUT_KEY)
+      if reference is not None:
+        yield c, outputs, o, reference
+
+
+def notebook_key(path):
+  return os.path.normpath('/' + path.lstrip('/'))
+
+
+def reference_key(reference):
+  return (notebook_key(reference['path']), str(reference['generation']),
+          reference['cell'], reference['output'])
+
+
+class OutputLocations(object):
+  """Where the outputs behind placeholders were stored by later saves.
+
+  Placeholders keep the generation the notebook was opened at, while every
+  save of the open notebook creates a new generation in which cells may have
+  moved. Each save records the cell and output index it stored the output of
+  every placeholder at, so that the next save and output requests find it.
+  """
+
+  def __init__(self, max_entries=MAX_SAVED_LOCATIONS):
+    self.max_entries = max_entries
+    self._lock = threading.Lock()
+    self._locations = collections.OrderedDict()
+
+  def record(self, path, generation, merged):
+    """Record where a save stored the outputs of placeholders.
+
+    Args:
+      path: The path the notebook was saved to.
+      generation: The generation the save created.
+      merged: (reference, cell index, output index) for each placeholder of
+        the saved notebook, as returned by merge_outputs.
+    """
+    locations = {reference_key(reference): (c, o)
+                 for reference, c, o in merged}
+    key = (notebook_key(path), str(generation))
+    with self._lock:
+      self._locations[key] = locations
+      self._locations.move_to_end(key)
+      while len(self._locations) > self.max_entries:
+        self._locations.popitem(last=False)
+
+  def locate(self, reference, generation):
+    """The (cell, output) indices of a placeholder's output in generation.
+
+    Returns:
+      The indices, or None if no save through this server created that
+      generation with the output in it.
+    """
+    if str(reference['generation']) == str(generation):
+      return reference['cell'], reference['output']
+    key = (notebook_key(reference['path']), str(generation))
+    with self._lock:
+      locations = self._locations.get(key)
+      if locations is None:
+        return None
+      self._locations.move_to_end(key)
+      return locations.get(reference_key(reference))
+
+
+LOCATIONS = OutputLocations()
+
+
+def cell_outputs(nb, cell):
+  """The outputs of the cell at the given index of nb.
+
+  Raises:
+    IndexError if there is no such cell.
+  """
+  if not 0 <= cell < len(nb.cells):
+    raise IndexError('No cell %d' % cell)
+  return nb.cells[cell].get('outputs') or []
+
+
+def get_output(nb, cell, output):
+  """The output at the given cell and output index of nb.
+
+  Raises:
+    IndexError if there is no such output.
+  """
+  outputs = cell_outputs(nb, cell)
+  if not 0 <= output < len(outputs):
+    raise IndexError('No output %d in cell %d' % (output, cell))
+  return outputs[output]
+
+
+def merge_outputs(nb, read_notebook, locations=LOCATIONS):
+  """Put the real outputs back in place of the placeholders in nb.
+
+  Args:
+    nb: A NotebookNode or notebook dict, changed in place.
+    read_notebook: Called with a path, returns (NotebookNode, generation) of
+      the stored notebook. Each path is read once.
+    locations: The OutputLocations of earlier saves.
+  Returns:
+    A list of (reference, cell index, output index) for each placeholder
+    that was replaced, to record with the generation nb is saved as.
+  Raises:
+    StaleOutputs if a stored notebook changed since its outputs were
+      replaced by placeholders, other than by saves of nb.
+  """
+  notebooks = {}
+  merged = []
+  for c, outputs, index, reference in list(placeholders(nb)):
+    path = reference['path']
+    if path not in notebooks:
+      notebooks[path] = read_notebook(path)
+    original, generation = notebooks[path]
+    location = locations.locate(reference, generation)
+    if location is None:
+      raise StaleOutputs(
+        'Error: "%s" changed since it was opened, so its unloaded outputs '
+        'can no longer be saved. Reopen the notebook.' % path)
+    try:
+      outputs[index] = get_output(original, *location)
+    except IndexError:
+      raise StaleOutputs('Error: An unloaded output of "%s" was not found' %
+                         path)
+    merged.append((reference, c, index))
+  return merged
@@ -0,0 +1,142 @@
+# Lint as: python3
+"""Background prefetch of small files into the content cache."""
+
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from notebook.base.handlers import app_log
+
+# Niceness applied to prefetch worker threads where the platform allows it.
+PREFETCH_NICENESS = 10
+
+
+class Cancelled(Exception):
+  """The prefetch batch was superseded."""
+  pass
+
+
+class TokenBucket(object):
+  """Thread-safe token bucket used to cap prefetch bandwidth."""
+
+  def __init__(self, rate):
+    self.rate = rate
+    self._lock = threading.Lock()
+    self._tokens = float(rate)
+    self._last = time.monotonic()
+
+  def consume(self, amount, is_cancelled=lambda: False):
+    """Block until 'amount' tokens are available.
+
+    Requests larger than the bucket are allowed once the bucket is full, so
+    that they do not wait forever.
+
+    Raises:
+      Cancelled if is_cancelled() becomes true while waiting.
+    """
+    if self.rate <= 0:
+      return
+    amount = min(amount, self.rate)
+    while True:
+      with self._lock:
+        now = time.monotonic()
+        self._tokens = min(
+          self.rate, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        if self._tokens >= amount:
+          self._tokens -= amount
+          return
+        wait = (amount - self._tokens) / self.rate
+      if is_cancelled():
+        raise Cancelled()
+      time.sleep(min(wait, 0.1))
+
+
+def _lower_thread_priority():
+  try:
+    os.setpriority(
+      os.PRIO_PROCESS, threading.get_native_id(), PREFETCH_NICENESS)
+  except (AttributeError, OSError):
+    pass
+
+
+class Prefetcher(object):
+  """Downloads small objects from the open directory into the content cache.
+
+  Only the most recently listed directory is prefetched: scheduling a new
+  batch, or calling cancel(), drops any downloads that have not finished.
+  """
+
+  def __init__(self, content_cache, max_object_bytes, max_workers,
+               max_bytes_per_second):
+    self.content_cache = content_cache
+    self.max_object_bytes = max_object_bytes
+    self._throttle = TokenBucket(max_bytes_per_second)
+    self._executor = ThreadPoolExecutor(
+      max_workers=max_workers,
+      thread_name_prefix='gcs-prefetch')
+    self._lock = threading.Lock()
+    self._epoch = 0
+    self._futures = []
+
+  def _is_candidate(self, blob):
+    return (not blob.name.endswith('/')
+            and blob.size is not None
+            and blob.size <= self.max_object_bytes
+            and blob.generation is not None
+            and not self.content_cache.contains(
+              blob.bucket.name, blob.name, blob.generation))
+
+  def prefetch(self, blobs):
+    """Schedule downloads for a new directory listing.
+
+    Args:
+      blobs: The listed Blobs that are immediate children of the directory.
+    """
+    candidates = sorted(
+      (b for b in blobs if self._is_candidate(b)), key=lambda b: b.size)
+
+    with self._lock:
+      epoch = self._cancel_locked()
+      self._futures = [
+        self._executor.submit(self._fetch, epoch, blob)
+        for blob in candidates]
+
+  def cancel(self):
+    """Drop all scheduled and in-flight downloads."""
+    with self._lock:
+      self._cancel_locked()
+
+  def _cancel_locked(self):
+    for future in self._futures:
+      future.cancel()
+    self._futures = []
+    self._epoch += 1
+    return self._epoch
+
+  def _fetch(self, epoch, blob):
+    # Imported here since the storage libraries are slow to load and the
+    # prefetcher is created at server start.
+    from jupyterlab_gcsfilebrowser.retry import STORAGE_RETRY
+
+    def is_cancelled():
+      return self._epoch != epoch
+
+    def download(file_obj):
+      if is_cancelled():
+        raise Cancelled()
+      blob.download_to_file(file_obj, retry=STORAGE_RETRY)
+
+    try:
+      _lower_thread_priority()
+      if is_cancelled() or not self._is_candidate(blob):
+        return
+      self._throttle.consume(blob.size, is_cancelled)
+      self.content_cache.put(
+        blob.bucket.name, blob.name, blob.generation, download)
+    except Cancelled:
+      pass
+    except Exception as e:
+      app_log.debug('Prefetch of gs://%s/%s failed: %s',
+                    blob.bucket.name, blob.name, e)
@@ -0,0 +1,123 @@
+# Lint as: python3
+"""Retry policy and adaptive concurrency for GCS requests."""
+
+import threading
+import time
+
+import requests
+
+from google.api_core import exceptions
+from google.api_core.retry import Retry
+from google.auth.exceptions import TransportError
+
+try:
+  from google.cloud.storage.exceptions import InvalidResponse
+except ImportError:
+  # Before google-cloud-storage 3, media errors came from resumable_media.
+  from google.resumable_media import InvalidResponse
+
+# Seconds before the first retry. Later retries wait up to twice as long as
+# the previous one, with full jitter, capped at RETRY_MAXIMUM.
+RETRY_INITIAL = 0.5
+RETRY_MAXIMUM = 32.0
+RETRY_MULTIPLIER = 2.0
+# Seconds after which a request is no longer retried.
+RETRY_DEADLINE = 120.0
+
+# HTTP statuses of media uploads and downloads that mean GCS is asking
+# clients to slow down, and those after which the request may succeed.
+THROTTLING_STATUS_CODES = frozenset([429, 503])
+TRANSIENT_STATUS_CODES = THROTTLING_STATUS_CODES | frozenset([408, 500, 502, 504])
+# Responses that mean GCS is asking clients to slow down.
+THROTTLING_ERRORS = (
+  exceptions.TooManyRequests,
+  exceptions.ServiceUnavailable,
+)
+# Errors after which the same request may succeed.
+TRANSIENT_ERRORS = THROTTLING_ERRORS + (
+  exceptions.InternalServerError,
+  exceptions.BadGateway,
+  exceptions.GatewayTimeout,
+  requests.exceptions.ConnectionError,
+  requests.exceptions.ChunkedEncodingError,
+  TransportError,
+  ConnectionError,
+)
+
+
+def _media_status(exc):
+  """The HTTP status of a failed media upload or download, if exc is one."""
+  if isinstance(exc, InvalidResponse):
+    return getattr(exc.response, 'status_code', None)
+  return None
+
+
+def is_throttled(exc):
+  """Whether exc means GCS throttled the request or gave up on retrying it."""
+  if isinstance(exc, exceptions.RetryError):
+    exc = exc.cause
+  return (isinstance(exc, THROTTLING_ERRORS)
+          or _media_status(exc) in THROTTLING_STATUS_CODES)
+
+
+def is_transient(exc):
+  # 408 Request Timeout has no exception class of its own.
+  return isinstance(exc, TRANSIENT_ERRORS) or (
+    isinstance(exc, exceptions.GoogleAPICallError) and exc.code == 408) or (
+    _media_status(exc) in TRANSIENT_STATUS_CODES)
+
+
+class AdaptiveConcurrency(object):
+  """AIMD control of the number of parallel requests.
+
+  Every throttled request halves the limit, at most once per
+  decrease_interval so that a burst of errors from one round of requests
+  counts once. Every successful request adds 1/limit, which grows the limit
+  by about one per round of requests, up to max_limit.
+  """
+
+  def __init__(self, max_limit, min_limit=1, decrease_interval=1.0):
+    self.max_limit = max_limit
+    self.min_limit = min_limit
+    self.decrease_interval = decrease_interval
+    self._limit = float(max_limit)
+    self._last_decrease = 0.0
+    self._lock = threading.Lock()
+
+  @property
+  def limit(self):
+    """The current number of requests that may run in parallel."""
+    return max(self.min_limit, int(self._limit))
+
+  def throttled(self):
+    with self._lock:
+      now = time.monotonic()
+      if now - self._last_decrease < self.decrease_interval:
+        return
+      self._last_decrease = now
+      self._limit = max(float(self.min_limit), self._limit / 2)
+
+  def succeeded(self):
+    with self._lock:
+      self._limit = min(float(self.max_limit), self._limit + 1 / self._limit)
+
+
+# Shared by all parallel storage operations of the server.
+CONCURRENCY = AdaptiveConcurrency(max_limit=16)
+
+
+def _on_error(exc):
+  if is_throttled(exc):
+    CONCURRENCY.throttled()
+
+
+# Retry policy for storage calls. Only pass it to calls that are idempotent,
+# or made idempotent with preconditions.
+STORAGE_RETRY = Retry(
+  predicate=is_transient,
+  initial=RETRY_INITIAL,
+  maximum=RETRY_MAXIMUM,
+  multiplier=RETRY_MULTIPLIER,
+  deadline=RETRY_DEADLINE,
+  on_error=_on_error,
+)
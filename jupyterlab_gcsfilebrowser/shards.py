@@ -0,0 +1,164 @@
+# Lint as: python3
+"""Parallel listing of GCS prefixes split into disjoint key ranges.
+
+A plain listing of a prefix is one chain of page tokens, so walking tens of
+millions of objects takes hours whatever the bandwidth. The key space below
+the prefix is instead split at keys found by a cheap delimited listing, and
+the ranges between them are listed concurrently with start_offset and
+end_offset.
+"""
+
+import queue
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Start keys of the listing shards below a prefix, relative to the prefix,
+# used when the prefix has too many entries to pick split keys from. Object
+# names mostly start with letters and digits, so the key space is split there;
+# names sorting before the first split go to the first shard and names after
+# the last split to the last one.
+SHARD_SPLITS = ('0', '5', 'A', 'I', 'Q', '_', 'c', 'f', 'i', 'l', 'o', 'r',
+                'u', 'x')
+# Ranges listed at the same time.
+MAX_SHARDS = 16
+# Entries read by the delimited listing that looks for split keys.
+SPLIT_PROBE_SIZE = 1000
+# Levels of single subdirectories descended into when looking for split keys.
+MAX_SPLIT_DEPTH = 4
+# Blobs handed from a shard to the caller at a time.
+PAGE_SIZE = 1000
+# Pages listed ahead of the caller before the shards pause.
+MAX_BUFFERED_PAGES = 32
+# Seconds between checks of whether the caller stopped reading.
+STOP_POLL_INTERVAL = 0.1
+
+
+def shard_ranges(prefix, splits=SHARD_SPLITS):
+  """Split the keys below prefix into (start_offset, end_offset) ranges."""
+  return key_ranges([prefix + c for c in splits])
+
+
+def key_ranges(split_keys):
+  """The (start_offset, end_offset) ranges between sorted split keys."""
+  bounds = [None] + list(split_keys) + [None]
+  return list(zip(bounds[:-1], bounds[1:]))
+
+
+def discover_splits(bucket_name, prefix, storage_client,
+                    max_shards=MAX_SHARDS):
+  """Find keys that split the objects below prefix into similar shards.
+
+  The subdirectories of prefix are read with one delimited listing page, and
+  every few of them starts a shard. A prefix with a single subdirectory is
+  split inside that subdirectory instead. A prefix with more entries than fit
+  in the page is split at SHARD_SPLITS, and one without subdirectories is not
+  split at all.
+
+  Returns:
+    A sorted list of split keys.
+  """
+  # Imported here since the storage libraries are slow to load.
+  from jupyterlab_gcsfilebrowser.retry import STORAGE_RETRY
+
+  for _ in range(MAX_SPLIT_DEPTH):
+    iterator = storage_client.list_blobs(
+      bucket_name, prefix=prefix, delimiter='/', page_size=SPLIT_PROBE_SIZE,
+      fields='prefixes,nextPageToken', retry=STORAGE_RETRY)
+    page = next(iter(iterator.pages), None)
+    if page is None:
+      return []
+    if iterator.next_page_token:
+      return [prefix + c for c in SHARD_SPLITS]
+
+    prefixes = sorted(page.prefixes)
+    if len(prefixes) != 1:
+      shards = min(max_shards, len(prefixes))
+      return [prefixes[i * len(prefixes) // shards]
+              for i in range(1, shards)]
+    prefix = prefixes[0]
+  return []
+
+
+def list_ranges(bucket_name, prefix, ranges, storage_client, fields=None,
+                max_buffered_pages=MAX_BUFFERED_PAGES):
+  """Yield the blobs below prefix in key ranges that are listed concurrently.
+
+  Each range is listed by its own thread, which hands pages of blobs to the
+  caller through a bounded queue. When the caller falls behind, the listings
+  pause instead of buffering the whole prefix. Blobs are in name order within
+  a range, but the ranges are interleaved.
+  """
+  from jupyterlab_gcsfilebrowser.retry import STORAGE_RETRY
+
+  def list_range(key_range):
+    start_offset, end_offset = key_range
+    return storage_client.list_blobs(
+      bucket_name, prefix=prefix, start_offset=start_offset,
+      end_offset=end_offset, fields=fields, retry=STORAGE_RETRY)
+
+  if len(ranges) == 1:
+    for b in list_range(ranges[0]):
+      yield b
+    return
+
+  pages = queue.Queue(max_buffered_pages)
+  stopped = threading.Event()
+
+  def put(item):
+    while not stopped.is_set():
+      try:
+        pages.put(item, timeout=STOP_POLL_INTERVAL)
+        return True
+      except queue.Full:
+        pass
+    return False
+
+  def list_shard(key_range):
+    try:
+      page = []
+      for b in list_range(key_range):
+        page.append(b)
+        if len(page) == PAGE_SIZE:
+          if not put(page):
+            return
+          page = []
+      if page:
+        put(page)
+    except Exception as e:
+      put(e)
+    finally:
+      # Marks the end of a range.
+      put(None)
+
+  pool = ThreadPoolExecutor(max_workers=len(ranges))
+  try:
+    for key_range in ranges:
+      pool.submit(list_shard, key_range)
+    remaining = len(ranges)
+    while remaining:
+      item = pages.get()
+      if item is None:
+        remaining -= 1
+      elif isinstance(item, Exception):
+        raise item
+      else:
+        for b in item:
+          yield b
+  finally:
+    stopped.set()
+    pool.shutdown(wait=False)
+
+
+def list_prefix(bucket_name, prefix, storage_client, fields=None,
+                max_shards=MAX_SHARDS):
+  """Yield every blob below prefix, listing shards of it concurrently.
+
+  The order of the blobs is not defined.
+  """
+  splits = []
+  if max_shards > 1:
+    splits = discover_splits(bucket_name, prefix, storage_client, max_shards)
+  for b in list_ranges(bucket_name, prefix, key_ranges(splits),
+                       storage_client, fields):
+    yield b
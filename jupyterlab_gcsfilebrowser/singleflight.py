@@ -0,0 +1,62 @@
+# Lint as: python3
+"""Coalescing of concurrent identical requests."""
+
+import contextvars
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SingleFlight(object):
+  """Runs blocking calls on a thread pool, sharing identical in-flight calls.
+
+  A call made while another call with the same key is still running does not
+  start a new one; it waits for the running call and gets its result (or
+  exception). Results are not kept once a call completes, so later callers
+  always see fresh data.
+  """
+
+  def __init__(self, max_workers):
+    self._executor = ThreadPoolExecutor(
+      max_workers=max_workers, thread_name_prefix='gcs-request')
+    self._lock = threading.Lock()
+    self._calls = {}
+    self.started = 0
+    self.coalesced = 0
+
+  def do(self, key, fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) unless a call for key is already running.
+
+    Returns:
+      A concurrent.futures.Future, which tornado coroutines can yield. The
+      result is shared by all callers and must not be modified.
+    """
+    with self._lock:
+      future = self._calls.get(key)
+      if future is not None:
+        self.coalesced += 1
+        return future
+      # The call runs in the first caller's context, which lets the watchdog
+      # attribute its storage requests.
+      future = self._executor.submit(
+        contextvars.copy_context().run, fn, *args, **kwargs)
+      self._calls[key] = future
+      self.started += 1
+    future.add_done_callback(lambda f: self._forget(key, f))
+    return future
+
+  def run(self, fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) on the pool, without sharing the call.
+
+    For calls that change something, which must each run.
+
+    Returns:
+      A concurrent.futures.Future, which tornado coroutines can yield.
+    """
+    return self._executor.submit(
+      contextvars.copy_context().run, fn, *args, **kwargs)
+
+  def _forget(self, key, future):
+    with self._lock:
+      if self._calls.get(key) is future:
+        del self._calls[key]
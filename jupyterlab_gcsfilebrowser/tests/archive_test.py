@@ -0,0 +1,110 @@
+import datetime
+import io
+import tarfile
+import unittest
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, MagicMock
+
+from jupyterlab_gcsfilebrowser import archive
+from jupyterlab_gcsfilebrowser import download
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser.tests.fakes import fake_list_blobs
+
+from google.cloud.storage import Blob, Bucket
+from tornado.ioloop import IOLoop
+
+
+class TestArchive(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='bucket')
+    self.contents = {
+      'dir/': b'',
+      'dir/a.txt': b'hello world',
+      'dir/empty.txt': b'',
+      'dir/sub/': b'',
+      'dir/sub/b.bin': bytes(range(256)) * 40,
+    }
+    self.blobs = [self.make_blob(name, data)
+                  for name, data in self.contents.items()]
+    self.pool = ThreadPoolExecutor(max_workers=4)
+    self.addCleanup(self.pool.shutdown)
+
+  def make_blob(self, name, data):
+    blob = Blob(name=name, bucket=self.bucket)
+    blob._properties['size'] = str(len(data))
+    blob._properties['updated'] = '2020-01-02T03:04:05.000Z'
+
+    def download_to_file(f, start=None, end=None, **kwargs):
+      f.write(data[start:end + 1])
+
+    blob.download_to_file = Mock(side_effect=download_to_file)
+    return blob
+
+  def testReadAheadSplitsObjectsIntoRanges(self):
+    read_ahead = download.ReadAhead(
+      self.blobs, self.pool, chunk_size=1000, read_ahead=3)
+
+    got = {blob.name: reader.read()
+           for blob, reader in archive.entries(read_ahead)}
+
+    self.assertEqual(self.contents, got)
+    self.assertEqual(11, self.blobs[4].download_to_file.call_count)
+    self.blobs[2].download_to_file.assert_not_called()
+
+  def testChunkReaderReadsAcrossChunks(self):
+    reader = archive.ChunkReader(iter([b'abc', b'', b'defg', b'h']))
+
+    self.assertEqual(b'abcde', reader.read(5))
+    self.assertEqual(b'f', reader.read(1))
+    self.assertEqual(b'gh', reader.read())
+    self.assertEqual(b'', reader.read(3))
+
+  def write(self, archive_format):
+    directory_archive = archive.DirectoryArchive(
+      archive_format, self.blobs, 'dir/', 'dir', IOLoop.current())
+    chunks = []
+    directory_archive._put = chunks.append
+    directory_archive._slots.acquire = Mock(return_value=True)
+    directory_archive._run()
+    self.assertIsNone(chunks.pop())
+    return b''.join(chunks)
+
+  def testZip(self):
+    data = self.write('zip')
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+      self.assertEqual(
+        ['dir/a.txt', 'dir/empty.txt', 'dir/sub/', 'dir/sub/b.bin'],
+        zf.namelist())
+      self.assertEqual(self.contents['dir/sub/b.bin'], zf.read('dir/sub/b.bin'))
+      self.assertEqual((2020, 1, 2, 3, 4, 4),
+                       zf.getinfo('dir/a.txt').date_time)
+
+  def testTarGz(self):
+    data = self.write('tar.gz')
+
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:gz') as tar:
+      self.assertEqual(
+        ['dir/a.txt', 'dir/empty.txt', 'dir/sub', 'dir/sub/b.bin'],
+        tar.getnames())
+      self.assertTrue(tar.getmember('dir/sub').isdir())
+      self.assertEqual(b'hello world', tar.extractfile('dir/a.txt').read())
+
+  def testDirectoryArchiveMissingDirectory(self):
+    storage_client = MagicMock()
+    storage_client.list_blobs = MagicMock(
+      side_effect=fake_list_blobs(self.blobs))
+
+    with self.assertRaises(handlers.FileNotFound):
+      handlers.directory_archive('bucket/missing', 'zip', storage_client)
+    with self.assertRaises(ValueError):
+      handlers.directory_archive('bucket/dir', 'rar', storage_client)
+
+    got = handlers.directory_archive('bucket/dir/', 'tar.gz', storage_client)
+    self.assertEqual(('dir/', 'dir'), (got.prefix, got.root))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,145 @@
+import threading
+import unittest
+from unittest.mock import Mock, MagicMock
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import jobs
+from jupyterlab_gcsfilebrowser.tests.fakes import fake_list_blobs
+
+from google.cloud.exceptions import Forbidden
+from google.cloud.storage import Blob, Bucket
+
+
+class TestBulk(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='bucket')
+    self.blobs = [
+      self.make_blob('dir/a.txt'),
+      self.make_blob('dir/b.txt'),
+      self.make_blob('dir/sub/'),
+      self.make_blob('dir/sub/c.txt'),
+    ]
+    self.storage_client = MagicMock()
+    self.storage_client.list_blobs = MagicMock(
+      side_effect=fake_list_blobs(self.blobs))
+    self.destination = self.storage_client.bucket.return_value.blob
+    self.destination.return_value.rewrite.return_value = (None, 1, 1)
+
+  def make_blob(self, name):
+    blob = Blob(name=name, bucket=self.bucket)
+    blob.delete = Mock()
+    return blob
+
+  def testDeleteResolvesOnceAndBatches(self):
+    results = handlers.bulk([
+      {'action': 'delete', 'localPath': 'bucket/dir/a.txt'},
+      {'action': 'delete', 'localPath': 'bucket/dir/b.txt'},
+      {'action': 'delete', 'localPath': 'bucket/dir/sub'},
+      {'action': 'delete', 'localPath': 'bucket/dir/missing.txt'},
+    ], self.storage_client)
+
+    self.assertEqual(['ok', 'ok', 'ok', 'error'],
+                     [r['status'] for r in results])
+    for b in self.blobs:
+      b.delete.assert_called_once()
+    # One delimited listing of 'dir/' and one listing of the subdirectory.
+    self.assertEqual(2, self.storage_client.list_blobs.call_count)
+    self.storage_client.batch.assert_called_once_with()
+
+  def testCopyPicksDistinctNames(self):
+    results = handlers.bulk([
+      {'action': 'copy', 'localPath': 'bucket/dir/a.txt',
+       'toLocalDir': 'bucket/dir'},
+      {'action': 'copy', 'localPath': 'bucket/dir/a.txt',
+       'toLocalDir': 'bucket/dir'},
+    ], self.storage_client)
+
+    self.assertEqual(['bucket/dir/a-Copy1.txt', 'bucket/dir/a-Copy2.txt'],
+                     [r['path'] for r in results])
+
+  def testMoveKeepsSourceWhenRewriteFails(self):
+    self.destination.return_value.rewrite.side_effect = Forbidden('denied')
+
+    results = handlers.bulk([
+      {'action': 'move', 'oldLocalPath': 'bucket/dir/a.txt',
+       'newLocalPath': 'bucket/dir/z.txt'},
+    ], self.storage_client)
+
+    self.assertEqual('error', results[0]['status'])
+    self.blobs[0].delete.assert_not_called()
+
+  def testCopyDirectory(self):
+    results = handlers.bulk([
+      {'action': 'copy', 'localPath': 'bucket/dir/sub',
+       'toLocalDir': 'bucket/dir'},
+    ], self.storage_client)
+
+    self.assertEqual('bucket/dir/sub-Copy1/', results[0]['path'])
+    self.destination.assert_any_call('dir/sub-Copy1/')
+    self.destination.assert_any_call('dir/sub-Copy1/c.txt')
+
+  def testMoveDirectory(self):
+    results = handlers.bulk([
+      {'action': 'move', 'oldLocalPath': 'bucket/dir/sub',
+       'newLocalPath': 'bucket/dir/moved'},
+    ], self.storage_client)
+
+    self.assertEqual('ok', results[0]['status'])
+    self.destination.assert_any_call('dir/moved/')
+    self.destination.assert_any_call('dir/moved/c.txt')
+    self.blobs[2].delete.assert_called_once()
+    self.blobs[3].delete.assert_called_once()
+
+  def testFailedBatchIsRetriedPerBlob(self):
+    self.storage_client.batch.return_value.__exit__.side_effect = (
+      Forbidden('denied'))
+    self.blobs[1].delete.side_effect = [None, Forbidden('denied')]
+
+    errors = handlers.delete_blobs(self.blobs[:2], self.storage_client)
+
+    self.assertEqual([('bucket', 'dir/b.txt')], list(errors))
+
+
+class TestBulkWithJobs(unittest.TestCase):
+
+  def setUp(self):
+    release = threading.Event()
+    self.addCleanup(release.set)
+    self.job_manager = jobs.JobManager(
+      {'delete': lambda job: release.wait()})
+    bucket = Bucket(client=Mock(), name='bucket')
+    self.file = Blob(name='a.txt', bucket=bucket)
+    self.file.delete = Mock()
+    self.storage_client = MagicMock()
+    self.storage_client.list_blobs = MagicMock(
+      side_effect=fake_list_blobs([self.file]))
+    self.storage_client.bucket.return_value.get_blob.side_effect = (
+      lambda name, **kwargs: self.file if name == 'a.txt' else None)
+
+  def testDirectoriesRunAsJobs(self):
+    results = handlers.bulk_with_jobs([
+      {'action': 'delete', 'localPath': 'bucket/dir'},
+      {'action': 'delete', 'localPath': 'bucket/a.txt'},
+      {'action': 'delete', 'localPath': 'bucket'},
+    ], self.storage_client, self.job_manager)
+
+    job, = self.job_manager.list()
+    self.assertEqual(job.id, results[0]['job']['id'])
+    self.assertEqual(('ok', 'bucket/dir'),
+                     (results[0]['status'], results[0]['localPath']))
+    self.assertEqual('ok', results[1]['status'])
+    self.assertNotIn('job', results[1])
+    self.file.delete.assert_called_once()
+    self.assertEqual('error', results[2]['status'])
+
+  def testWithoutJobManagerEverythingRunsInline(self):
+    results = handlers.bulk_with_jobs([
+      {'action': 'delete', 'localPath': 'bucket/a.txt'},
+    ], self.storage_client)
+
+    self.assertEqual(['ok'], [r['status'] for r in results])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import Mock
+
+from jupyterlab_gcsfilebrowser import cache
+from jupyterlab_gcsfilebrowser import handlers
+
+from google.cloud.storage import Blob, Bucket
+
+
+def fake_download(data):
+  def download(file_obj, **kwargs):
+    file_obj.write(data)
+  return download
+
+
+class TestContentCache(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def testPutAndOpen(self):
+    content_cache = cache.ContentCache(self.cache_dir, 1024)
+    content_cache.put('bucket', 'a.ipynb', 1, fake_download(b'{"cells": []}'))
+
+    with content_cache.open('bucket', 'a.ipynb', 1) as buf:
+      self.assertEqual(b'{"cells": []}', bytes(buf))
+
+    with content_cache.open('bucket', 'a.ipynb', 2) as buf:
+      self.assertIsNone(buf)
+
+  def testEvictsLeastRecentlyUsed(self):
+    content_cache = cache.ContentCache(self.cache_dir, 10)
+    content_cache.put('bucket', 'a', 1, fake_download(b'aaaa'))
+    content_cache.put('bucket', 'b', 1, fake_download(b'bbbb'))
+
+    # Touch 'a' so that 'b' becomes the least recently used entry.
+    with content_cache.open('bucket', 'a', 1):
+      pass
+    content_cache.put('bucket', 'c', 1, fake_download(b'cccc'))
+
+    self.assertTrue(content_cache.contains('bucket', 'a', 1))
+    self.assertFalse(content_cache.contains('bucket', 'b', 1))
+    self.assertTrue(content_cache.contains('bucket', 'c', 1))
+    self.assertEqual(8, content_cache.size)
+
+  def testSkipsObjectsLargerThanBudget(self):
+    content_cache = cache.ContentCache(self.cache_dir, 4)
+    self.assertFalse(
+      content_cache.put('bucket', 'big', 1, fake_download(b'too large')))
+    self.assertEqual([], os.listdir(self.cache_dir))
+
+  def testReloadsExistingEntries(self):
+    content_cache = cache.ContentCache(self.cache_dir, 1024)
+    content_cache.put('bucket', 'a', 1, fake_download(b'aaaa'))
+
+    reloaded = cache.ContentCache(self.cache_dir, 1024)
+    self.assertTrue(reloaded.contains('bucket', 'a', 1))
+    self.assertEqual(4, reloaded.size)
+
+  def testBlobContentsReadThrough(self):
+    content_cache = cache.ContentCache(self.cache_dir, 1024)
+    bucket = Bucket(client=Mock(), name='bucket')
+    blob = Blob(name='a.ipynb', bucket=bucket)
+    blob._properties['generation'] = '7'
+    blob.download_to_file = Mock(side_effect=fake_download(b'contents'))
+
+    for _ in range(2):
+      with handlers.blob_contents(blob, content_cache) as buf:
+        self.assertEqual(b'contents', bytes(buf))
+
+    blob.download_to_file.assert_called_once()
+
+  def testOversizedBlobDownloadedOnce(self):
+    content_cache = cache.ContentCache(self.cache_dir, 4)
+    bucket = Bucket(client=Mock(), name='bucket')
+    blob = Blob(name='big.txt', bucket=bucket)
+    blob._properties.update({'generation': '7', 'size': '9'})
+    blob.download_to_file = Mock(side_effect=fake_download(b'too large'))
+
+    with handlers.blob_contents(blob, content_cache) as buf:
+      self.assertEqual(b'too large', bytes(buf))
+
+    blob.download_to_file.assert_called_once()
+    self.assertEqual([], os.listdir(self.cache_dir))
+
+
+if __name__ == '__main__':
+  unittest.main()
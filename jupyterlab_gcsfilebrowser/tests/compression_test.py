@@ -0,0 +1,303 @@
+import gzip
+import io
+import json
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import zipfile
+from unittest.mock import Mock, MagicMock, patch
+
+from jupyterlab_gcsfilebrowser import archive
+from jupyterlab_gcsfilebrowser import cache
+from jupyterlab_gcsfilebrowser import compression
+from jupyterlab_gcsfilebrowser import download
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+
+from google.cloud.storage import Blob, Bucket
+from tornado.ioloop import IOLoop
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+
+def gzip_blob(name, data, record_size=False):
+  """A gzip-encoded blob, which downloads decompressed like the library."""
+  stored = compression.gzip_compress(data)
+  blob = Blob(name=name, bucket=Bucket(Mock(), 'bucket'))
+  blob._properties.update({
+    'size': str(len(stored)),
+    'contentEncoding': 'gzip',
+    'updated': '2020-01-02T03:04:05.000Z',
+  })
+  if record_size:
+    blob._properties['metadata'] = {
+      compression.UNCOMPRESSED_SIZE_KEY: str(len(data))}
+  blob.download_to_file = Mock(side_effect=lambda f, **kwargs: f.write(
+    stored if kwargs.get('raw_download') else data))
+  return blob
+
+
+class TestCompression(unittest.TestCase):
+
+  def testAcceptsGzip(self):
+    self.assertTrue(compression.accepts_gzip('gzip, deflate, br'))
+    self.assertTrue(compression.accepts_gzip('br;q=1.0, GZIP;q=0.5'))
+    self.assertTrue(compression.accepts_gzip('*'))
+    self.assertFalse(compression.accepts_gzip('gzip;q=0'))
+    self.assertFalse(compression.accepts_gzip('deflate, br'))
+    self.assertFalse(compression.accepts_gzip(None))
+
+  def testCompressionIsDeterministic(self):
+    data = b'{"cells": []}' * 100
+
+    self.assertEqual(compression.gzip_compress(data),
+                     compression.gzip_compress(data))
+    self.assertEqual(data, gzip.decompress(compression.gzip_compress(data)))
+
+  def testContentSize(self):
+    data = b'x' * 5000
+    recorded = gzip_blob('a.txt', data, record_size=True)
+    unrecorded = gzip_blob('b.txt', data)
+
+    self.assertEqual(5000, compression.content_size(recorded))
+    self.assertIsNone(compression.content_size(unrecorded))
+    self.assertEqual(compression.GZIP_EXPANSION_ESTIMATE * unrecorded.size,
+                     compression.estimated_content_size(unrecorded))
+
+
+class TestGzipUpload(unittest.TestCase):
+
+  def setUp(self):
+    self.storage_client = MagicMock()
+    self.storage_client.bucket.return_value.get_blob.return_value = None
+    self.blob = self.storage_client.get_bucket.return_value.blob.return_value
+    self.blob.content_encoding = None
+
+  def save(self, content):
+    return handlers.upload({
+      'path': 'bucket/a.ipynb',
+      'format': 'text',
+      'content': content,
+      }, self.storage_client)
+
+  def testStoresTextGzipEncoded(self):
+    content = json.dumps({'cells': [{'source': 'x' * 1000}] * 30})
+
+    with patch.object(compression, '_enabled', True):
+      self.save(content)
+
+    data = self.blob.upload_from_string.call_args[0][0]
+    self.assertEqual(content.encode('utf-8'), gzip.decompress(data))
+    self.assertLess(len(data), len(content) // 10)
+    self.assertEqual('gzip', self.blob.content_encoding)
+    self.assertEqual({compression.UNCOMPRESSED_SIZE_KEY: str(len(content))},
+                     self.blob.metadata)
+
+  def testSkipsUnchangedGzipContent(self):
+    content = 'y' * handlers.SKIP_UNCHANGED_MIN_BYTES
+    stored = compression.gzip_compress(content.encode('utf-8'))
+    stored_blob = Blob(name='a.ipynb', bucket=Bucket(Mock(), 'bucket'))
+    stored_blob._properties.update({
+      'size': str(len(stored)),
+      'crc32c': handlers.crc32c(stored),
+    })
+    self.storage_client.bucket.return_value.get_blob.return_value = stored_blob
+
+    with patch.object(compression, '_enabled', True):
+      self.assertIs(stored_blob, self.save(content))
+    self.blob.upload_from_string.assert_not_called()
+
+  def testSmallOrDisabledStaysUncompressed(self):
+    with patch.object(compression, '_enabled', True):
+      self.save('small')
+    self.save('x' * 5000)
+
+    for call in self.blob.upload_from_string.call_args_list:
+      self.assertFalse(call[0][0].startswith(b'\x1f\x8b'))
+    self.assertIsNone(self.blob.content_encoding)
+
+
+class TestCompressOffEventLoop(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/new', handlers.NewHandler)],
+                       gcs_single_flight=SingleFlight(2))
+
+  def testNewFileCompressesInRequestThread(self):
+    threads = []
+
+    def gzip_compress(data):
+      threads.append(threading.current_thread().name)
+      return compression.gzip_compress(data)
+
+    storage_client = MagicMock()
+    storage_client.bucket.return_value.get_blob.return_value = None
+    blob = storage_client.get_bucket.return_value.blob.return_value
+    blob.bucket.name = 'bucket'
+    blob.name = 'untitled.txt'
+    blob.content_type = 'text/plain'
+    body = json.dumps({'type': 'file', 'ext': 'txt', 'path': 'bucket'})
+    with patch.object(handlers, 'gzip_compress', gzip_compress), \
+        patch.object(handlers, 'should_compress', return_value=True), \
+        patch.object(handlers, 'generate_next_unique_name',
+                     return_value='untitled.txt'), \
+        patch.object(handlers, 'read_file_content',
+                     return_value=('text', '')), \
+        patch.object(handlers, 'shared_storage_client',
+                     return_value=storage_client):
+      response = self.fetch('/new', method='POST', body=body)
+
+    self.assertEqual(200, response.code)
+    self.assertEqual(1, len(threads))
+    self.assertTrue(threads[0].startswith('gcs-request'))
+
+
+class TestGzipDownload(unittest.TestCase):
+
+  def setUp(self):
+    self.data = b'hello world\n' * 1000
+    self.blob = gzip_blob('dir/a.txt', self.data)
+
+  def testReadAheadFetchesWholeObject(self):
+    read_ahead = download.ReadAhead([self.blob], Mock(), chunk_size=100)
+
+    self.assertEqual([(self.blob, 0, None)],
+                     list(read_ahead._iter_ranges([self.blob], 100)))
+    self.assertEqual(self.data, download.download_range(self.blob, 0, None))
+
+  def testDownloadIsNotSplit(self):
+    f = io.BytesIO()
+    download.download_to_file(self.blob, f, threshold=1)
+
+    self.assertEqual(self.data, f.getvalue())
+    self.blob.download_to_file.assert_called_once()
+
+  def write(self, archive_format):
+    directory_archive = archive.DirectoryArchive(
+      archive_format, [self.blob], 'dir/', 'dir', IOLoop.current())
+    chunks = []
+    directory_archive._put = chunks.append
+    directory_archive._slots.acquire = Mock(return_value=True)
+    directory_archive._run()
+    self.assertIsNone(chunks.pop())
+    return b''.join(chunks)
+
+  def testArchivesUseContentSize(self):
+    with zipfile.ZipFile(io.BytesIO(self.write('zip'))) as zf:
+      self.assertEqual(self.data, zf.read('dir/a.txt'))
+    with tarfile.open(fileobj=io.BytesIO(self.write('tar.gz')),
+                      mode='r:gz') as tar:
+      self.assertEqual(self.data, tar.extractfile('dir/a.txt').read())
+
+
+class CompressedHandler(handlers.StorageHandler):
+
+  def get(self):
+    return self.finish_compressed(json.dumps({'content': 'x' * 5000}))
+
+
+class TestCompressedResponse(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/contents', CompressedHandler)])
+
+  def fetch_contents(self, accept_encoding):
+    return self.fetch('/contents', decompress_response=False,
+                      headers={'Accept-Encoding': accept_encoding})
+
+  def testGzipWhenAccepted(self):
+    with patch.object(compression, '_enabled', True):
+      response = self.fetch_contents('gzip')
+
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual('x' * 5000,
+                     json.loads(gzip.decompress(response.body))['content'])
+
+  def testIdentityOtherwise(self):
+    with patch.object(compression, '_enabled', True):
+      response = self.fetch_contents('identity')
+    self.assertNotIn('Content-Encoding', response.headers)
+
+    response = self.fetch_contents('gzip')
+    self.assertNotIn('Content-Encoding', response.headers)
+    self.assertEqual('x' * 5000, json.loads(response.body)['content'])
+
+
+class TestRawDownload(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/files(.*)', handlers.GCSHandler)])
+
+  def setUp(self):
+    super(TestRawDownload, self).setUp()
+    self.data = b'hello world\n' * 1000
+    self.blob = gzip_blob('dir/a.txt', self.data)
+    self.blob._properties.update({
+      'generation': '5', 'contentType': 'text/plain'})
+    storage_client = MagicMock()
+    storage_client.bucket.return_value.get_blob.return_value = self.blob
+    patcher = patch.object(handlers, 'shared_storage_client',
+                           return_value=storage_client)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def fetch_raw(self, accept_encoding):
+    return self.fetch('/files/bucket/dir/a.txt?raw=1',
+                      decompress_response=False,
+                      headers={'Accept-Encoding': accept_encoding})
+
+  def testStoredBytesPassThrough(self):
+    response = self.fetch_raw('gzip')
+
+    self.assertEqual('gzip', response.headers['Content-Encoding'])
+    self.assertEqual(compression.gzip_compress(self.data), response.body)
+    self.assertEqual('5', response.headers['X-GCS-Generation'])
+    self.assertTrue(
+      self.blob.download_to_file.call_args[1]['raw_download'])
+
+  def testDecompressedWhenGzipNotAccepted(self):
+    response = self.fetch_raw('identity')
+
+    self.assertNotIn('Content-Encoding', response.headers)
+    self.assertEqual(self.data, response.body)
+    self.assertNotIn('raw_download', self.blob.download_to_file.call_args[1])
+
+  def testMissingFile(self):
+    handlers.shared_storage_client().bucket().get_blob.return_value = None
+
+    self.assertEqual(404, self.fetch_raw('gzip').code)
+
+
+class TestRawTextCached(AsyncHTTPTestCase):
+
+  def get_app(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.cache_dir)
+    return Application(
+      [('/files(.*)', handlers.GCSHandler)],
+      gcs_content_cache=cache.ContentCache(self.cache_dir, 1024 * 1024),
+      gcs_single_flight=SingleFlight(2))
+
+  def testPlainTextReadThroughCache(self):
+    data = b'hello world\n' * 100
+    blob = Blob(name='dir/a.txt', bucket=Bucket(Mock(), 'bucket'))
+    blob._properties.update({
+      'size': str(len(data)), 'generation': '5', 'contentType': 'text/plain'})
+    blob.download_to_file = Mock(
+      side_effect=lambda f, **kwargs: f.write(data))
+    storage_client = MagicMock()
+    storage_client.bucket.return_value.get_blob.return_value = blob
+
+    with patch.object(handlers, 'shared_storage_client',
+                      return_value=storage_client):
+      responses = [self.fetch('/files/bucket/dir/a.txt?raw=1')
+                   for _ in range(2)]
+
+    self.assertEqual([data, data], [r.body for r in responses])
+    self.assertEqual(1, blob.download_to_file.call_count)
+
+
+if __name__ == '__main__':
+  unittest.main()
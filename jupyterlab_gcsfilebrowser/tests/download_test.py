@@ -0,0 +1,66 @@
+import base64
+import io
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock
+
+import google_crc32c
+
+from jupyterlab_gcsfilebrowser import download
+
+from google.cloud.storage import Blob, Bucket
+
+
+class TestDownload(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='bucket')
+    self.data = bytes(range(256)) * 100
+    self.pool = ThreadPoolExecutor(max_workers=4)
+    self.addCleanup(self.pool.shutdown)
+
+  def make_blob(self, data, crc32c=None):
+    blob = Blob(name='big.bin', bucket=self.bucket)
+    blob._properties['size'] = str(len(data))
+    if crc32c is None:
+      crc32c = base64.b64encode(google_crc32c.Checksum(data).digest())
+    blob._properties['crc32c'] = crc32c.decode('utf-8')
+
+    def download_to_file(f, start=None, end=None, **kwargs):
+      if start is None:
+        f.write(data)
+      else:
+        f.write(data[start:end + 1])
+
+    blob.download_to_file = Mock(side_effect=download_to_file)
+    return blob
+
+  def testParallelDownloadIsOrderedAndVerified(self):
+    blob = self.make_blob(self.data)
+
+    got = io.BytesIO()
+    download.download_to_file(
+      blob, got, self.pool, threshold=1, chunk_size=1000)
+
+    self.assertEqual(self.data, got.getvalue())
+    self.assertEqual(26, blob.download_to_file.call_count)
+
+  def testChecksumMismatch(self):
+    blob = self.make_blob(self.data, crc32c=b'AAAAAA==')
+
+    with self.assertRaises(download.ChecksumMismatch):
+      download.download_to_file(blob, io.BytesIO(), self.pool, threshold=1)
+
+  def testSmallObjectUsesOneRequest(self):
+    blob = self.make_blob(self.data)
+
+    got = io.BytesIO()
+    download.download_to_file(blob, got, self.pool)
+
+    self.assertEqual(self.data, got.getvalue())
+    blob.download_to_file.assert_called_once_with(
+        got, retry=download.STORAGE_RETRY)
+
+
+if __name__ == '__main__':
+  unittest.main()
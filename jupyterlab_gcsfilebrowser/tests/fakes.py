@@ -0,0 +1,55 @@
+"""Shared fakes for the handler tests."""
+
+
+class FakePage(list):
+  """One page of a listing."""
+  prefixes = ()
+
+
+class FakeIterator(list):
+  """A materialized listing with the prefixes of a delimited listing."""
+  prefixes = ()
+  page_size = None
+  next_page_token = None
+
+  @property
+  def pages(self):
+    """Pages of at most page_size blobs and prefixes, in name order."""
+    entries = sorted([(b.name, b) for b in self]
+                     + [(p, None) for p in self.prefixes],
+                     key=lambda e: e[0])
+    size = self.page_size or len(entries) or 1
+    for start in range(0, max(len(entries), 1), size):
+      chunk = entries[start:start + size]
+      page = FakePage(b for _, b in chunk if b is not None)
+      page.prefixes = tuple(p for p, b in chunk if b is None)
+      self.next_page_token = (
+        'page-%d' % (start + size) if start + size < len(entries) else None)
+      yield page
+
+
+def fake_list_blobs(blobs):
+  """Emulates Client.list_blobs over a fixed set of blobs."""
+  def list_blobs(bucket_name, prefix='', delimiter=None, max_results=None,
+                 start_offset=None, end_offset=None, page_size=None,
+                 **kwargs):
+    iterator = FakeIterator()
+    prefixes = set()
+    for b in sorted(blobs, key=lambda b: b.name):
+      if b.bucket.name != bucket_name or not b.name.startswith(prefix or ''):
+        continue
+      if start_offset is not None and b.name < start_offset:
+        continue
+      if end_offset is not None and b.name >= end_offset:
+        continue
+      rest = b.name[len(prefix or ''):]
+      if delimiter and delimiter in rest:
+        prefixes.add(prefix + rest.split(delimiter, 1)[0] + delimiter)
+      else:
+        iterator.append(b)
+    if max_results is not None:
+      del iterator[max_results:]
+    iterator.prefixes = prefixes
+    iterator.page_size = page_size
+    return iterator
+  return list_blobs
@@ -1,10 +1,13 @@
+import json
 import unittest
 import datetime
 from unittest.mock import Mock, MagicMock, patch
 
 from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser.tests.fakes import fake_list_blobs
 
 from google.cloud import storage # used for connecting to GCS
+from google.cloud.exceptions import PreconditionFailed
 from google.cloud.storage import Blob, Bucket
 
 import pprint
@@ -126,5 +129,325 @@ class TestGCSDirectory(unittest.TestCase):
       self.assertEqual(wanted['content'], got['content'])
 
 
+class TestListDir(unittest.TestCase):
+
+  def make_blob(self, name, updated='2020-01-02T03:04:05.678Z'):
+    blob = Blob(name=name, bucket=Bucket(Mock(), 'bucket'))
+    blob._properties['updated'] = updated
+    return blob
+
+  def testListing(self):
+    blobs = [self.make_blob(name) for name in (
+      'a+b/', 'a+b/file.txt', 'a+b/sub/x', 'a+b/sub/y', 'a+b/empty/',
+      'a+bc/other.txt')]
+
+    got = handlers.list_dir('bucket', 'a+b', blobs)
+
+    self.assertEqual([
+      {'type': 'file', 'path': 'bucket/a+b/file.txt', 'name': 'file.txt',
+       'last_modified': '2020-01-02 03:04:05 +0000'},
+      {'type': 'directory', 'path': 'bucket/a+b/sub/', 'name': 'sub/',
+       'last_modified': '2020-01-02 03:04:05 +0000'},
+      {'type': 'directory', 'path': 'bucket/a+b/empty/', 'name': 'empty/',
+       'last_modified': '2020-01-02 03:04:05 +0000'},
+    ], got)
+
+  def testTimestampMatchesBlobLastModified(self):
+    for updated in ('2020-01-02T03:04:05.678Z', '2020-01-02T03:04:05Z'):
+      blob = self.make_blob('a', updated)
+      self.assertEqual(handlers.blob_last_modified(blob),
+                       handlers.listing_last_modified(blob))
+    self.assertEqual('', handlers.listing_last_modified(Blob(
+      name='a', bucket=Bucket(Mock(), 'bucket'))))
+
+  def testDumps(self):
+    value = {'content': [{'name': 'é', 'size': 3}]}
+    self.assertEqual(value, json.loads(handlers.dumps(value)))
+
+
+class TestGCSCopy(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='dummy_bucket1')
+    self.blobs = [
+      Blob(name='dir/', bucket=self.bucket),
+      Blob(name='dir/a.ipynb', bucket=self.bucket),
+      Blob(name='dir/sub/b.ipynb', bucket=self.bucket),
+    ]
+    self.storage_client = Mock()
+    self.storage_client.list_blobs = MagicMock(
+      side_effect=fake_list_blobs(self.blobs))
+    self.destination_bucket = self.storage_client.get_bucket.return_value
+    self.destination_bucket.name = 'dummy_bucket1'
+    self.rewrite = self.destination_bucket.blob.return_value.rewrite
+    self.storage_client.bucket.return_value.get_blob.side_effect = (
+      lambda name, **kwargs: next(
+        (b for b in self.blobs if b.name == name), None))
+
+  def testCopyFollowsRewriteTokens(self):
+    self.rewrite.side_effect = [('token', 5, 10), (None, 10, 10)]
+
+    handlers.copy(
+      'dummy_bucket1/dir/a.ipynb', 'dummy_bucket1/dir', self.storage_client)
+
+    self.destination_bucket.blob.assert_called_once_with('dir/a-Copy1.ipynb')
+    self.assertEqual(2, self.rewrite.call_count)
+    self.assertEqual('token', self.rewrite.call_args[1]['token'])
+
+  def testCopyDirectory(self):
+    self.rewrite.return_value = (None, 10, 10)
+
+    handlers.copy(
+      'dummy_bucket1/dir', 'dummy_bucket1/other', self.storage_client)
+
+    self.assertEqual(3, self.rewrite.call_count)
+    self.destination_bucket.blob.assert_any_call('other/dir/sub/b.ipynb')
+    self.destination_bucket.blob.assert_called_with('other/dir/')
+
+  def testCopyDirectoryIntoItself(self):
+    self.rewrite.return_value = (None, 10, 10)
+
+    handlers.copy(
+      'dummy_bucket1/dir', 'dummy_bucket1/dir', self.storage_client)
+
+    self.destination_bucket.blob.assert_any_call('dir/dir/a.ipynb')
+    self.destination_bucket.blob.assert_called_with('dir/dir/')
+
+  def testCopyMissingPath(self):
+    with self.assertRaises(ValueError):
+      handlers.copy(
+        'dummy_bucket1/missing', 'dummy_bucket1/dir', self.storage_client)
+
+  def testDestinationDoesNotListSourceDirectory(self):
+    _, bucket_name, new_blob_name = handlers.copy_destination(
+      'dummy_bucket1/dir', 'dummy_bucket1/other', self.storage_client)
+
+    self.assertEqual(('dummy_bucket1', 'other/dir/'),
+                     (bucket_name, new_blob_name))
+    for call in self.storage_client.list_blobs.call_args_list:
+      self.assertEqual(1, call[1].get('max_results'))
+
+class TestGCSUpload(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='dummy_bucket1')
+    self.composed = {}
+    self.compose_kwargs = []
+
+    def compose(name, sources, **kwargs):
+      self.composed[name] = [s.name for s in sources]
+      self.compose_kwargs.append(kwargs)
+
+    def blob(name):
+      b = Blob(name=name, bucket=self.bucket)
+      b.compose = Mock(
+        side_effect=lambda sources, **kwargs: compose(name, sources, **kwargs))
+      b.upload_from_file = Mock()
+      return b
+
+    self.bucket.blob = Mock(side_effect=blob)
+    self.storage_client = MagicMock()
+    self.storage_client.bucket.return_value = self.bucket
+    self.storage_client.list_blobs.return_value = []
+
+  def testComposeTree(self):
+    parts = [self.bucket.blob('part-%d' % i) for i in range(70)]
+
+    handlers.compose_tree(self.bucket, parts, 'file', 'tmp-')
+
+    self.assertEqual(
+      ['tmp-c1-00000.tmp', 'tmp-c1-00032.tmp', 'tmp-c1-00064.tmp'],
+      self.composed['file'])
+    self.assertEqual(['part-%d' % i for i in range(32, 64)],
+                     self.composed['tmp-c1-00032.tmp'])
+
+  def testUploadSlices(self):
+    handlers.upload({
+      'path': 'dummy_bucket1/dir/big.bin',
+      'upload_id': 'abc-123',
+      'part': 2,
+      'content': 'aGVsbG8=',
+      }, self.storage_client)
+    handlers.upload({
+      'path': 'dummy_bucket1/dir/big.bin',
+      'upload_id': 'abc-123',
+      'parts': 2,
+      }, self.storage_client)
+
+    self.assertEqual(
+      ['dir/big.bin.temporary-abc-123-00001.tmp',
+       'dir/big.bin.temporary-abc-123-00002.tmp'],
+      self.composed['dir/big.bin'])
+    self.storage_client.list_blobs.assert_called_once_with(
+      'dummy_bucket1', prefix='dir/big.bin.temporary-abc-123-',
+      retry=handlers.STORAGE_RETRY)
+
+  def testAppendChunkComposesWithPrecondition(self):
+    stored = {}
+
+    def get_blob(name, **kwargs):
+      if name not in stored:
+        return None
+      b = Blob(name=name, bucket=self.bucket)
+      b._properties['generation'] = stored[name]
+      return b
+
+    self.bucket.get_blob = Mock(side_effect=get_blob)
+    self.storage_client.get_bucket.return_value = self.bucket
+    stored['dir/a.txt.temporary'] = '7'
+
+    with patch.object(handlers, 'delete_blob') as delete_blob:
+      handlers.upload({
+        'path': 'dummy_bucket1/dir/a.txt',
+        'format': 'text',
+        'content': 'more',
+        'chunk': 2,
+        }, self.storage_client)
+      handlers.upload({
+        'path': 'dummy_bucket1/dir/a.txt',
+        'format': 'text',
+        'content': 'end',
+        'chunk': -1,
+        }, self.storage_client)
+
+    self.assertEqual(['dir/a.txt.temporary', 'dir/a.txt.temporary-2.tmp'],
+                     self.composed['dir/a.txt.temporary'])
+    self.assertEqual(['dir/a.txt.temporary', 'dir/a.txt.temporary--1.tmp'],
+                     self.composed['dir/a.txt'])
+    self.assertEqual([7, 0], [kwargs['if_generation_match']
+                              for kwargs in self.compose_kwargs])
+    self.assertEqual(3, delete_blob.call_count)
+
+  def testUploadRejectsBadUploadId(self):
+    with self.assertRaises(ValueError):
+      handlers.upload({
+        'path': 'dummy_bucket1/dir/big.bin',
+        'upload_id': '../x',
+        'part': 1,
+        'content': '',
+        }, self.storage_client)
+
+
+class TestStat(unittest.TestCase):
+
+  def setUp(self):
+    self.storage_client = MagicMock()
+    self.get_blob = self.storage_client.bucket.return_value.get_blob
+    self.storage_client.list_blobs.return_value = []
+
+  def testFile(self):
+    blob = Blob(name='dir/a.txt', bucket=Bucket(Mock(), 'bucket'))
+    blob._properties.update({
+      'size': '12',
+      'generation': '1580000000000001',
+      'md5Hash': 'XUFAKrxLKna5cZ2REBfFkg==',
+      'updated': '2020-01-01T00:00:00.000Z',
+    })
+    self.get_blob.return_value = blob
+
+    got = handlers.stat('bucket/dir/a.txt', self.storage_client)
+
+    self.get_blob.assert_called_once_with(
+      'dir/a.txt', retry=handlers.STORAGE_RETRY)
+    self.storage_client.list_blobs.assert_not_called()
+    self.assertEqual('file', got['type'])
+    self.assertIsNone(got['content']['content'])
+    self.assertEqual(12, got['content']['size'])
+    self.assertEqual('1580000000000001', got['content']['generation'])
+    self.assertEqual('XUFAKrxLKna5cZ2REBfFkg==', got['content']['md5'])
+
+  def testDirectory(self):
+    self.get_blob.return_value = None
+    self.storage_client.list_blobs.return_value = [Mock()]
+
+    got = handlers.stat('bucket/dir', self.storage_client)
+
+    self.assertEqual('directory', got['type'])
+    self.storage_client.list_blobs.assert_called_once_with(
+      'bucket', prefix='dir/', max_results=1, retry=handlers.STORAGE_RETRY)
+
+  def testMissing(self):
+    self.get_blob.return_value = None
+    with self.assertRaises(handlers.FileNotFound):
+      handlers.stat('bucket/missing', self.storage_client)
+
+  def testUploadExpectedGeneration(self):
+    blob = self.storage_client.get_bucket.return_value.blob.return_value
+    blob.upload_from_string.side_effect = PreconditionFailed('changed')
+
+    with self.assertRaises(handlers.FileChanged):
+      handlers.upload({
+        'path': 'bucket/a.txt',
+        'format': 'text',
+        'content': 'new',
+        'expected_generation': '5',
+        }, self.storage_client)
+    self.assertEqual(
+      5, blob.upload_from_string.call_args[1]['if_generation_match'])
+
+
+class TestSkipUnchanged(unittest.TestCase):
+
+  def setUp(self):
+    self.content = 'x' * handlers.SKIP_UNCHANGED_MIN_BYTES
+    self.stored = Blob(name='a.txt', bucket=Bucket(Mock(), 'bucket'))
+    self.stored._properties.update({
+      'size': str(len(self.content)),
+      'crc32c': handlers.crc32c(self.content.encode('utf-8')),
+    })
+    self.storage_client = MagicMock()
+    self.storage_client.bucket.return_value.get_blob.return_value = self.stored
+    self.upload_from_string = (
+      self.storage_client.get_bucket.return_value.blob.return_value
+      .upload_from_string)
+
+  def save(self, content):
+    return handlers.upload({
+      'path': 'bucket/a.txt',
+      'format': 'text',
+      'content': content,
+      }, self.storage_client)
+
+  def testSkipsSameContent(self):
+    before = handlers.METRICS.snapshot().get('unchanged_save_bytes', 0)
+
+    self.assertIs(self.stored, self.save(self.content))
+
+    self.upload_from_string.assert_not_called()
+    self.assertEqual(
+      before + len(self.content),
+      handlers.METRICS.snapshot()['unchanged_save_bytes'])
+
+  def testWritesChangedContent(self):
+    self.save('y' * len(self.content))
+
+    self.upload_from_string.assert_called_once()
+
+
+class TestFileContent(unittest.TestCase):
+
+  def testDetectsFormat(self):
+    self.assertEqual(('json', {'cells': []}), handlers.file_content(
+      'a.ipynb', 'application/octet-stream', b'{"cells": []}'))
+    self.assertEqual(('text', 'héllo'), handlers.file_content(
+      'a.txt', None, 'héllo'.encode('utf-8')))
+    self.assertEqual(('base64', 'gAE='), handlers.file_content(
+      'a.bin', 'application/octet-stream', b'\x80\x01'))
+    self.assertEqual(('base64', 'aGk='), handlers.file_content(
+      'a.png', 'image/png', b'hi'))
+    self.assertEqual(('text', '<svg/>'), handlers.file_content(
+      'a.svg', 'image/svg+xml', b'<svg/>'))
+
+  def testRequestedFormat(self):
+    self.assertEqual(('base64', 'e30='), handlers.file_content(
+      'a.ipynb', None, b'{}', 'base64'))
+    self.assertEqual(('text', '{}'), handlers.file_content(
+      'a.ipynb', None, b'{}', 'text'))
+    with self.assertRaises(handlers.Error):
+      handlers.file_content('a.bin', None, b'\x80', 'text')
+    with self.assertRaises(handlers.Error):
+      handlers.file_content('a.txt', None, b'x', 'json')
+
+
 if __name__ == '__main__':
   unittest.main()
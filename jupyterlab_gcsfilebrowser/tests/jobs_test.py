@@ -0,0 +1,192 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import Mock, MagicMock, patch
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import jobs
+from jupyterlab_gcsfilebrowser.tests.fakes import fake_list_blobs
+
+from google.cloud.storage import Blob, Bucket
+
+
+class TestJobManager(unittest.TestCase):
+
+  def setUp(self):
+    self.journal_dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.journal_dir)
+
+  def wait(self, job_manager):
+    job_manager._executor.shutdown(wait=True)
+
+  def testRunsJobWithProgress(self):
+    def runner(job):
+      job.add_total(2, 20)
+      job.advance(2, 20)
+
+    job_manager = jobs.JobManager({'test': runner}, self.journal_dir)
+    job = job_manager.submit('test', {'path': 'bucket/dir'})
+    self.wait(job_manager)
+
+    got = job_manager.get(job.id).to_dict()
+    self.assertEqual(jobs.SUCCEEDED, got['state'])
+    self.assertEqual(2, got['progress']['objects_done'])
+    self.assertEqual(20, got['progress']['bytes_total'])
+    self.assertEqual([], os.listdir(self.journal_dir))
+
+  def testFailedJob(self):
+    def runner(job):
+      raise ValueError('boom')
+
+    job_manager = jobs.JobManager({'test': runner}, self.journal_dir)
+    job = job_manager.submit('test', {})
+    self.wait(job_manager)
+
+    self.assertEqual(jobs.FAILED, job.state)
+    self.assertEqual('boom', job.error)
+
+  def testCancel(self):
+    started = threading.Event()
+
+    def runner(job):
+      started.set()
+      while True:
+        job.check_cancelled()
+
+    job_manager = jobs.JobManager({'test': runner}, self.journal_dir)
+    job = job_manager.submit('test', {})
+    started.wait()
+    job_manager.cancel(job.id)
+    self.wait(job_manager)
+
+    self.assertEqual(jobs.CANCELLED, job.state)
+
+  def testUnknownJob(self):
+    job_manager = jobs.JobManager({}, self.journal_dir)
+    with self.assertRaises(jobs.UnknownJob):
+      job_manager.get('missing')
+    with self.assertRaises(ValueError):
+      job_manager.submit('missing', {})
+
+  def testResumesUnfinishedJobs(self):
+    release = threading.Event()
+    job_manager = jobs.JobManager(
+      {'test': lambda job: release.wait()}, self.journal_dir)
+    job = job_manager.submit('test', {'path': 'bucket/dir'})
+    self.assertEqual(1, len(os.listdir(self.journal_dir)))
+
+    resumed_params = []
+    restarted = jobs.JobManager(
+      {'test': lambda job: resumed_params.append((job.params, job.resumed))},
+      self.journal_dir)
+    resumed = restarted.resume()
+    self.wait(restarted)
+    release.set()
+    self.wait(job_manager)
+
+    self.assertEqual([job.id], [j.id for j in resumed])
+    self.assertEqual([({'path': 'bucket/dir'}, True)], resumed_params)
+
+
+class TestJobRunners(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='bucket')
+    self.blobs = [self.make_blob(name) for name in (
+      'dir/', 'dir/a.ipynb', 'dir/sub/b.ipynb')]
+    self.storage_client = MagicMock()
+    self.storage_client.list_blobs = MagicMock(
+      side_effect=fake_list_blobs(self.blobs))
+    self.destination = self.storage_client.bucket.return_value
+    self.destination.name = 'bucket'
+    self.destination.blob.return_value.rewrite.return_value = (None, 1, 1)
+
+    patcher = patch.object(handlers, 'shared_storage_client',
+                           return_value=self.storage_client)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def make_blob(self, name):
+    blob = Blob(name=name, bucket=self.bucket)
+    blob._properties['size'] = '10'
+    blob.delete = Mock()
+    return blob
+
+  def testMoveJob(self):
+    job = jobs.Job('move', {'old': 'bucket/dir', 'new': 'bucket/new'})
+
+    handlers.move_job(job)
+
+    self.assertEqual(3, job.objects_done)
+    self.assertEqual(30, job.bytes_done)
+    self.destination.blob.assert_any_call('new/sub/b.ipynb')
+    for b in self.blobs:
+      b.delete.assert_called_once()
+
+  def testDeleteJobRecordsFailures(self):
+    self.storage_client.batch.return_value.__exit__.side_effect = (
+      ValueError('batch failed'))
+    self.blobs[1].delete.side_effect = ValueError('denied')
+
+    job = jobs.Job('delete', {'path': 'bucket/dir'})
+    with self.assertRaises(handlers.Error):
+      handlers.delete_job(job)
+
+    self.assertEqual(2, job.objects_done)
+    self.assertEqual(1, job.failed)
+    self.assertEqual('dir/a.ipynb', job.failures[0]['name'])
+
+  def testCancelledCopyJob(self):
+    job = jobs.Job('copy', {
+      'path': 'bucket/dir',
+      'destination_bucket': 'bucket',
+      'destination': 'dir-Copy1/',
+      })
+    job.cancel()
+
+    with self.assertRaises(jobs.JobCancelled):
+      handlers.copy_job(job)
+    self.destination.blob.assert_not_called()
+
+
+class TestDirectoryJob(unittest.TestCase):
+
+  def setUp(self):
+    self.release = threading.Event()
+    self.job_manager = jobs.JobManager(
+      {'delete': lambda job: self.release.wait()})
+    self.addCleanup(self.release.set)
+    self.storage_client = MagicMock()
+    self.get_blob = self.storage_client.bucket.return_value.get_blob
+
+  def start(self, path):
+    return handlers.directory_job(
+      self.job_manager, {'action': 'delete', 'localPath': path},
+      self.storage_client)
+
+  def testDirectoryRunsAsJob(self):
+    self.get_blob.return_value = None
+
+    job = self.start('bucket/dir')
+
+    self.assertEqual({'path': 'bucket/dir'}, job.params)
+    self.assertEqual([job], self.job_manager.list())
+    self.get_blob.assert_called_once_with('dir', retry=handlers.STORAGE_RETRY)
+
+  def testFilesAndBucketsRunInline(self):
+    self.get_blob.return_value = Mock()
+
+    self.assertIsNone(self.start('bucket/a.txt'))
+    self.assertIsNone(self.start('bucket'))
+    self.assertIsNone(handlers.directory_job(
+      None, {'action': 'delete', 'localPath': 'bucket/dir'},
+      self.storage_client))
+    self.assertEqual([], self.job_manager.list())
+
+
+if __name__ == '__main__':
+  unittest.main()
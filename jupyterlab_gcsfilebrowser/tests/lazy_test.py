@@ -0,0 +1,57 @@
+import json
+import subprocess
+import sys
+import unittest
+
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application, RequestHandler
+
+from jupyterlab_gcsfilebrowser import lazy
+
+CREATED = []
+
+
+class EchoHandler(RequestHandler):
+
+  def initialize(self, prefix):
+    CREATED.append(self)
+    self.prefix = prefix
+
+  def get(self, name):
+    self.finish(self.prefix + name)
+
+
+def double(value):
+  return 2 * value
+
+
+class TestLazy(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([
+      ('/echo/(.*)', lazy.lazy_handler('EchoHandler', __name__),
+       {'prefix': 'hello '}),
+    ])
+
+  def testHandlerRunsRealClass(self):
+    response = self.fetch('/echo/world')
+
+    self.assertEqual(b'hello world', response.body)
+    self.assertIsInstance(CREATED[-1], EchoHandler)
+
+  def testFunction(self):
+    self.assertEqual(4, lazy.lazy_function('double', __name__)(2))
+
+  def testImportDefersStorageModules(self):
+    loaded = json.loads(subprocess.check_output([
+      sys.executable, '-c',
+      'import json, sys, jupyterlab_gcsfilebrowser; '
+      'print(json.dumps(sorted(sys.modules)))']))
+
+    for module in ('google.cloud.storage', 'nbformat',
+                   'jupyterlab_gcsfilebrowser.handlers'):
+      self.assertNotIn(module, loaded)
+
+
+if __name__ == '__main__':
+  unittest.main()
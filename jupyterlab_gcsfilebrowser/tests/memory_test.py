@@ -0,0 +1,215 @@
+import json
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock, Mock, patch
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import memory
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+
+from google.cloud.storage import Blob, Bucket
+import tornado.gen as gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application, RequestHandler
+
+
+class TestMemoryBudget(unittest.TestCase):
+
+  def testReservationsWaitForRoom(self):
+    budget = memory.MemoryBudget(max_bytes=100, wait_timeout=5)
+    first = budget.acquire(80)
+    acquired = threading.Event()
+
+    def reserve():
+      with budget.reserve(50):
+        acquired.set()
+
+    thread = threading.Thread(target=reserve)
+    thread.start()
+    self.assertFalse(acquired.wait(0.1))
+    self.assertEqual(1, budget.snapshot()['memory_waiting'])
+
+    budget.release(first)
+    thread.join(5)
+    self.assertTrue(acquired.is_set())
+    self.assertEqual({
+      'memory_budget_bytes': 100,
+      'memory_reserved_bytes': 0,
+      'memory_peak_reserved_bytes': 80,
+      'memory_reservations': 0,
+      'memory_waiting': 0,
+    }, budget.snapshot())
+
+  def testTimeout(self):
+    budget = memory.MemoryBudget(max_bytes=100)
+    budget.acquire(60)
+
+    with self.assertRaises(memory.MemoryBudgetExceeded):
+      budget.acquire(60, timeout=0.01)
+    self.assertEqual(503, handlers.error_status(memory.MemoryBudgetExceeded()))
+
+  def testOversizedReservationTakesWholeBudget(self):
+    budget = memory.MemoryBudget(max_bytes=100)
+
+    with budget.reserve(1000):
+      self.assertEqual(100, budget.snapshot()['memory_reserved_bytes'])
+      with budget.try_reserve(1) as reserved:
+        self.assertFalse(reserved)
+
+  def testDisabled(self):
+    budget = memory.MemoryBudget(max_bytes=0)
+
+    with budget.reserve(10 ** 12), budget.try_reserve(10 ** 12) as reserved:
+      self.assertTrue(reserved)
+
+
+class PingHandler(RequestHandler):
+
+  def get(self):
+    self.finish('pong')
+
+
+class TestWaitOnEventLoop(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([
+      ('/upload', handlers.UploadHandler),
+      ('/ping', PingHandler),
+    ])
+
+  def setUp(self):
+    super(TestWaitOnEventLoop, self).setUp()
+    self.budget = memory.MemoryBudget(max_bytes=100, wait_timeout=5)
+    blob = Blob(name='a.txt', bucket=Bucket(Mock(), 'bucket'))
+    blob._properties.update({
+      'updated': '2020-01-02T03:04:05.000Z', 'generation': '1'})
+    for patcher in (
+        patch.object(handlers, 'BUDGET', self.budget),
+        patch.object(handlers, 'upload', return_value=blob),
+        patch.object(handlers, 'shared_storage_client', MagicMock())):
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def post_upload(self):
+    body = json.dumps({
+      'path': 'bucket/a.txt', 'format': 'text', 'content': 'x' * 1000})
+    return self.http_client.fetch(
+      self.get_url('/upload'), method='POST', body=body, raise_error=False)
+
+  @gen_test
+  def testOverBudgetUploadsWaitWithoutBlocking(self):
+    held = self.budget.acquire(100)
+    uploads = [self.post_upload(), self.post_upload()]
+    while self.budget.snapshot()['memory_waiting'] < 2:
+      yield gen.sleep(0.01)
+
+    started = time.time()
+    ping = yield self.http_client.fetch(self.get_url('/ping'))
+    self.assertEqual(b'pong', ping.body)
+    self.assertLess(time.time() - started, 1)
+
+    self.budget.release(held)
+    responses = yield uploads
+    self.assertEqual([200, 200], [r.code for r in responses])
+    self.assertEqual(0, self.budget.snapshot()['memory_reserved_bytes'])
+
+  @gen_test
+  def testOverBudgetUploadsTimeOut(self):
+    self.budget.wait_timeout = 0.1
+    self.budget.acquire(100)
+
+    responses = yield [self.post_upload(), self.post_upload()]
+
+    self.assertEqual([503, 503], [r.code for r in responses])
+    self.assertEqual(0, self.budget.snapshot()['memory_waiting'])
+
+  @gen_test
+  def testNoBlockingWaitOnEventLoop(self):
+    self.budget.acquire(100)
+
+    with self.assertRaises(memory.MemoryBudgetExceeded):
+      self.budget.acquire(10)
+    yield gen.moment
+
+  @gen_test
+  def testReservationsQueueBehindCoroutines(self):
+    held = self.budget.acquire(60)
+    waiting = self.budget.acquire_async(60)
+    acquired = threading.Event()
+
+    def reserve():
+      with self.budget.reserve(30):
+        acquired.set()
+
+    thread = threading.Thread(target=reserve)
+    thread.start()
+    yield gen.sleep(0.1)
+    self.assertFalse(acquired.is_set())
+
+    self.budget.release(held)
+    cost = yield waiting
+    thread.join(5)
+    self.assertTrue(acquired.is_set())
+    self.budget.release(cost)
+    self.assertEqual(0, self.budget.snapshot()['memory_reserved_bytes'])
+
+
+class TestCheckpointWaitsOffEventLoop(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/checkpoint', handlers.CheckpointHandler)],
+                       gcs_single_flight=SingleFlight(2))
+
+  def setUp(self):
+    super(TestCheckpointWaitsOffEventLoop, self).setUp()
+    self.budget = memory.MemoryBudget(max_bytes=100, wait_timeout=5)
+
+  @gen_test
+  def testCheckpointWaitsForMemory(self):
+    def create_checkpoint(path, storage_client):
+      with self.budget.reserve(50):
+        return {'checkpoint': {'id': 'checkpoint', 'last_modified': 0}}
+
+    held = self.budget.acquire(100)
+    body = json.dumps({'action': 'createCheckpoint',
+                       'localPath': 'bucket/a.ipynb'})
+    with patch.object(handlers, 'create_checkpoint', create_checkpoint), \
+        patch.object(handlers, 'shared_storage_client', MagicMock()):
+      response = self.http_client.fetch(
+        self.get_url('/checkpoint'), method='POST', body=body,
+        raise_error=False)
+      while self.budget.snapshot()['memory_waiting'] < 1:
+        yield gen.sleep(0.01)
+      self.budget.release(held)
+      response = yield response
+
+    self.assertEqual(200, response.code)
+    self.assertEqual(
+      'checkpoint', json.loads(response.body)['checkpoint']['id'])
+
+
+class TestSpill(unittest.TestCase):
+
+  def setUp(self):
+    self.data = b'x' * 1000
+    self.blob = Blob(name='dir/a.txt', bucket=Bucket(Mock(), 'bucket'))
+    self.blob._properties['size'] = str(len(self.data))
+    self.blob.download_to_file = Mock(
+      side_effect=lambda f, **kwargs: f.write(self.data))
+
+  def testDownloadSpillsToDiskWhenBudgetIsFull(self):
+    budget = memory.MemoryBudget(max_bytes=100)
+    with patch.object(handlers, 'BUDGET', budget), budget.reserve(100):
+      with handlers.blob_contents(self.blob) as buf:
+        self.assertNotIsInstance(buf, memoryview)
+        self.assertEqual(self.data, bytes(buf))
+
+  def testDownloadInMemory(self):
+    with handlers.blob_contents(self.blob) as buf:
+      self.assertIsInstance(buf, memoryview)
+      self.assertEqual(self.data, bytes(buf))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,127 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+import nbformat
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import notebooks
+from jupyterlab_gcsfilebrowser import outputs
+
+
+def notebook_text():
+  return nbformat.writes(nbformat.v4.new_notebook(cells=[
+    nbformat.v4.new_code_cell('print(1)')]))
+
+
+class TestNotebooks(unittest.TestCase):
+
+  def testDecodeUploadEncodesNotebook(self):
+    content = json.loads(notebook_text())
+    body = json.dumps({
+      'path': 'bucket/a.ipynb', 'format': 'json', 'content': content,
+    }).encode('utf-8')
+
+    model = notebooks.decode_upload(body)
+
+    self.assertEqual('text', model['format'])
+    self.assertEqual(json.dumps(content), model['content'])
+
+  def testDecodeUploadKeepsLazyOutputs(self):
+    nb = json.loads(notebook_text())
+    nb['cells'][0]['outputs'] = [
+      outputs.placeholder('bucket/a.ipynb', 1, 0, 0, 10000)]
+    body = json.dumps({
+      'path': 'bucket/a.ipynb', 'format': 'json', 'content': nb,
+    }).encode('utf-8')
+
+    self.assertEqual('json', notebooks.decode_upload(body)['format'])
+
+  def testDecodeUploadValidatesNotebook(self):
+    nb = json.loads(notebook_text())
+    del nb['cells'][0]['source']
+    for content in (nb, {'cells': []}, [1]):
+      body = json.dumps({
+        'path': 'bucket/a.ipynb', 'format': 'json', 'content': content,
+      }).encode('utf-8')
+
+      with self.assertRaises(notebooks.InvalidUpload) as raised:
+        notebooks.decode_upload(body)
+      self.assertTrue(str(raised.exception).startswith(
+        'Invalid notebook in body of request'))
+
+  def testSmallNotebookInline(self):
+    with patch.object(notebooks, 'shared_pool') as shared_pool:
+      future = notebooks.notebook_task(
+        notebooks.export_notebook, 10, 'script', notebook_text())
+
+    shared_pool.assert_not_called()
+    output, extension, _ = future.result()
+    self.assertIn('print(1)', output)
+    self.assertEqual('.txt', extension)
+
+  def testInlineErrorIsRaisedByFuture(self):
+    future = notebooks.notebook_task(notebooks.export_notebook, 10,
+                                     'script', 'not a notebook')
+    with self.assertRaises(Exception):
+      future.result()
+
+  def testLargeNotebookInWorker(self):
+    self.addCleanup(notebooks.configure_notebook_pool,
+                    notebooks.DEFAULT_PROCESS_WORKERS,
+                    notebooks.DEFAULT_PROCESS_THRESHOLD)
+    notebooks.configure_notebook_pool(1, 0)
+
+    future = notebooks.notebook_task(
+      notebooks.export_notebook, 10, 'script', notebook_text())
+
+    self.assertIn('print(1)', future.result(timeout=60)[0])
+    notebooks._discard_pool(notebooks.shared_pool())
+
+
+class TestInvalidUpload(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/upload', handlers.UploadHandler)])
+
+  def setUp(self):
+    super(TestInvalidUpload, self).setUp()
+    patcher = patch.object(handlers, 'shared_storage_client', MagicMock())
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.addCleanup(notebooks.configure_notebook_pool,
+                    notebooks.DEFAULT_PROCESS_WORKERS,
+                    notebooks.DEFAULT_PROCESS_THRESHOLD)
+
+  def post_upload(self, body):
+    response = self.fetch('/upload', method='POST', body=body)
+    return response.code, json.loads(response.body)['error']['message']
+
+  def testBadBodyIsBadRequest(self):
+    for body in (b'{"path": ', b'[1, 2]', b'{"format": "json"}'):
+      notebooks.configure_notebook_pool(0, 0)
+      inline = self.post_upload(body)
+      notebooks.configure_notebook_pool(1, 0)
+      in_worker = self.post_upload(body)
+
+      self.assertEqual((400, 'Invalid JSON in body of request'), inline)
+      self.assertEqual(inline, in_worker)
+    notebooks._discard_pool(notebooks.shared_pool())
+
+  def testInvalidNotebookIsBadRequest(self):
+    body = json.dumps({
+      'path': 'bucket/a.ipynb', 'format': 'json', 'content': {'cells': []},
+    }).encode('utf-8')
+    notebooks.configure_notebook_pool(1, 0)
+
+    code, message = self.post_upload(body)
+
+    self.assertEqual(400, code)
+    self.assertTrue(message.startswith('Invalid notebook in body of request'))
+    notebooks._discard_pool(notebooks.shared_pool())
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,201 @@
+import json
+import threading
+import unittest
+from unittest.mock import Mock, MagicMock, patch
+
+import nbformat
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import outputs
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+from jupyterlab_gcsfilebrowser.tests.fakes import fake_list_blobs
+
+from google.cloud.storage import Blob, Bucket
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+
+def make_notebook():
+  v4 = nbformat.v4
+  return v4.new_notebook(cells=[
+    v4.new_markdown_cell('# Title'),
+    v4.new_code_cell('plot()', outputs=[
+      v4.new_output('stream', name='stdout', text='small\n'),
+      v4.new_output('display_data', data={'image/png': 'A' * 10000}),
+    ]),
+  ])
+
+
+class TestOutputs(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='bucket')
+    self.data = nbformat.writes(make_notebook()).encode('utf-8')
+    self.blob = Blob(name='dir/big.ipynb', bucket=self.bucket)
+    self.blob._properties['size'] = str(len(self.data))
+    self.blob._properties['generation'] = '7'
+    self.blob.download_to_file = Mock(
+      side_effect=lambda f, **kwargs: f.write(self.data))
+    self.blob.upload_from_string = Mock()
+
+    self.storage_client = MagicMock()
+    self.storage_client.list_blobs = MagicMock(
+      side_effect=fake_list_blobs([self.blob]))
+    self.storage_client.get_bucket.return_value.blob.return_value = self.blob
+    self.locations = outputs.OutputLocations()
+    patcher = patch.object(handlers, 'LOCATIONS', self.locations)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def store(self, data, generation):
+    """Makes the blob hold data at generation, as an upload would."""
+    self.data = data
+    self.blob._properties['size'] = str(len(data))
+    self.blob._properties['generation'] = str(generation)
+
+  def open_lazily(self):
+    got = handlers.getPathContents(
+      'bucket/dir/big.ipynb', self.storage_client, lazy_output_size=1000)
+    return got, got['content']['content']
+
+  def testLargeOutputsReplaced(self):
+    got, content = self.open_lazily()
+
+    self.assertEqual(1, got['content']['lazy_outputs'])
+    self.assertEqual('json', got['content']['format'])
+    nb = nbformat.reads(json.dumps(content), as_version=4)
+    small, placeholder = nb.cells[1].outputs
+    self.assertEqual('small\n', small.text)
+    self.assertEqual({
+      'path': 'bucket/dir/big.ipynb',
+      'generation': 7,
+      'cell': 1,
+      'output': 1,
+      'size': outputs.output_size(make_notebook().cells[1].outputs[1]),
+    }, placeholder.metadata[outputs.LAZY_OUTPUT_KEY])
+
+  def testSmallNotebookUnchanged(self):
+    got = handlers.getPathContents(
+      'bucket/dir/big.ipynb', self.storage_client,
+      lazy_output_size=len(self.data) + 1)
+
+    self.assertNotIn('lazy_outputs', got['content'])
+    self.assertEqual(json.loads(self.data), got['content']['content'])
+
+  def testSaveRestoresOutputs(self):
+    _, nb = self.open_lazily()
+    nb['cells'].insert(0, nbformat.v4.new_code_cell('import os'))
+
+    handlers.upload({
+      'path': 'bucket/dir/big.ipynb',
+      'format': 'json',
+      'content': nb,
+    }, self.storage_client)
+
+    saved = nbformat.reads(self.blob.upload_from_string.call_args[0][0],
+                           as_version=4)
+    self.assertEqual(make_notebook().cells[1].outputs, saved.cells[2].outputs)
+
+  def testSaveAfterNotebookChangedFails(self):
+    _, content = self.open_lazily()
+    self.blob._properties['generation'] = '8'
+
+    with self.assertRaises(outputs.StaleOutputs):
+      handlers.upload({
+        'path': 'bucket/dir/big.ipynb',
+        'format': 'text',
+        'content': json.dumps(content),
+      }, self.storage_client)
+    self.blob.upload_from_string.assert_not_called()
+
+  def testSaveTwiceInARow(self):
+    _, nb = self.open_lazily()
+    self.blob.upload_from_string.side_effect = (
+      lambda data, **kwargs: self.store(data, 8))
+
+    for source in ('import os', 'import sys'):
+      nb['cells'].insert(0, nbformat.v4.new_code_cell(source))
+      handlers.upload({
+        'path': 'bucket/dir/big.ipynb',
+        'format': 'json',
+        'content': json.loads(json.dumps(nb)),
+      }, self.storage_client)
+      self.blob.upload_from_string.side_effect = (
+        lambda data, **kwargs: self.store(data, 9))
+
+    saved = nbformat.reads(self.data, as_version=4)
+    self.assertEqual('9', self.blob._properties['generation'])
+    self.assertEqual(make_notebook().cells[1].outputs, saved.cells[3].outputs)
+
+  def testSavedOutputsMoveWithTheirCell(self):
+    _, nb = self.open_lazily()
+    reference = nb['cells'][1]['outputs'][1]['metadata'][
+      outputs.LAZY_OUTPUT_KEY]
+    nb['cells'].insert(0, nbformat.v4.new_code_cell('import os'))
+    self.blob.upload_from_string.side_effect = (
+      lambda data, **kwargs: self.store(data, 8))
+
+    handlers.upload({
+      'path': 'bucket/dir/big.ipynb',
+      'format': 'json',
+      'content': nb,
+    }, self.storage_client)
+
+    self.assertEqual((2, 1), self.locations.locate(reference, 8))
+    self.assertEqual((1, 1), self.locations.locate(reference, 7))
+    self.assertIsNone(self.locations.locate(reference, 9))
+
+  def testGetOutput(self):
+    nb = make_notebook()
+    self.assertEqual('small\n', outputs.get_output(nb, 1, 0).text)
+    with self.assertRaises(IndexError):
+      outputs.get_output(nb, 0, 0)
+    with self.assertRaises(IndexError):
+      outputs.cell_outputs(nb, 2)
+
+
+class TestLazySaveOffEventLoop(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/upload', handlers.UploadHandler)],
+                       gcs_single_flight=SingleFlight(2))
+
+  def testMergeRunsInRequestThread(self):
+    threads = []
+    blob = Blob(name='a.ipynb', bucket=Bucket(Mock(), 'bucket'))
+
+    def upload(model, *args):
+      threads.append(threading.current_thread().name)
+      self.assertEqual('json', model['format'])
+      return blob
+
+    nb = make_notebook()
+    nb.cells[1].outputs[1] = outputs.placeholder(
+      'bucket/a.ipynb', 7, 1, 1, 10000)
+    body = json.dumps({
+      'path': 'bucket/a.ipynb', 'format': 'json', 'content': nb})
+    with patch.object(handlers, 'upload', side_effect=upload), \
+        patch.object(handlers, 'shared_storage_client', MagicMock()):
+      response = self.fetch('/upload', method='POST', body=body)
+
+    self.assertEqual(200, response.code)
+    self.assertTrue(threads[0].startswith('gcs-request'))
+
+
+class TestOutputHandler(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/output/(.*)', handlers.OutputHandler)])
+
+  def testMalformedIndicesAreBadRequests(self):
+    with patch.object(handlers, 'shared_storage_client', MagicMock()):
+      for query in ('', 'cell=x', 'cell=1&output=', 'cell=1&output=1.5'):
+        response = self.fetch('/output/bucket/a.ipynb?' + query)
+
+        self.assertEqual(400, response.code)
+        self.assertEqual(
+          400, json.loads(response.body)['error']['response']['status'])
+
+
+if __name__ == '__main__':
+  unittest.main()
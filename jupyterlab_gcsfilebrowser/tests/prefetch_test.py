@@ -0,0 +1,90 @@
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest.mock import Mock, MagicMock
+
+from jupyterlab_gcsfilebrowser import cache
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import prefetch
+
+from google.cloud.storage import Blob, Bucket
+
+
+def make_blob(bucket, name, data, generation=1):
+  blob = Blob(name=name, bucket=bucket)
+  blob._properties['generation'] = str(generation)
+  blob._properties['size'] = str(len(data))
+  blob.download_to_file = Mock(side_effect=lambda f, **kwargs: f.write(data))
+  return blob
+
+
+class TestPrefetcher(unittest.TestCase):
+
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.content_cache = cache.ContentCache(self.cache_dir, 1024)
+    self.bucket = Bucket(client=Mock(), name='bucket')
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+
+  def testPrefetchesSmallFiles(self):
+    prefetcher = prefetch.Prefetcher(self.content_cache, 10, 2, 0)
+    small = make_blob(self.bucket, 'dir/small.ipynb', b'{}')
+    large = make_blob(self.bucket, 'dir/large.csv', b'x' * 100)
+
+    prefetcher.prefetch([small, large])
+    prefetcher._executor.shutdown(wait=True)
+
+    self.assertTrue(
+      self.content_cache.contains('bucket', 'dir/small.ipynb', 1))
+    self.assertFalse(
+      self.content_cache.contains('bucket', 'dir/large.csv', 1))
+    large.download_to_file.assert_not_called()
+
+  def testNewListingCancelsPendingDownloads(self):
+    prefetcher = prefetch.Prefetcher(self.content_cache, 10, 1, 0)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_download(f, **kwargs):
+      started.set()
+      release.wait()
+      f.write(b'{}')
+
+    first = make_blob(self.bucket, 'a/first.ipynb', b'{}')
+    first.download_to_file = Mock(side_effect=blocking_download)
+    second = make_blob(self.bucket, 'a/second.ipynb', b'{}')
+
+    prefetcher.prefetch([first, second])
+    started.wait()
+    prefetcher.prefetch([])
+    release.set()
+    prefetcher._executor.shutdown(wait=True)
+
+    second.download_to_file.assert_not_called()
+
+  def testTokenBucketCancels(self):
+    bucket = prefetch.TokenBucket(1)
+    bucket.consume(1)
+    with self.assertRaises(prefetch.Cancelled):
+      bucket.consume(1, lambda: True)
+
+  def testGetPathContentsSchedulesDirectoryChildren(self):
+    blobs = [
+      make_blob(self.bucket, 'dir/a.ipynb', b'{}'),
+      make_blob(self.bucket, 'dir/sub/b.ipynb', b'{}'),
+    ]
+    storage_client = Mock()
+    storage_client.list_blobs = MagicMock(return_value=blobs)
+    prefetcher = Mock()
+
+    handlers.getPathContents('bucket/dir/', storage_client,
+                             prefetcher=prefetcher)
+
+    prefetcher.prefetch.assert_called_once_with([blobs[0]])
+
+
+if __name__ == '__main__':
+  unittest.main()
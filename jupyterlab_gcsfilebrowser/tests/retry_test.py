@@ -0,0 +1,79 @@
+import unittest
+
+from google.api_core import exceptions
+from unittest.mock import Mock, patch
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import retry
+
+
+class TestRetry(unittest.TestCase):
+
+  def testTransientErrors(self):
+    self.assertTrue(retry.is_transient(exceptions.TooManyRequests('slow')))
+    self.assertTrue(retry.is_transient(exceptions.BadGateway('gateway')))
+    self.assertTrue(retry.is_transient(ConnectionResetError()))
+    self.assertFalse(retry.is_transient(exceptions.NotFound('gone')))
+    self.assertFalse(retry.is_transient(
+      exceptions.PreconditionFailed('changed')))
+
+  def testMediaErrors(self):
+    def media_error(status):
+      return retry.InvalidResponse(Mock(status_code=status), 'failed')
+
+    self.assertTrue(retry.is_transient(media_error(429)))
+    self.assertTrue(retry.is_transient(media_error(503)))
+    self.assertTrue(retry.is_throttled(media_error(429)))
+    self.assertFalse(retry.is_throttled(media_error(500)))
+    self.assertTrue(retry.is_transient(media_error(500)))
+    self.assertFalse(retry.is_transient(media_error(404)))
+
+  def testThrottledAfterRetries(self):
+    cause = exceptions.ServiceUnavailable('busy')
+    self.assertTrue(retry.is_throttled(
+      exceptions.RetryError('deadline exceeded', cause)))
+    self.assertFalse(retry.is_throttled(
+      exceptions.RetryError('deadline exceeded', ValueError())))
+    self.assertEqual(503, handlers.error_status(cause))
+    self.assertEqual(500, handlers.error_status(ValueError()))
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+  def testHalvesOncePerIntervalAndGrowsBack(self):
+    concurrency = retry.AdaptiveConcurrency(16, decrease_interval=60)
+    concurrency.throttled()
+    concurrency.throttled()
+    self.assertEqual(8, concurrency.limit)
+
+    # About one more per round of eight successful requests.
+    for _ in range(9):
+      concurrency.succeeded()
+    self.assertEqual(9, concurrency.limit)
+
+    for _ in range(1000):
+      concurrency.succeeded()
+    self.assertEqual(16, concurrency.limit)
+
+  def testMinimumLimit(self):
+    concurrency = retry.AdaptiveConcurrency(4, decrease_interval=0)
+    for _ in range(10):
+      concurrency.throttled()
+    self.assertEqual(1, concurrency.limit)
+
+  def testParallelForEachFollowsLimit(self):
+    concurrency = retry.AdaptiveConcurrency(8, decrease_interval=60)
+    fn = Mock(side_effect=[exceptions.TooManyRequests('slow')] + [None] * 9)
+
+    with patch.object(handlers, 'CONCURRENCY', concurrency):
+      failures = handlers.parallel_for_each(fn, range(10), max_workers=1)
+
+    self.assertEqual(1, len(failures))
+    self.assertEqual(0, failures[0][0])
+    self.assertEqual(10, fn.call_count)
+    # Halved once, then grown back by the nine successes.
+    self.assertEqual(5, concurrency.limit)
+
+
+if __name__ == '__main__':
+  unittest.main()
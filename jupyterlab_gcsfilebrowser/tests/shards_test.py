@@ -0,0 +1,77 @@
+import threading
+import unittest
+from unittest.mock import Mock, MagicMock, patch
+
+from jupyterlab_gcsfilebrowser import shards
+from jupyterlab_gcsfilebrowser.tests.fakes import fake_list_blobs
+
+from google.cloud.storage import Blob, Bucket
+
+
+class TestShards(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='bucket')
+    self.names = ['data/'] + [
+      'data/%s/part-%d' % (d, i) for d in 'abcdefgh' for i in range(3)
+    ] + ['data/top.txt', 'other/x']
+    self.storage_client = MagicMock()
+    self.storage_client.list_blobs = MagicMock(side_effect=fake_list_blobs(
+      [Blob(name=n, bucket=self.bucket) for n in self.names]))
+
+  def testSplitsAtSubdirectories(self):
+    got = shards.discover_splits(
+      'bucket', 'data/', self.storage_client, max_shards=4)
+
+    self.assertEqual(['data/c/', 'data/e/', 'data/g/'], got)
+
+  def testDescendsIntoSingleSubdirectory(self):
+    got = shards.discover_splits('bucket', '', self.storage_client,
+                                 max_shards=2)
+    self.assertEqual(['other/'], got)
+
+    self.storage_client.list_blobs.side_effect = fake_list_blobs(
+      [Blob(name='only/%s/x' % d, bucket=self.bucket) for d in 'abcd'])
+    got = shards.discover_splits('bucket', '', self.storage_client,
+                                 max_shards=2)
+    self.assertEqual(['only/c/'], got)
+
+  def testTooManyEntriesUsesFixedSplits(self):
+    with patch.object(shards, 'SPLIT_PROBE_SIZE', 2):
+      got = shards.discover_splits('bucket', 'data/', self.storage_client)
+
+    self.assertEqual(['data/' + c for c in shards.SHARD_SPLITS], got)
+
+  def testListsEveryBlobOnce(self):
+    with patch.object(shards, 'PAGE_SIZE', 2):
+      got = [b.name for b in shards.list_prefix(
+        'bucket', 'data/', self.storage_client, max_shards=4)]
+
+    self.assertEqual(sorted(n for n in self.names if n.startswith('data/')),
+                     sorted(got))
+    # One listing to find the splits and one per shard.
+    self.assertEqual(5, self.storage_client.list_blobs.call_count)
+
+  def testClosingStopsShards(self):
+    with patch.object(shards, 'PAGE_SIZE', 1):
+      blobs = shards.list_ranges(
+        'bucket', 'data/', shards.key_ranges(['data/c/', 'data/e/']),
+        self.storage_client, max_buffered_pages=1)
+      next(blobs)
+      blobs.close()
+
+    for thread in threading.enumerate():
+      if thread.name.startswith('ThreadPoolExecutor'):
+        thread.join(5)
+    self.assertEqual(3, self.storage_client.list_blobs.call_count)
+
+  def testShardErrorIsRaised(self):
+    self.storage_client.list_blobs.side_effect = ValueError('listing failed')
+
+    with self.assertRaises(ValueError):
+      list(shards.list_ranges('bucket', 'data/', shards.key_ranges(['data/c/']),
+                              self.storage_client))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,73 @@
+import threading
+import unittest
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+
+
+class TestSingleFlight(unittest.TestCase):
+
+  def testConcurrentCallsShareOneResult(self):
+    release = threading.Event()
+    calls = []
+
+    def fetch(path):
+      calls.append(path)
+      release.wait()
+      return {'path': path}
+
+    single_flight = SingleFlight(max_workers=4)
+    futures = [single_flight.do(('contents', 'b/a'), fetch, 'b/a')
+               for _ in range(5)]
+    other = single_flight.do(('contents', 'b/c'), fetch, 'b/c')
+    release.set()
+
+    results = [f.result() for f in futures]
+    self.assertEqual(['b/a'] * 5, [r['path'] for r in results])
+    self.assertTrue(all(r is results[0] for r in results))
+    self.assertEqual('b/c', other.result()['path'])
+    self.assertEqual(['b/a', 'b/c'], sorted(calls))
+    self.assertEqual(4, single_flight.coalesced)
+
+  def testLaterCallsStartAgain(self):
+    single_flight = SingleFlight(max_workers=1)
+    first = single_flight.do('key', lambda: 1)
+    first.result()
+
+    self.assertEqual(2, single_flight.do('key', lambda: 2).result())
+
+  def testRunDoesNotShareCalls(self):
+    single_flight = SingleFlight(max_workers=2)
+    calls = []
+
+    futures = [single_flight.run(calls.append, i) for i in range(3)]
+
+    for f in futures:
+      f.result()
+    self.assertEqual([0, 1, 2], sorted(calls))
+    self.assertEqual(0, single_flight.coalesced)
+
+  def testErrorsAreShared(self):
+    release = threading.Event()
+
+    def fail():
+      release.wait()
+      raise handlers.FileNotFound('missing')
+
+    single_flight = SingleFlight(max_workers=1)
+    futures = [single_flight.do('key', fail) for _ in range(2)]
+    release.set()
+
+    for f in futures:
+      with self.assertRaises(handlers.FileNotFound):
+        f.result()
+
+  def testContentsKey(self):
+    self.assertEqual(handlers.contents_key('/bucket/a.ipynb'),
+                     handlers.contents_key('bucket/a.ipynb'))
+    self.assertNotEqual(handlers.contents_key('bucket/dir'),
+                        handlers.contents_key('bucket/dir/'))
+
+
+if __name__ == '__main__':
+  unittest.main()
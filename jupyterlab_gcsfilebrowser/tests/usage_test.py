@@ -0,0 +1,148 @@
+import datetime
+import json
+import threading
+import time
+import unittest
+from unittest.mock import Mock, MagicMock, patch
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import usage
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+from jupyterlab_gcsfilebrowser.tests.fakes import fake_list_blobs
+
+from google.cloud.storage import Blob, Bucket
+import tornado.gen as gen
+from tornado.testing import AsyncHTTPTestCase, gen_test
+from tornado.web import Application
+
+
+class TestUsage(unittest.TestCase):
+
+  def setUp(self):
+    self.bucket = Bucket(client=Mock(), name='bucket')
+    self.blobs = [
+      self.make_blob('dir/', 0, '2020-01-01T00:00:00.000Z'),
+      self.make_blob('dir/0.txt', 10, '2020-01-03T00:00:00.000Z'),
+      self.make_blob('dir/Zeta.txt', 20, '2020-01-02T00:00:00.000Z'),
+      self.make_blob('dir/sub/a.txt', 30, '2020-01-01T00:00:00.000Z'),
+      self.make_blob('dir/~tilde', 40, '2020-01-01T00:00:00.000Z'),
+      self.make_blob('other.txt', 50, '2020-01-05T00:00:00.000Z'),
+    ]
+    self.storage_client = MagicMock()
+    self.storage_client.list_blobs = MagicMock(
+      side_effect=fake_list_blobs(self.blobs))
+
+  def make_blob(self, name, size, updated):
+    blob = Blob(name=name, bucket=self.bucket)
+    blob._properties['size'] = str(size)
+    blob._properties['updated'] = updated
+    return blob
+
+  def testShardsCoverKeySpaceOnce(self):
+    got = usage.directory_usage('bucket', 'dir/', self.storage_client,
+                                splits=usage.SHARD_SPLITS)
+
+    self.assertEqual((100, 5), (got.size, got.objects))
+    self.assertEqual(datetime.date(2020, 1, 3), got.last_modified.date())
+    self.assertEqual(len(usage.SHARD_SPLITS) + 1,
+                     self.storage_client.list_blobs.call_count)
+
+  def testAncestorPrefixes(self):
+    self.assertEqual(['', 'a/', 'a/b/'], usage.ancestor_prefixes('a/b/c.txt'))
+    self.assertEqual(['', 'a/'], usage.ancestor_prefixes('a/'))
+
+  def testCacheAppliesOwnWrites(self):
+    usage_cache = usage.UsageCache(ttl=60)
+    handlers.path_usage('bucket/dir', self.storage_client, usage_cache)
+    handlers.path_usage('bucket/dir/sub', self.storage_client, usage_cache)
+    calls = self.storage_client.list_blobs.call_count
+
+    handlers.record_added(usage_cache, self.make_blob(
+      'dir/sub/new.txt', 5, '2021-01-01T00:00:00.000Z'))
+    handlers.record_removed(usage_cache, self.blobs[1])
+
+    got = handlers.path_usage('bucket/dir/', self.storage_client, usage_cache)
+    self.assertEqual((95, 5, True),
+                     (got['size'], got['objects'], got['cached']))
+    self.assertTrue(got['last_modified'].startswith('2021-01-01'))
+    got = handlers.path_usage(
+      'bucket/dir/sub', self.storage_client, usage_cache)
+    self.assertEqual((35, 2), (got['size'], got['objects']))
+    self.assertEqual(calls, self.storage_client.list_blobs.call_count)
+
+  def testInvalidateDropsAncestorsAndDescendants(self):
+    usage_cache = usage.UsageCache(ttl=60)
+    for prefix in ('', 'dir/', 'dir/sub/', 'other/'):
+      usage_cache.put('bucket', prefix, usage.Usage(1, 1), usage_cache.version)
+
+    usage_cache.invalidate('bucket', 'dir')
+
+    self.assertIsNone(usage_cache.get('bucket', ''))
+    self.assertIsNone(usage_cache.get('bucket', 'dir/'))
+    self.assertIsNone(usage_cache.get('bucket', 'dir/sub/'))
+    self.assertIsNotNone(usage_cache.get('bucket', 'other/'))
+
+  def testStaleAggregateIsNotCached(self):
+    usage_cache = usage.UsageCache(ttl=60)
+    version = usage_cache.version
+    usage_cache.removed('bucket', 'dir/a.txt', 1)
+
+    self.assertFalse(
+      usage_cache.put('bucket', 'dir/', usage.Usage(1, 1), version))
+
+  def testExpiredEntry(self):
+    usage_cache = usage.UsageCache(ttl=0)
+    usage_cache.put('bucket', 'dir/', usage.Usage(1, 1), usage_cache.version)
+    time.sleep(0.01)
+
+    self.assertIsNone(usage_cache.get('bucket', 'dir/'))
+
+  def testMissingDirectory(self):
+    with self.assertRaises(handlers.FileNotFound):
+      handlers.path_usage('bucket/missing', self.storage_client)
+
+  def testListingShowsCachedDirectorySizes(self):
+    usage_cache = usage.UsageCache(ttl=60)
+    handlers.path_usage('bucket/dir/sub', self.storage_client, usage_cache)
+
+    got = handlers.getPathContents(
+      'bucket/dir', self.storage_client, usage_cache=usage_cache)
+
+    sub = [i for i in got['content'] if i['name'] == 'sub/'][0]
+    self.assertEqual((30, 1), (sub['size'], sub['objects']))
+
+
+class TestUsageHandler(AsyncHTTPTestCase):
+
+  def get_app(self):
+    self.single_flight = SingleFlight(4)
+    return Application([('/du/(.*)', handlers.UsageHandler)],
+                       gcs_single_flight=self.single_flight)
+
+  @gen_test
+  def testConcurrentRequestsShareOneScan(self):
+    release = threading.Event()
+    scans = []
+
+    def directory_usage(bucket_name, prefix, storage_client):
+      scans.append(threading.current_thread().name)
+      release.wait(5)
+      return usage.Usage(10, 2, None)
+
+    with patch.object(handlers, 'directory_usage',
+                      side_effect=directory_usage), \
+        patch.object(handlers, 'shared_storage_client', MagicMock()):
+      requests = [self.http_client.fetch(self.get_url('/du/bucket/dir'))
+                  for _ in range(3)]
+      while self.single_flight.coalesced < 2:
+        yield gen.sleep(0.01)
+      release.set()
+      responses = yield requests
+
+    self.assertEqual(1, len(scans))
+    self.assertTrue(scans[0].startswith('gcs-request'))
+    self.assertEqual([10] * 3, [json.loads(r.body)['size'] for r in responses])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,52 @@
+import datetime
+import unittest
+from unittest.mock import MagicMock, patch
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import warmup
+
+
+class TestWarmUp(unittest.TestCase):
+
+  def setUp(self):
+    self.session = MagicMock()
+    self.session.credentials.expiry = None
+    patcher = patch.object(handlers, 'shared_storage_session',
+                           return_value=self.session)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def testRefreshesTokenAndOpensConnections(self):
+    warm_up = warmup.WarmUp(connections=3)
+    warm_up.stop()
+
+    warm_up._run()
+
+    self.session.credentials.refresh.assert_called_once()
+    self.assertEqual(3, self.session.head.call_count)
+    self.session.head.assert_called_with(
+      'https://storage.googleapis.com', timeout=10)
+
+  def testFailureIsLogged(self):
+    self.session.credentials.refresh.side_effect = ValueError('no creds')
+    warm_up = warmup.WarmUp(connections=3)
+
+    warm_up._run()
+
+    self.session.head.assert_not_called()
+
+  def testRefreshDelay(self):
+    warm_up = warmup.WarmUp(connections=1)
+    self.session.credentials.expiry = (
+      datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+    self.assertAlmostEqual(
+      3600 - warmup.TOKEN_REFRESH_MARGIN,
+      warm_up._refresh_delay(self.session.credentials), delta=5)
+
+    self.session.credentials.expiry = datetime.datetime.utcnow()
+    self.assertEqual(warmup.TOKEN_RETRY_INTERVAL,
+                     warm_up._refresh_delay(self.session.credentials))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,153 @@
+import contextvars
+import json
+import threading
+import time
+import unittest
+from unittest.mock import Mock, patch
+
+import tornado.gen as gen
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+from jupyterlab_gcsfilebrowser import handlers
+from jupyterlab_gcsfilebrowser import watchdog
+from jupyterlab_gcsfilebrowser.singleflight import SingleFlight
+
+
+def list_objects():
+  watchdog.count_objects(3)
+  watchdog.count_storage_request(None)
+  return 'listed'
+
+
+class BlockingHandler(handlers.StorageHandler):
+
+  def get(self):
+    time.sleep(0.5)
+    self.finish('done')
+
+
+class ThreadedHandler(handlers.StorageHandler):
+
+  @gen.coroutine
+  def get(self):
+    result = yield self.settings['gcs_single_flight'].do('key', list_objects)
+    self.finish(result)
+
+
+class TestWatchdog(AsyncHTTPTestCase):
+
+  def get_app(self):
+    self.watchdog = watchdog.Watchdog(
+      lag_threshold=0.1, slow_request_threshold=0.3)
+    return Application([
+      ('/blocking', BlockingHandler),
+      ('/threaded', ThreadedHandler),
+      ('/diagnostics(.*)', handlers.DiagnosticsHandler),
+    ], gcs_watchdog=self.watchdog, gcs_single_flight=SingleFlight(2))
+
+  def setUp(self):
+    super(TestWatchdog, self).setUp()
+    self.watchdog.start()
+
+  def tearDown(self):
+    self.watchdog.stop()
+    super(TestWatchdog, self).tearDown()
+
+  def diagnostics(self):
+    # Lets the probe run once more, so that the end of a block is recorded.
+    self.io_loop.run_sync(lambda: gen.sleep(0.1))
+    return json.loads(self.fetch('/diagnostics').body)
+
+  def testBlockingRequest(self):
+    self.assertEqual(b'done', self.fetch('/blocking').body)
+
+    snapshot = self.diagnostics()
+    block, = snapshot['blocked']
+    self.assertEqual('/blocking', block['path'])
+    self.assertEqual('BlockingHandler', block['handler'])
+    self.assertGreaterEqual(block['seconds'], 0.4)
+    self.assertTrue(any(' get' in frame and 'watchdog_test' in frame
+                        for frame in block['stack']))
+    self.assertGreaterEqual(snapshot['loop_lag']['max'], 0.4)
+
+    slow, = snapshot['slow_requests']
+    self.assertEqual(('GET', '/blocking', 200),
+                     (slow['method'], slow['path'], slow['status']))
+    self.assertEqual('/blocking', snapshot['slow_paths'][0]['path'])
+
+  def testCountsWorkOfThreads(self):
+    self.watchdog.slow_request_threshold = 0
+
+    self.assertEqual(b'listed', self.fetch('/threaded').body)
+
+    slow = [r for r in self.diagnostics()['slow_requests']
+            if r['path'] == '/threaded']
+    self.assertEqual(1, len(slow))
+    self.assertEqual((3, 1), (slow[0]['objects'], slow[0]['storage_requests']))
+
+  def testFastRequestsAreNotRecorded(self):
+    self.fetch('/threaded')
+
+    snapshot = self.diagnostics()
+    self.assertEqual([], snapshot['blocked'])
+    self.assertEqual([], snapshot['slow_requests'])
+
+
+class TestRequestRecord(unittest.TestCase):
+
+  def testCountsFromManyThreads(self):
+    record = watchdog.RequestRecord(Mock(request=Mock(method='GET', path='/')))
+    context = contextvars.copy_context()
+    context.run(watchdog.CURRENT_REQUEST.set, record)
+
+    def count():
+      for _ in range(10000):
+        watchdog.count_objects(1)
+        watchdog.count_storage_request(None)
+
+    threads = [threading.Thread(target=context.copy().run, args=(count,))
+               for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    counts = record.as_dict(0)
+    self.assertEqual((80000, 80000),
+                     (counts['objects'], counts['storage_requests']))
+
+
+class TestSlowPaths(unittest.TestCase):
+
+  def finish(self, recorder, path, seconds):
+    record = watchdog.RequestRecord(
+      Mock(request=Mock(method='GET', path=path)))
+    record.started -= seconds
+    recorder.request_finished(record, 200)
+
+  def testKeepsPathsWithMostTime(self):
+    recorder = watchdog.Watchdog(lag_threshold=1, slow_request_threshold=0)
+
+    with patch.object(watchdog, 'MAX_TRACKED_SLOW_PATHS', 2):
+      for path, seconds in (('/a', 3), ('/b', 1), ('/c', 2), ('/b', 1)):
+        self.finish(recorder, path, seconds)
+
+    self.assertEqual(['/a', '/b'], [
+      p['path'] for p in recorder.snapshot()['slow_paths']])
+
+
+class TestDiagnosticsDisabled(AsyncHTTPTestCase):
+
+  def get_app(self):
+    return Application([('/diagnostics(.*)', handlers.DiagnosticsHandler)])
+
+  def testNotFound(self):
+    response = self.fetch('/diagnostics')
+
+    self.assertEqual(404, response.code)
+    self.assertEqual(404, json.loads(response.body)['error']['response']['status'])
+
+
+if __name__ == '__main__':
+  unittest.main()
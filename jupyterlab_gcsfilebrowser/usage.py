@@ -0,0 +1,136 @@
+# Lint as: python3
+"""Size, object count and newest modification time of GCS prefixes."""
+
+import collections
+import threading
+import time
+
+from jupyterlab_gcsfilebrowser.shards import SHARD_SPLITS, list_prefix, list_ranges, shard_ranges
+
+# Only the listing fields needed for the aggregate are requested.
+LISTING_FIELDS = 'items(name,size,updated),nextPageToken'
+# Number of prefixes whose usage is cached.
+MAX_USAGE_ENTRIES = 10000
+
+
+class Usage(object):
+  """Aggregate of the objects below a prefix."""
+
+  def __init__(self, size=0, objects=0, last_modified=None):
+    self.size = size
+    self.objects = objects
+    self.last_modified = last_modified
+
+  def add(self, size, objects=1, updated=None):
+    self.size += size or 0
+    self.objects += objects
+    if updated and (not self.last_modified or updated > self.last_modified):
+      self.last_modified = updated
+
+  def merge(self, other):
+    self.add(other.size, other.objects, other.last_modified)
+
+  def copy(self):
+    return Usage(self.size, self.objects, self.last_modified)
+
+
+def directory_usage(bucket_name, prefix, storage_client, splits=None):
+  """List the objects below prefix in parallel shards and aggregate them.
+
+  The prefix is split at the given split characters, or at split keys
+  discovered by list_prefix.
+
+  Returns:
+    A Usage.
+  """
+  if splits is None:
+    blobs = list_prefix(bucket_name, prefix, storage_client,
+                        fields=LISTING_FIELDS)
+  else:
+    blobs = list_ranges(bucket_name, prefix, shard_ranges(prefix, splits),
+                        storage_client, fields=LISTING_FIELDS)
+
+  total = Usage()
+  for b in blobs:
+    total.add(b.size, 1, b.updated)
+  return total
+
+
+def ancestor_prefixes(name):
+  """The directory prefixes containing an object name, from the bucket root."""
+  parts = name.split('/')[:-1]
+  return [''] + ['/'.join(parts[:i]) + '/' for i in range(1, len(parts) + 1)]
+
+
+class UsageCache(object):
+  """Caches the usage of prefixes and keeps it current after our own writes.
+
+  Writes made through this server adjust the cached usage of every ancestor
+  prefix of the written object. Writes made elsewhere are only picked up once
+  an entry is older than ttl seconds.
+  """
+
+  def __init__(self, ttl, max_entries=MAX_USAGE_ENTRIES):
+    self.ttl = ttl
+    self.max_entries = max_entries
+    # Incremented on every write, so that an aggregate computed while writes
+    # happened is not cached.
+    self.version = 0
+    self._lock = threading.Lock()
+    self._entries = collections.OrderedDict()
+
+  def get(self, bucket_name, prefix):
+    """Returns a copy of the cached Usage of prefix, or None."""
+    key = (bucket_name, prefix)
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None:
+        return None
+      usage, computed = entry
+      if time.time() - computed > self.ttl:
+        del self._entries[key]
+        return None
+      self._entries.move_to_end(key)
+      return usage.copy()
+
+  def put(self, bucket_name, prefix, usage, version):
+    """Cache usage computed when the cache was at version.
+
+    Returns:
+      True if the usage was cached, False if writes happened since version.
+    """
+    with self._lock:
+      if version != self.version:
+        return False
+      key = (bucket_name, prefix)
+      self._entries[key] = (usage.copy(), time.time())
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_entries:
+        self._entries.popitem(last=False)
+      return True
+
+  def _apply(self, bucket_name, name, size, objects, updated):
+    with self._lock:
+      self.version += 1
+      for prefix in ancestor_prefixes(name):
+        entry = self._entries.get((bucket_name, prefix))
+        if entry is not None:
+          entry[0].add(size, objects, updated)
+
+  def added(self, bucket_name, name, size, updated=None):
+    """Record that an object was created."""
+    self._apply(bucket_name, name, size, 1, updated)
+
+  def removed(self, bucket_name, name, size):
+    """Record that an object was deleted."""
+    self._apply(bucket_name, name, -(size or 0), -1, None)
+
+  def invalidate(self, bucket_name, name):
+    """Forget the usage of every prefix containing or below name."""
+    with self._lock:
+      self.version += 1
+      for prefix in ancestor_prefixes(name):
+        self._entries.pop((bucket_name, prefix), None)
+      for key in [k for k in self._entries
+                  if k[0] == bucket_name and k[1].startswith(name)]:
+        del self._entries[key]
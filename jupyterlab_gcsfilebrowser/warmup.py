@@ -0,0 +1,82 @@
+# Lint as: python3
+"""Background warm-up of the storage client at server start."""
+
+import datetime
+import importlib
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from notebook.base.handlers import app_log
+
+# Seconds before expiry at which the access token is refreshed, so that no
+# request has to wait for a refresh.
+TOKEN_REFRESH_MARGIN = 300
+# Seconds to wait before retrying a failed refresh.
+TOKEN_RETRY_INTERVAL = 60
+# The storage API endpoint that connections are opened to.
+STORAGE_ENDPOINT = 'https://storage.googleapis.com'
+
+
+class WarmUp(object):
+  """Prepares the shared storage client off the event loop.
+
+  Imports the handlers, builds the shared client, fetches an access token
+  and opens keep-alive connections to the storage endpoint, then keeps the
+  token refreshed ahead of its expiry. The first file browser request then
+  costs no more than later ones.
+  """
+
+  def __init__(self, connections):
+    self.connections = connections
+    self._stopped = threading.Event()
+    self._thread = None
+
+  def start(self):
+    self._thread = threading.Thread(
+      target=self._run, name='gcs-warmup', daemon=True)
+    self._thread.start()
+
+  def stop(self):
+    self._stopped.set()
+
+  def _run(self):
+    try:
+      handlers = importlib.import_module('jupyterlab_gcsfilebrowser.handlers')
+      session = handlers.shared_storage_session()
+      self._refresh(session.credentials)
+      self._connect(session)
+    except Exception as e:
+      # Requests set up the client themselves if the warm-up failed.
+      app_log.warning('GCS warm-up failed: %s', e)
+      return
+
+    while not self._stopped.wait(self._refresh_delay(session.credentials)):
+      try:
+        self._refresh(session.credentials)
+      except Exception as e:
+        app_log.warning('Could not refresh the GCS access token: %s', e)
+
+  def _refresh(self, credentials):
+    from google.auth.transport.requests import Request
+
+    credentials.refresh(Request())
+
+  def _refresh_delay(self, credentials):
+    expiry = credentials.expiry
+    if expiry is None:
+      return TOKEN_RETRY_INTERVAL
+    remaining = (expiry - datetime.datetime.utcnow()).total_seconds()
+    return max(TOKEN_RETRY_INTERVAL, remaining - TOKEN_REFRESH_MARGIN)
+
+  def _connect(self, session):
+    """Open connections to the storage endpoint in parallel.
+
+    The session is the one the shared client sends through, and any response
+    leaves its connection in the session's pool, so a bodyless request to the
+    endpoint is enough.
+    """
+    def connect(_):
+      session.head(STORAGE_ENDPOINT, timeout=10).close()
+
+    with ThreadPoolExecutor(max_workers=self.connections) as pool:
+      list(pool.map(connect, range(self.connections)))
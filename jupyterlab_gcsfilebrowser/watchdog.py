@@ -0,0 +1,230 @@
+# Lint as: python3
+"""Detection of requests that block the event loop or run slowly."""
+
+import collections
+import contextvars
+import sys
+import threading
+import time
+import traceback
+
+from notebook.base.handlers import app_log
+from tornado.ioloop import IOLoop
+from tornado.web import RequestHandler
+
+# Seconds between probes of the event loop.
+PROBE_INTERVAL = 0.05
+# Frames kept from the sampled stack of a blocked loop, innermost last.
+MAX_STACK_FRAMES = 30
+# Recent loop lags kept for the lag percentiles.
+MAX_LAG_SAMPLES = 2000
+# Paths reported in the summary of slow requests.
+MAX_SLOW_PATHS = 20
+# Paths whose slow requests are totalled. When more are slow, the path with
+# the least total time is dropped.
+MAX_TRACKED_SLOW_PATHS = 1000
+
+# The request that the running code works for, if any.
+CURRENT_REQUEST = contextvars.ContextVar('gcs_current_request', default=None)
+
+
+class RequestRecord(object):
+  """What a request did, counted while it runs.
+
+  The request's worker threads count into it concurrently, so the counts are
+  only changed and read under its lock.
+  """
+
+  def __init__(self, handler):
+    self.method = handler.request.method
+    self.path = handler.request.path
+    self.handler = type(handler).__name__
+    self.started = time.monotonic()
+    self.storage_requests = 0
+    self.objects = 0
+    self._lock = threading.Lock()
+
+  def count(self, storage_requests=0, objects=0):
+    with self._lock:
+      self.storage_requests += storage_requests
+      self.objects += objects
+
+  def as_dict(self, duration):
+    with self._lock:
+      return {
+        'method': self.method,
+        'path': self.path,
+        'handler': self.handler,
+        'seconds': round(duration, 3),
+        'storage_requests': self.storage_requests,
+        'objects': self.objects,
+      }
+
+
+def count_objects(count):
+  """Add to the objects handled by the current request."""
+  record = CURRENT_REQUEST.get()
+  if record is not None:
+    record.count(objects=count)
+
+
+def count_storage_request(response, *args, **kwargs):
+  """A requests response hook that counts storage API calls per request."""
+  record = CURRENT_REQUEST.get()
+  if record is not None:
+    record.count(storage_requests=1)
+
+
+def percentile(values, p):
+  values = sorted(values)
+  if not values:
+    return 0.0
+  return values[min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))]
+
+
+class Watchdog(object):
+  """Watches the event loop for stalls and records slow requests.
+
+  A probe on the event loop stamps a heartbeat every PROBE_INTERVAL seconds.
+  A monitor thread samples the stack of the loop's thread when the heartbeat
+  is more than lag_threshold seconds old, which shows what blocks the loop
+  and for which request. Requests that take more than slow_request_threshold
+  seconds are recorded when they finish. The last max_records of each are
+  kept for the diagnostics endpoint.
+  """
+
+  def __init__(self, lag_threshold, slow_request_threshold, max_records=100):
+    self.lag_threshold = lag_threshold
+    self.slow_request_threshold = slow_request_threshold
+    self._lock = threading.Lock()
+    self._lags = collections.deque(maxlen=MAX_LAG_SAMPLES)
+    self._blocks = collections.deque(maxlen=max_records)
+    self._slow_requests = collections.deque(maxlen=max_records)
+    # Totals by path, least recently slow first.
+    self._slow_paths = collections.OrderedDict()
+    self._block = None
+    self._heartbeat = None
+    self._loop = None
+    self._loop_thread = None
+    self._stopped = threading.Event()
+
+  def start(self):
+    """Start watching the current thread's event loop."""
+    self._loop = IOLoop.current()
+    self._loop_thread = threading.get_ident()
+    self._heartbeat = time.monotonic()
+    self._loop.add_callback(self._probe, self._heartbeat)
+    threading.Thread(target=self._monitor, name='gcs-watchdog',
+                     daemon=True).start()
+
+  def stop(self):
+    self._stopped.set()
+
+  def _probe(self, expected):
+    now = time.monotonic()
+    with self._lock:
+      self._lags.append(max(now - expected, 0.0))
+      if self._block is not None:
+        self._block['seconds'] = round(now - self._heartbeat, 3)
+        app_log.warning('Event loop was blocked for %.2f s by %s %s',
+                        self._block['seconds'], self._block['method'],
+                        self._block['path'])
+        self._block = None
+      self._heartbeat = now
+    if not self._stopped.is_set():
+      self._loop.call_at(self._loop.time() + PROBE_INTERVAL, self._probe,
+                         now + PROBE_INTERVAL)
+
+  def _monitor(self):
+    while not self._stopped.wait(PROBE_INTERVAL):
+      with self._lock:
+        heartbeat = self._heartbeat
+        blocked = time.monotonic() - heartbeat
+        if self._block is not None or blocked < self.lag_threshold:
+          continue
+      block = self._sample(blocked)
+      with self._lock:
+        if self._heartbeat == heartbeat:
+          self._block = block
+          self._blocks.append(block)
+
+  def _sample(self, blocked):
+    """Describe what the loop's thread is running."""
+    frame = sys._current_frames().get(self._loop_thread)
+    block = {
+      'time': time.time(),
+      'seconds': round(blocked, 3),
+      'method': None,
+      'path': None,
+      'handler': None,
+      'stack': [],
+    }
+    if frame is None:
+      return block
+    block['stack'] = [
+      '%s:%d %s' % (f.filename, f.lineno, f.name)
+      for f in traceback.extract_stack(frame)[-MAX_STACK_FRAMES:]]
+    while frame is not None:
+      handler = frame.f_locals.get('self')
+      if isinstance(handler, RequestHandler):
+        block['method'] = handler.request.method
+        block['path'] = handler.request.path
+        block['handler'] = type(handler).__name__
+        break
+      frame = frame.f_back
+    return block
+
+  def request_started(self, handler):
+    """Start counting the work of a request.
+
+    Returns:
+      A RequestRecord to pass to request_finished.
+    """
+    record = RequestRecord(handler)
+    CURRENT_REQUEST.set(record)
+    return record
+
+  def request_finished(self, record, status):
+    duration = time.monotonic() - record.started
+    if duration < self.slow_request_threshold:
+      return
+    slow = dict(record.as_dict(duration), status=status, time=time.time())
+    app_log.warning(
+      'Slow request: %s %s took %.2f s, %d storage requests, %d objects',
+      record.method, record.path, duration, slow['storage_requests'],
+      slow['objects'])
+    with self._lock:
+      self._slow_requests.append(slow)
+      path = self._slow_paths.get(record.path)
+      if path is None:
+        if len(self._slow_paths) >= MAX_TRACKED_SLOW_PATHS:
+          # The least recently slow of the paths with the least time.
+          del self._slow_paths[min(
+            self._slow_paths, key=lambda p: self._slow_paths[p]['seconds'])]
+        path = self._slow_paths[record.path] = {
+          'path': record.path, 'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+      self._slow_paths.move_to_end(record.path)
+      path['count'] += 1
+      path['seconds'] += duration
+      path['max_seconds'] = max(path['max_seconds'], duration)
+
+  def snapshot(self):
+    """Returns a dict of the recent loop lag, blocks and slow requests."""
+    with self._lock:
+      lags = list(self._lags)
+      slow_paths = sorted(self._slow_paths.values(),
+                          key=lambda p: p['seconds'], reverse=True)
+      return {
+        'lag_threshold': self.lag_threshold,
+        'slow_request_threshold': self.slow_request_threshold,
+        'loop_lag': {
+          'p50': round(percentile(lags, 50), 4),
+          'p99': round(percentile(lags, 99), 4),
+          'max': round(max(lags or [0.0]), 4),
+        },
+        'blocked': list(self._blocks),
+        'slow_requests': list(self._slow_requests),
+        'slow_paths': [dict(p, seconds=round(p['seconds'], 3),
+                            max_seconds=round(p['max_seconds'], 3))
+                       for p in slow_paths[:MAX_SLOW_PATHS]],
+      }
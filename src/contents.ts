@@ -4,6 +4,8 @@ import {URLExt} from "@jupyterlab/coreutils";
 
 const DRIVE_NAME_GCS: 'GCS' = 'GCS';
 const GCS_LINK_PREFIX = 'https://storage.cloud.google.com/';
+// Milliseconds between polls of a background job.
+const JOB_POLL_INTERVAL = 500;
 
 /**
  * A Contents.IDrive implementation that Google Cloud Storage.
@@ -18,6 +20,9 @@ export class GCSDrive implements Contents.IDrive {
 
   private _isDisposed = false;
   private _fileChanged = new Signal<this, Contents.IChangedArgs>(this);
+  // Generation of each file as last read or saved, sent with the next save
+  // so that the server rejects it if someone else changed the file since.
+  private _generations = new Map<string, string>();
 
   /**
    * The name of the drive.
@@ -67,11 +72,32 @@ export class GCSDrive implements Contents.IDrive {
     * @returns A promise which resolves with the file content.
     */
   get(localPath: string, options?: Contents.IFetchOptions): Promise<Contents.IModel> {
+    if (options && options.type === 'file' && options.format === 'text'
+        && options.content !== false && !localPath.endsWith('.ipynb')) {
+      return this._getText(localPath);
+    }
     return new Promise((resolve, reject) => {
       // TODO(cbwilkes): Move to a services library.
       let serverSettings = ServerConnection.makeSettings();
-      const requestUrl = URLExt.join(
+      let requestUrl = URLExt.join(
         serverSettings.baseUrl, 'gcp/v1/gcs/files', localPath);
+      let query: string[] = [];
+      if (options && options.content === false) {
+        // Only the metadata, which the server reads without downloading the
+        // file.
+        query.push('content=0');
+      }
+      if (options && options.format) {
+        query.push('format=' + options.format);
+      }
+      if (localPath.endsWith('.ipynb')) {
+        // Large outputs are left out when the server is configured to, and
+        // fetched with getOutputs by the Load Unloaded Outputs command.
+        query.push('outputs=lazy');
+      }
+      if (query.length) {
+        requestUrl += '?' + query.join('&');
+      }
       ServerConnection.makeRequest(requestUrl, {}, serverSettings
       ).then((response) => {
         response.json().then((content) => {
@@ -81,7 +107,8 @@ export class GCSDrive implements Contents.IDrive {
             return;
           }
           if (content.type == 'directory') {
-            let directory_contents = content.content.map((c: any) => {
+            let directory_contents = content.content && content.content.map(
+                (c: any) => {
               return {
                 name: c.name,
                 path: c.path,
@@ -108,16 +135,15 @@ export class GCSDrive implements Contents.IDrive {
             resolve(directory);
           }
           else if (content.type == "file") {
-            let decoded_content = Buffer.from(
-              content.content.content.replace(/\n/g, ""),
-              'base64').toString('utf8')
-
+            if (content.content.generation) {
+              this._generations.set(localPath, content.content.generation);
+            }
             resolve({
               type: "file",
               path: content.content.path,
               name: content.content.path,
-              format: "text",
-              content: decoded_content,
+              format: content.content.format,
+              content: content.content.content,
               created: "",
               writable: true,
               last_modified: content.content.last_modified,
@@ -129,6 +155,49 @@ export class GCSDrive implements Contents.IDrive {
     });
   }
 
+  /**
+    * Get the text of a file as it is stored.
+    *
+    * The server sends a gzip-encoded file as it is stored in GCS, and the
+    * browser decompresses it, so the file is not compressed again for the
+    * response.
+    *
+    * @param localPath: The path to the file.
+    *
+    * @returns A promise which resolves with the file model.
+    */
+  private _getText(localPath: string): Promise<Contents.IModel> {
+    let serverSettings = ServerConnection.makeSettings();
+    const requestUrl = URLExt.join(
+      serverSettings.baseUrl, 'gcp/v1/gcs/files', localPath) + '?raw=1';
+    return ServerConnection.makeRequest(requestUrl, {}, serverSettings
+    ).then((response) => {
+      if (!response.ok) {
+        return response.json().then((content) => {
+          console.error(content.error);
+          throw content.error;
+        });
+      }
+      const generation = response.headers.get('X-GCS-Generation');
+      if (generation) {
+        this._generations.set(localPath, generation);
+      }
+      return response.text().then((text) => {
+        return {
+          type: "file",
+          path: localPath,
+          name: localPath,
+          format: "text",
+          content: text,
+          created: "",
+          writable: true,
+          last_modified: response.headers.get('X-GCS-Last-Modified') || "",
+          mimetype: response.headers.get('Content-Type') || ""
+        } as Contents.IModel;
+      });
+    });
+  }
+
   /**
     * Get an encoded download url given a file path.
     *
@@ -139,6 +208,95 @@ export class GCSDrive implements Contents.IDrive {
     return Promise.resolve(GCS_LINK_PREFIX + localPath);
   }
 
+  /**
+    * Wait for a background job started by a delete, move or copy.
+    *
+    * @param job - The job returned by the server, if any.
+    *
+    * @returns A promise which resolves when the job succeeds, right away
+    *   when there is no job, and rejects with its error otherwise.
+    */
+  private _waitForJob(job?: any): Promise<void> {
+    if (!job) {
+      return Promise.resolve(void 0);
+    }
+    let serverSettings = ServerConnection.makeSettings();
+    const requestUrl = URLExt.join(
+      serverSettings.baseUrl, 'gcp/v1/gcs/jobs', job.id);
+    const poll = (): Promise<void> => {
+      return ServerConnection.makeRequest(requestUrl, {}, serverSettings
+      ).then((response) => response.json()
+      ).then((content) => {
+        if (content.error) {
+          console.error(content.error);
+          throw content.error;
+        }
+        const state = content.job.state;
+        if (state === 'succeeded') {
+          return;
+        }
+        if (state === 'failed' || state === 'cancelled') {
+          throw {message: content.job.error || 'Error: The job was ' + state};
+        }
+        return new Promise<void>((resolve) => {
+          setTimeout(resolve, JOB_POLL_INTERVAL);
+        }).then(poll);
+      });
+    };
+    return poll();
+  }
+
+  /**
+    * Get notebook outputs that were replaced by placeholders.
+    *
+    * @param localPath - The path of the notebook.
+    *
+    * @param cell - The index of the cell.
+    *
+    * @param output - The index of the output. All outputs of the cell are
+    *   returned when it is omitted.
+    *
+    * @param generation - The notebook generation from the placeholder. The
+    *   request fails if the notebook has changed since.
+    *
+    * @returns A promise which resolves with a list of outputs.
+    */
+  getOutputs(localPath: string, cell: number, output?: number,
+             generation?: string): Promise<any[]> {
+    let serverSettings = ServerConnection.makeSettings();
+    let query = '?cell=' + cell;
+    if (output !== undefined) {
+      query += '&output=' + output;
+    }
+    if (generation !== undefined) {
+      query += '&generation=' + encodeURIComponent(generation);
+    }
+    const requestUrl = URLExt.join(
+      serverSettings.baseUrl, 'gcp/v1/gcs/output', localPath) + query;
+    return ServerConnection.makeRequest(requestUrl, {}, serverSettings
+    ).then((response) => response.json()
+    ).then((content) => {
+      if (content.error) {
+        console.error(content.error);
+        throw content.error;
+      }
+      return content.outputs || [content.output];
+    });
+  }
+
+  /**
+    * Get the url of a streamed zip archive of a directory.
+    *
+    * @param localPath - The path of the directory.
+    *
+    * @returns A promise which resolves with the archive url.
+    */
+  getArchiveUrl(localPath: string): Promise<string> {
+    let serverSettings = ServerConnection.makeSettings();
+    return Promise.resolve(URLExt.join(
+      serverSettings.baseUrl, 'gcp/v1/gcs/archive', localPath) + '?format=zip');
+  }
+
   /**
     * Create a new untitled file or directory in the specified directory path.
     *
@@ -199,16 +357,12 @@ export class GCSDrive implements Contents.IDrive {
             resolve(directory);
           }
           else if (content.type == "file") {
-            let decoded_content = Buffer.from(
-              content.content.content.replace(/\n/g, ""),
-              'base64').toString('utf8')
-
             resolve({
               type: "file",
               path: content.content.path,
               name: content.content.name,
-              format: "text",
-              content: decoded_content,
+              format: content.content.format,
+              content: content.content.content,
               created: "",
               writable: true,
               last_modified: "",
@@ -244,7 +398,11 @@ export class GCSDrive implements Contents.IDrive {
             reject(content.error);
             return;
           }
-          resolve(void 0);
+          // Directories are deleted by a background job.
+          this._waitForJob(content.job).then(() => {
+            this._generations.delete(localPath);
+            resolve(void 0);
+          }, reject);
         });
       })
     });
@@ -310,28 +468,29 @@ export class GCSDrive implements Contents.IDrive {
             }
           }
           else if (content.type == "file") {
-            let decoded_content = Buffer.from(
-              content.content.content.replace(/\n/g, ""),
-              'base64').toString('utf8')
-
             data = {
               type: "file",
               path: content.content.path,
               name: content.content.name,
-              format: "text",
-              content: decoded_content,
+              format: content.content.format,
+              content: content.content.content,
               created: "",
               writable: true,
               last_modified: "",
               mimetype: content.content.mimetype
             }
           }
-          resolve(data);
-          this._fileChanged.emit({
-            type: 'rename',
-            oldValue: {path: oldLocalPath},
-            newValue: data
-          });
+          // Directories are moved by a background job.
+          this._waitForJob(content.job).then(() => {
+            this._generations.delete(oldLocalPath);
+            this._generations.delete(newLocalPath);
+            resolve(data);
+            this._fileChanged.emit({
+              type: 'rename',
+              oldValue: {path: oldLocalPath},
+              newValue: data
+            });
+          }, reject);
         })
       });
     });
@@ -353,8 +512,15 @@ export class GCSDrive implements Contents.IDrive {
       let serverSettings = ServerConnection.makeSettings();
       const requestUrl = URLExt.join(
         serverSettings.baseUrl, 'gcp/v1/gcs/upload', localPath);
+      let body: any = options;
+      if (this._generations.has(localPath)) {
+        body = {
+          ...options,
+          expected_generation: this._generations.get(localPath),
+        };
+      }
       const requestInit: RequestInit = {
-        body: JSON.stringify(options),
+        body: JSON.stringify(body),
         method: "POST",
       };
       ServerConnection.makeRequest(requestUrl, requestInit, serverSettings
@@ -365,6 +531,9 @@ export class GCSDrive implements Contents.IDrive {
             reject(content.error);
             return;
           }
+          if (content.generation) {
+            this._generations.set(localPath, content.generation);
+          }
           const data = {
             type: options.type,
             path: options.path,
@@ -373,7 +542,7 @@ export class GCSDrive implements Contents.IDrive {
             content: options.content,
             created: options.created,
             writable: true,
-            last_modified: options.last_modified,
+            last_modified: content.last_modified || options.last_modified,
             mimetype: options.mimetype
           };
           this._fileChanged.emit({
@@ -419,17 +588,67 @@ export class GCSDrive implements Contents.IDrive {
             reject(content.error);
             return;
           }
-          resolve({
-            type: "file",
-            path: content.path,
-            name: content.path,
-            format: "text",
-            content: null,
-            created: "",
-            writable: true,
-            last_modified: "",
-            mimetype: null
-          });
+          // Directories are copied by a background job.
+          this._waitForJob(content.job).then(() => {
+            resolve({
+              type: content.type || "file",
+              path: content.path,
+              name: content.path,
+              format: "text",
+              content: null,
+              created: "",
+              writable: true,
+              last_modified: "",
+              mimetype: null
+            });
+          }, reject);
+        })
+      });
+    });
+  }
+
+  /**
+    * Run several delete, move and copy operations in a single request.
+    *
+    * @param operations - The operations to run. Each one takes the same
+    *   fields as the matching single-item request, plus an `action`.
+    *
+    * @returns A promise which resolves with the result of each operation,
+    *   in the same order as `operations`, once any background jobs for
+    *   directories have finished.
+    */
+  bulk(operations: GCSDrive.IBulkOperation[]): Promise<GCSDrive.IBulkResult[]> {
+    return new Promise((resolve, reject) => {
+      // TODO(cbwilkes): Move to a services library.
+      let serverSettings = ServerConnection.makeSettings();
+      const requestUrl = URLExt.join(
+        serverSettings.baseUrl, 'gcp/v1/gcs/bulk');
+      const body = {
+        'operations': operations,
+      }
+      const requestInit: RequestInit = {
+        body: JSON.stringify(body),
+        method: "POST",
+      };
+      ServerConnection.makeRequest(requestUrl, requestInit, serverSettings
+      ).then((response) => {
+        response.json().then((content) => {
+          if (content.error) {
+            console.error(content.error);
+            reject(content.error);
+            return;
+          }
+          // Directories are handled by background jobs, which are waited
+          // for like those of single-item requests.
+          resolve(Promise.all(content.results.map(
+              (result: GCSDrive.IBulkResult) => {
+            return this._waitForJob(result.job).then(() => result,
+                (error: any) => ({
+                  ...result,
+                  status: 'error',
+                  error: {message: (error && error.message) || String(error)}
+                } as GCSDrive.IBulkResult));
+          })));
         })
       });
     });
@@ -583,3 +802,29 @@ export class GCSDrive implements Contents.IDrive {
     });
   }
 }
+
+/**
+ * A namespace for GCSDrive statics.
+ */
+export namespace GCSDrive {
+  /**
+   * One operation of a bulk request.
+   */
+  export interface IBulkOperation {
+    action: 'delete' | 'move' | 'copy';
+    localPath?: string;
+    oldLocalPath?: string;
+    newLocalPath?: string;
+    toLocalDir?: string;
+  }
+
+  /**
+   * The result of one operation of a bulk request.
+   */
+  export interface IBulkResult extends IBulkOperation {
+    status: 'ok' | 'error';
+    path?: string;
+    error?: {message: string};
+    job?: any;
+  }
+}
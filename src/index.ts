@@ -15,6 +15,8 @@ import {IStatusBar} from '@jupyterlab/statusbar';
 
 import {IFileBrowserFactory} from "@jupyterlab/filebrowser";
 
+import {INotebookTracker} from '@jupyterlab/notebook';
+
 import {
   Clipboard,
   MainAreaWidget,
@@ -44,6 +46,8 @@ import {stylesheet} from 'typestyle';
 
 const NAMESPACE = 'gcsfilebrowser';
 const GCS_URI_PREFIX = 'gs://';
+// Output metadata key of a placeholder for an output that was not loaded.
+const LAZY_OUTPUT_KEY = 'gcsfilebrowser_lazy_output';
 
 const localStyles = stylesheet({
   header: {
@@ -83,7 +87,8 @@ async function activateGCSFileBrowser(
   manager: IDocumentManager,
   factory_browser: IFileBrowserFactory,
   factory: IGCSFileBrowserFactory,
-  restorer: ILayoutRestorer
+  restorer: ILayoutRestorer,
+  notebooks: INotebookTracker | null
 ) {
   const drive = new GCSDrive();
   manager.services.contents.addDrive(drive);
@@ -108,6 +113,9 @@ async function activateGCSFileBrowser(
   app.shell.add(mybrowser, 'left', {rank: 100});
 
   addCommands(app, factory);
+  if (notebooks) {
+    addOutputCommands(app, drive, notebooks);
+  }
 }
 
 /**
@@ -159,6 +167,7 @@ namespace CommandIDs {
   export const open = 'gcsfilebrowser:open';
   export const download = 'gcsfilebrowser:download';
   export const createNewDirectory = 'gcsfilebrowser:create-new-directory';
+  export const loadOutputs = 'gcsfilebrowser:load-outputs';
 }
 
 
@@ -393,6 +402,60 @@ function addCommands(
 
 }
 
+/**
+ * Add the command that loads the outputs of notebook cells that were left
+ * out when the notebook was opened.
+ */
+function addOutputCommands(
+  app: JupyterFrontEnd,
+  drive: GCSDrive,
+  notebooks: INotebookTracker
+) {
+  const {commands} = app;
+
+  commands.addCommand(CommandIDs.loadOutputs, {
+    execute: () => {
+      const panel = notebooks.currentWidget;
+      if (!panel) {
+        return;
+      }
+
+      const notebook = panel.content;
+      const loads: Promise<void>[] = [];
+      notebook.widgets.forEach(cell => {
+        if (cell.model.type !== 'code' || !notebook.isSelectedOrActive(cell)) {
+          return;
+        }
+        const outputs = (cell.model as any).outputs;
+        for (let i = 0; i < outputs.length; i++) {
+          const reference = outputs.get(i).metadata[LAZY_OUTPUT_KEY] as any;
+          if (!reference) {
+            continue;
+          }
+          loads.push(drive.getOutputs(
+            reference.path, reference.cell, reference.output,
+            String(reference.generation)
+          ).then(([output]) => {
+            outputs.set(i, output);
+          }));
+        }
+      });
+      return Promise.all(loads);
+    },
+    isEnabled: () => {
+      const panel = notebooks.currentWidget;
+      return !!panel && panel.context.path.indexOf(drive.name + ':') === 0;
+    },
+    label: 'Load Unloaded Outputs'
+  });
+
+  app.contextMenu.addItem({
+    command: CommandIDs.loadOutputs,
+    selector: '.jp-Notebook .jp-Cell',
+    rank: 20
+  });
+}
+
 /**
  * The JupyterLab plugin for the GCS Filebrowser.
  */
@@ -404,6 +467,7 @@ const GCSFileBrowserPlugin: JupyterFrontEndPlugin<void> = {
     IGCSFileBrowserFactory,
     ILayoutRestorer
   ],
+  optional: [INotebookTracker],
   activate: activateGCSFileBrowser,
   autoStart: true
 };
@@ -45,6 +45,8 @@ import {ISignal, Signal} from '@phosphor/signaling';
 
 import {Widget} from '@phosphor/widgets';
 
+import {GCSDrive} from '../contents';
+
 import {GCSFileBrowserModel} from './model';
 
 /**
@@ -339,18 +341,45 @@ export class DirListing extends Widget {
     }
 
     const basePath = this._model.path;
-    let promises: Promise<Contents.IModel>[] = [];
-
-    each(this._clipboard, path => {
-      if (this._isCut) {
-        const parts = path.split('/').filter(x => x != "");
-        const name = parts[parts.length - 1];
-        const newPath = PathExt.join(basePath, name);
-        promises.push(this._model.manager.rename(path, newPath));
-      } else {
-        promises.push(this._model.manager.copy(path, basePath));
-      }
-    });
+    let promises: Promise<any>[] = [];
+
+    if (this._clipboard.length > 1) {
+      // Send multi-item pastes to the server as a single bulk request.
+      const operations = this._clipboard.map(path => {
+        if (this._isCut) {
+          const parts = path.split('/').filter(x => x != "");
+          const name = parts[parts.length - 1];
+          return {
+            action: 'move',
+            oldLocalPath: path,
+            newLocalPath: PathExt.join(basePath, name)
+          } as GCSDrive.IBulkOperation;
+        }
+        return {
+          action: 'copy',
+          localPath: path,
+          toLocalDir: basePath
+        } as GCSDrive.IBulkOperation;
+      });
+      promises.push(
+        this._model.bulk(operations).then(failed => {
+          if (failed.length) {
+            throw failed[0].error.message;
+          }
+        })
+      );
+    } else {
+      each(this._clipboard, path => {
+        if (this._isCut) {
+          const parts = path.split('/').filter(x => x != "");
+          const name = parts[parts.length - 1];
+          const newPath = PathExt.join(basePath, name);
+          promises.push(this._model.manager.rename(path, newPath));
+        } else {
+          promises.push(this._model.manager.copy(path, basePath));
+        }
+      });
+    }
 
     // Remove any cut modifiers.
     each(this._items, item => {
@@ -426,9 +455,11 @@ export class DirListing extends Widget {
    */
   async download(): Promise<void> {
     await Promise.all(
-      toArray(this.selectedItems())
-        .filter(item => item.type !== 'directory')
-        .map(item => this._model.download(item.path))
+      toArray(this.selectedItems()).map(item =>
+        item.type === 'directory'
+          ? this._model.downloadDirectory(item.path)
+          : this._model.download(item.path)
+      )
     );
   }
 
@@ -1362,6 +1393,21 @@ export class DirListing extends Widget {
    * Delete the files with the given paths.
    */
   private async _delete(paths: string[]): Promise<void> {
+    if (paths.length > 1) {
+      // Send multi-item deletes to the server as a single bulk request.
+      const operations = paths.map(
+        path => ({action: 'delete', localPath: path} as GCSDrive.IBulkOperation)
+      );
+      try {
+        const failed = await this._model.bulk(operations);
+        each(failed, result => {
+          void showErrorMessage('Delete Failed', result.error.message);
+        });
+      } catch (err) {
+        void showErrorMessage('Delete Failed', err);
+      }
+      return;
+    }
     await Promise.all(
       paths.map(path =>
         this._model.manager.deleteFile(path).catch(err => {
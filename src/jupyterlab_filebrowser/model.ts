@@ -27,7 +27,7 @@ import {
   filter
 } from '@phosphor/algorithm';
 
-import {PromiseDelegate, ReadonlyJSONObject} from '@phosphor/coreutils';
+import {PromiseDelegate, ReadonlyJSONObject, UUID} from '@phosphor/coreutils';
 
 import {IDisposable} from '@phosphor/disposable';
 
@@ -50,6 +50,21 @@ export const LARGE_FILE_SIZE = 15 * 1024 * 1024;
  */
 export const CHUNK_SIZE = 1024 * 1024;
 
+/**
+ * Files bigger than this (in bytes) are uploaded as slices sent in parallel.
+ */
+export const PARALLEL_UPLOAD_SIZE = 16 * 1024 * 1024;
+
+/**
+ * The size (in bytes) of the slices of a parallel upload.
+ */
+export const SLICE_SIZE = 4 * 1024 * 1024;
+
+/**
+ * The maximum number of upload requests in flight, shared by all uploads.
+ */
+export const MAX_CONCURRENT_UPLOADS = 6;
+
 /**
  * An upload progress event for a file at `path`.
  */
@@ -365,6 +380,35 @@ export class GCSFileBrowserModel implements IDisposable {
     this._additionalDrives.set(drive.name, drive);
   }
 
+  /**
+   * Run several file operations on the GCS drive in a single request.
+   *
+   * @param operations - The operations to run, using global paths.
+   *
+   * @returns A promise which resolves with the operations that failed, once
+   *   the model has been refreshed.
+   */
+  async bulk(
+    operations: GCSDrive.IBulkOperation[]
+  ): Promise<GCSDrive.IBulkResult[]> {
+    const contents = this.manager.services.contents;
+    const drive = this._additionalDrives.values().next().value as GCSDrive;
+    const localPath = (path: string) =>
+      path === undefined ? undefined : contents.localPath(path);
+
+    const results = await drive.bulk(
+      operations.map(op => ({
+        action: op.action,
+        localPath: localPath(op.localPath),
+        oldLocalPath: localPath(op.oldLocalPath),
+        newLocalPath: localPath(op.newLocalPath),
+        toLocalDir: localPath(op.toLocalDir)
+      }))
+    );
+    await this.refresh();
+    return results.filter(result => result.status === 'error');
+  }
+
   private _additionalDrives = new Map<string, Contents.IDrive>();
 
   /**
@@ -391,6 +435,25 @@ export class GCSFileBrowserModel implements IDisposable {
    */
   async download(path: string): Promise<void> {
     const url = await this.manager.services.contents.getDownloadUrl(path);
+    this._openDownload(url);
+  }
+
+  /**
+   * Download a directory as a zip archive.
+   *
+   * @param path - The path of the directory to be downloaded.
+   *
+   * @returns A promise which resolves when the archive has begun
+   *   downloading.
+   */
+  async downloadDirectory(path: string): Promise<void> {
+    const contents = this.manager.services.contents;
+    const drive = this._additionalDrives.values().next().value as GCSDrive;
+    const url = await drive.getArchiveUrl(contents.localPath(path));
+    this._openDownload(url);
+  }
+
+  private _openDownload(url: string): void {
     let element = document.createElement('a');
     element.href = url;
     element.download = '';
@@ -398,7 +461,6 @@ export class GCSFileBrowserModel implements IDisposable {
     document.body.appendChild(element);
     element.click();
     document.body.removeChild(element);
-    return void 0;
   }
 
   /**
@@ -517,32 +579,30 @@ export class GCSFileBrowserModel implements IDisposable {
     let type: Contents.ContentType = 'file';
     let format: Contents.FileFormat = 'base64';
 
-    const uploadInner = async (
-      blob: Blob,
-      chunk?: number
-    ): Promise<Contents.IModel> => {
-      await this._uploadCheckDisposed();
-      let reader = new FileReader();
-      reader.readAsDataURL(blob);
-      await new Promise((resolve, reject) => {
-        reader.onload = resolve;
-        reader.onerror = event =>
-          reject(`Failed to upload "${file.name}":` + event);
+    const uploadInner: Private.UploadFunction = (blob, options = {}) =>
+      this._uploadLimiter.run(async () => {
+        await this._uploadCheckDisposed();
+        let reader = new FileReader();
+        reader.readAsDataURL(blob);
+        await new Promise((resolve, reject) => {
+          reader.onload = resolve;
+          reader.onerror = event =>
+            reject(`Failed to upload "${file.name}":` + event);
+        });
+        await this._uploadCheckDisposed();
+
+        // remove header https://stackoverflow.com/a/24289420/907060
+        const content = (reader.result as string).split(',')[1];
+
+        let model = {
+          type,
+          format,
+          name,
+          content,
+          ...options
+        } as Partial<Contents.IModel>;
+        return await this.manager.services.contents.save(path, model);
       });
-      await this._uploadCheckDisposed();
-
-      // remove header https://stackoverflow.com/a/24289420/907060
-      const content = (reader.result as string).split(',')[1];
-
-      let model: Partial<Contents.IModel> = {
-        type,
-        format,
-        name,
-        chunk,
-        content
-      };
-      return await this.manager.services.contents.save(path, model);
-    };
 
     if (!chunked) {
       try {
@@ -564,12 +624,8 @@ export class GCSFileBrowserModel implements IDisposable {
       oldValue: null
     });
 
-    for (let start = 0; !finalModel; start += CHUNK_SIZE) {
-      const end = start + CHUNK_SIZE;
-      const lastChunk = end >= file.size;
-      const chunk = lastChunk ? -1 : end / CHUNK_SIZE;
-
-      const newUpload = {path, progress: start / file.size};
+    const setProgress = (progress: number) => {
+      const newUpload = {path, progress};
       this._uploads.splice(this._uploads.indexOf(upload));
       this._uploads.push(newUpload);
       this._uploadChanged.emit({
@@ -578,27 +634,25 @@ export class GCSFileBrowserModel implements IDisposable {
         oldValue: upload
       });
       upload = newUpload;
+    };
 
-      let currentModel: Contents.IModel;
-      try {
-        currentModel = await uploadInner(file.slice(start, end), chunk);
-      } catch (err) {
-        ArrayExt.removeFirstWhere(this._uploads, uploadIndex => {
-          return file.name === uploadIndex.path;
-        });
-
-        this._uploadChanged.emit({
-          name: 'failure',
-          newValue: upload,
-          oldValue: null
-        });
+    try {
+      finalModel =
+        file.size > PARALLEL_UPLOAD_SIZE
+          ? await this._uploadSlices(file, uploadInner, setProgress)
+          : await this._uploadChunks(file, uploadInner, setProgress);
+    } catch (err) {
+      ArrayExt.removeFirstWhere(this._uploads, uploadIndex => {
+        return file.name === uploadIndex.path;
+      });
 
-        throw err;
-      }
+      this._uploadChanged.emit({
+        name: 'failure',
+        newValue: upload,
+        oldValue: null
+      });
 
-      if (lastChunk) {
-        finalModel = currentModel;
-      }
+      throw err;
     }
 
     this._uploads.splice(this._uploads.indexOf(upload));
@@ -611,6 +665,77 @@ export class GCSFileBrowserModel implements IDisposable {
     return finalModel;
   }
 
+  /**
+   * Upload a file one chunk at a time, appending each chunk to the last.
+   */
+  private async _uploadChunks(
+    file: File,
+    uploadInner: Private.UploadFunction,
+    setProgress: (progress: number) => void
+  ): Promise<Contents.IModel> {
+    let finalModel: Contents.IModel;
+    for (let start = 0; !finalModel; start += CHUNK_SIZE) {
+      const end = start + CHUNK_SIZE;
+      const lastChunk = end >= file.size;
+      const chunk = lastChunk ? -1 : end / CHUNK_SIZE;
+
+      setProgress(start / file.size);
+      const currentModel = await uploadInner(file.slice(start, end), {chunk});
+      if (lastChunk) {
+        finalModel = currentModel;
+      }
+    }
+    return finalModel;
+  }
+
+  /**
+   * Upload the slices of a file in parallel as separate parts, then have the
+   * server compose the parts into the file.
+   *
+   * #### Notes
+   * If any slice fails, the server is asked to delete the uploaded parts once
+   * every slice request has settled.
+   */
+  private async _uploadSlices(
+    file: File,
+    uploadInner: Private.UploadFunction,
+    setProgress: (progress: number) => void
+  ): Promise<Contents.IModel> {
+    const uploadId = UUID.uuid4();
+    const parts = Math.ceil(file.size / SLICE_SIZE);
+    let uploaded = 0;
+    let error: any = null;
+
+    const uploadPart = async (part: number) => {
+      if (error) {
+        return;
+      }
+      const start = (part - 1) * SLICE_SIZE;
+      const slice = file.slice(start, start + SLICE_SIZE);
+      await uploadInner(slice, {upload_id: uploadId, part});
+      uploaded += slice.size;
+      setProgress(uploaded / file.size);
+    };
+
+    let pending: Promise<void>[] = [];
+    for (let part = 1; part <= parts; part++) {
+      pending.push(
+        uploadPart(part).catch(err => {
+          error = error || err;
+        })
+      );
+    }
+    await Promise.all(pending);
+
+    if (error) {
+      await uploadInner(new Blob(), {upload_id: uploadId, abort: true}).catch(
+        err => console.error(err)
+      );
+      throw error;
+    }
+    return await uploadInner(new Blob(), {upload_id: uploadId, parts});
+  }
+
   private _uploadCheckDisposed(): Promise<void> {
     if (this.isDisposed) {
       return Promise.reject('Filemanager disposed. File upload canceled');
@@ -706,6 +831,7 @@ export class GCSFileBrowserModel implements IDisposable {
   private _isDisposed = false;
   private _restored = new PromiseDelegate<void>();
   private _uploads: IUploadModel[] = [];
+  private _uploadLimiter = new Private.Limiter(MAX_CONCURRENT_UPLOADS);
   private _uploadChanged = new Signal<this, IChangedArgs<IUploadModel>>(this);
   private _unloadEventListener: (e: Event) => string;
   private _poll: Poll;
@@ -809,4 +935,47 @@ namespace Private {
     const resolved = PathExt.resolve(localPath, path);
     return driveName ? `${driveName}:${resolved}` : resolved;
   }
+
+  /**
+   * Upload a blob of a file, with extra fields for the upload request.
+   */
+  export type UploadFunction = (
+    blob: Blob,
+    options?: {[key: string]: any}
+  ) => Promise<Contents.IModel>;
+
+  /**
+   * Runs async functions with a bound on how many run at once.
+   */
+  export class Limiter {
+    constructor(limit: number) {
+      this._limit = limit;
+    }
+
+    /**
+     * Run a function once fewer than `limit` others are running.
+     */
+    async run<T>(fn: () => Promise<T>): Promise<T> {
+      if (this._active < this._limit) {
+        this._active++;
+      } else {
+        // The slot is handed over by the function that finishes.
+        await new Promise<void>(resolve => this._waiting.push(resolve));
+      }
+      try {
+        return await fn();
+      } finally {
+        const next = this._waiting.shift();
+        if (next) {
+          next();
+        } else {
+          this._active--;
+        }
+      }
+    }
+
+    private _limit: number;
+    private _active = 0;
+    private _waiting: Array<() => void> = [];
+  }
 }